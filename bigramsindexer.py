@@ -1,53 +1,31 @@
 from indexer import Indexer
-from bs4 import BeautifulSoup
-from nltk.tokenize import word_tokenize
-from tokenizer import tokenize, compute_word_frequencies
+from tokenizer import compute_word_frequencies, lemma_cache
 from nltk import bigrams
 from collections import Counter
 import timeit
-import sys
+import argparse
 import json
 
 
 class BigramsIndexer(Indexer):
-    def first_pass(self):
-        for folder_num in range(0, 75):
-            for file_num in range(0, 500):
-                full_path = "/".join([self.base_url, str(folder_num), str(file_num)])
-                content = ""
-                with open(full_path, "r", encoding="utf-8") as f:
-                    content = f.read()
-                soup = BeautifulSoup(content, "html.parser")
-                words = word_tokenize(soup.get_text(separator=" "))
-                tokens = tokenize(words)
-                word_frequencies = compute_word_frequencies(bigrams(tokens))
-                weighted_words = self.extract_weighted_tags(soup)
-                raw_tfs = dict(Counter(word_frequencies) + Counter(weighted_words))
-                if not tokens:
-                    continue
-                key1 = tokens[0]
-                for i in range(1, len(tokens)):
-                    key2 = tokens[i]
-                    key = f"{key1} {key2}"
-                    doc_key = str(folder_num) + "/" + str(file_num)
-                    wf_key = (key1, key2)
-                    raw_tf = raw_tfs[wf_key]
-                    pair = [doc_key, raw_tf, 0]
-                    if key not in self.index:
-                        self.index[key] = [pair]
-                    else:
-                        if self.index[key][-1][0] != doc_key:
-                            self.index[key].append(pair)
-                    key1 = key2
-                print("Folder", folder_num, "File", file_num)
+    def index_tokens(self, doc_id, tokens, tag_tokens):
+        word_frequencies = compute_word_frequencies(bigrams(tokens))
+        weighted_words = self.extract_weighted_tags(tag_tokens)
+        raw_tfs = dict(Counter(word_frequencies) + Counter(weighted_words))
+        if not tokens:
+            return
+        key1 = tokens[0]
+        for i in range(1, len(tokens)):
+            key2 = tokens[i]
+            key = f"{key1} {key2}"
+            wf_key = (key1, key2)
+            self.add_posting(key, doc_id, raw_tfs[wf_key])
+            key1 = key2
 
-    def extract_weighted_tags(self, soup):
+    def extract_weighted_tags(self, tag_tokens):
         weighted_tag_words = {}
         for tag in self.tags:
-            words = []
-            for i in soup.find_all(tag):
-                words += word_tokenize(i.text.strip())
-            for word in bigrams(tokenize(words)):
+            for word in bigrams(tag_tokens[tag]):
                 if word not in weighted_tag_words:
                     weighted_tag_words[word] = self.tags[tag]
                 else:
@@ -56,13 +34,50 @@ class BigramsIndexer(Indexer):
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("base_url")
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="write the legacy index2.json/lengths2.json files instead of index2.bin",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes the folders are indexed with",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        help="flush sorted blocks to disk whenever the in-memory index grows past this many megabytes",
+    )
+    parser.add_argument(
+        "--tier-size",
+        type=int,
+        help="split postings lists longer than this into a high and a low impact tier",
+    )
+    parser.add_argument(
+        "--lemma-cache",
+        help="file the (word, pos) -> lemma memo is loaded from and saved to, so later runs start warm",
+    )
+    args = parser.parse_args()
     start = timeit.default_timer()
-    base_url = sys.argv[1]
-    indexer = BigramsIndexer(base_url)
+    if args.lemma_cache:
+        lemma_cache.load(args.lemma_cache)
+    memory_budget = args.memory_budget * 2**20 if args.memory_budget else None
+    indexer = BigramsIndexer(
+        args.base_url, workers=args.workers, memory_budget=memory_budget
+    )
     indexer.create_index()
-    with open("index2.json", "a") as f:
-        json.dump(indexer.get_index(), f, indent=4)
-    with open("lengths2.json", "a") as f:
-        json.dump(indexer.get_lengths(), f, indent=4)
+    if args.json:
+        indexer.save_json("index2.json")
+        with open("lengths2.json", "a") as f:
+            json.dump(indexer.get_lengths(), f, indent=4)
+    else:
+        indexer.save_binary("index2.bin", args.tier_size)
+    indexer.close()
+    if args.lemma_cache:
+        lemma_cache.save(args.lemma_cache)
     stop = timeit.default_timer()
     print("Time: ", stop - start, "seconds")
@@ -0,0 +1,566 @@
+import math
+import mmap
+import os
+import struct
+from array import array
+from collections import namedtuple
+from functools import cached_property
+
+# File layout (all integers little endian):
+#
+#   header    MAGIC, num_documents, num_docs, num_terms, flags and the offsets
+#             of the sections below
+#   postings  per term: the high tier, i.e. high_df float32 weights, then
+#             varint doc id gaps, then varint raw term frequencies. A high
+#             tier longer than SKIP_INTERVAL postings is followed by 4 byte
+#             aligned block headers: the uint32 last doc id of every block of
+#             SKIP_INTERVAL postings, then the uint32 offset of the first gap
+#             of every block from the first gap of the tier, so a block can be
+#             found and decoded without decoding the ones before it. Terms
+#             written with a tier size keep only their tier_size highest
+#             impact postings there; the rest go to a 4 byte aligned low tier
+#             of df - high_df uint32 doc ids, float32 weights and varint raw
+#             term frequencies, which can be binary searched in place.
+#             Both tiers are ordered by document. Indexes written with
+#             positions (flags & POSITIONS) follow them with the token
+#             positions of the term in each of its documents, in document
+#             order across both tiers: the byte size of the entry, then the
+#             varint gaps between the positions, so documents can be skipped
+#   terms     num_terms fixed size entries sorted by term
+#             (postings offset, term blob offset, term length, df,
+#             max impact, high_df, low tier offset, low tier max impact,
+#             positions offset, block headers offset)
+#             where an impact is the tf_idf / length of a posting
+#   term blob utf-8 bytes of every term, concatenated in sorted order
+#   docs      (num_docs + 1) uint64 offsets into the doc blob, then the blob of
+#             utf-8 doc keys; a doc id is the position in this table
+#   lengths   num_docs float32 document lengths, NaN if a doc has no length,
+#             aligned to 4 bytes
+MAGIC = b"SEIDX005"
+HEADER = struct.Struct("<8sIIIIQQQQQ")
+TERM_ENTRY = struct.Struct("<QQIIfIQfQQ")
+# Header flags
+POSITIONS = 1
+# Postings per block of the high tier
+SKIP_INTERVAL = 128
+
+TermEntry = namedtuple(
+    "TermEntry",
+    [
+        "offset",
+        "df",
+        "max_impact",
+        "high_df",
+        "low_offset",
+        "low_max_impact",
+        "positions_offset",
+        "skips_offset",
+    ],
+)
+
+
+def encode_varint(value, out):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varints(buffer, pos, count):
+    values = []
+    for _ in range(count):
+        shift = 0
+        value = 0
+        while True:
+            byte = buffer[pos]
+            pos += 1
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        values.append(value)
+    return values, pos
+
+
+def decode_positions(buffer, pos, end):
+    """Decodes the varint position gaps stored between pos and end back into positions"""
+    positions = []
+    position = 0
+    while pos < end:
+        shift = 0
+        while True:
+            byte = buffer[pos]
+            pos += 1
+            position += (byte & 0x7F) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        positions.append(position)
+    return positions
+
+
+class BinaryIndexWriter:
+    """
+    Streams an inverted index into the binary format read by BinaryIndex. Terms have to be added in sorted order and
+    every postings list has to be ordered by document, as the doc ids are stored as gaps. doc_keys and lengths are
+    indexed by doc id, with NaN as the length of documents without postings
+    """
+
+    def __init__(
+        self, path, doc_keys, lengths, num_documents, tier_size=None, positions=False
+    ):
+        self.path = path
+        self.doc_keys = doc_keys
+        self.lengths = lengths
+        self.num_documents = num_documents
+        self.tier_size = tier_size
+        self.positions = positions
+        self.num_terms = 0
+        self.last_term = None
+        self.term_entries = bytearray()
+        self.term_blob = bytearray()
+        self.file = open(path + ".tmp", "wb")
+        self.file.write(bytes(HEADER.size))
+        self.offset = HEADER.size
+
+    def add(self, term, postings):
+        """
+        Appends the postings of a term. Each posting is a [doc_id, raw_tf, tf_idf] triple as built by the Indexer,
+        followed by the token positions of the term in the document when the index is written with positions
+        """
+        if self.last_term is not None and term <= self.last_term:
+            raise ValueError(f"Terms must be added in sorted order: {term!r}")
+        self.last_term = term
+
+        impacts = [
+            (posting[0], posting[1], posting[2], self.impact(posting))
+            for posting in postings
+        ]
+        if self.tier_size is None or len(impacts) <= self.tier_size:
+            high, low = impacts, []
+        else:
+            by_impact = sorted(impacts, key=lambda posting: posting[3], reverse=True)
+            high = sorted(by_impact[: self.tier_size])
+            low = sorted(by_impact[self.tier_size :])
+
+        offset = self.offset
+        weights = array("f", [posting[2] for posting in high])
+        encoded = bytearray()
+        previous = 0
+        block_offsets = array("I")
+        for i in range(0, len(high), SKIP_INTERVAL):
+            block_offsets.append(len(encoded))
+            for posting in high[i : i + SKIP_INTERVAL]:
+                encode_varint(posting[0] - previous, encoded)
+                previous = posting[0]
+        for posting in high:
+            encode_varint(posting[1], encoded)
+        self.write(weights.tobytes())
+        self.write(encoded)
+
+        skips_offset = 0
+        if len(high) > SKIP_INTERVAL:
+            last_doc_ids = array(
+                "I",
+                [
+                    high[min(i + SKIP_INTERVAL, len(high)) - 1][0]
+                    for i in range(0, len(high), SKIP_INTERVAL)
+                ],
+            )
+            self.write(bytes(-self.offset % 4))
+            skips_offset = self.offset
+            self.write(last_doc_ids.tobytes())
+            self.write(block_offsets.tobytes())
+
+        low_offset = 0
+        low_max_impact = 0.0
+        if low:
+            self.write(bytes(-self.offset % 4))
+            low_offset = self.offset
+            low_max_impact = max(posting[3] for posting in low)
+            encoded = bytearray()
+            for posting in low:
+                encode_varint(posting[1], encoded)
+            self.write(array("I", [posting[0] for posting in low]).tobytes())
+            self.write(array("f", [posting[2] for posting in low]).tobytes())
+            self.write(encoded)
+
+        positions_offset = 0
+        if self.positions:
+            positions_offset = self.write_positions(postings)
+
+        encoded_term = term.encode("utf-8")
+        self.term_entries += TERM_ENTRY.pack(
+            offset,
+            len(self.term_blob),
+            len(encoded_term),
+            len(postings),
+            max(posting[3] for posting in high),
+            len(high),
+            low_offset,
+            low_max_impact,
+            positions_offset,
+            skips_offset,
+        )
+        self.term_blob += encoded_term
+        self.num_terms += 1
+
+    def write(self, data):
+        self.file.write(data)
+        self.offset += len(data)
+
+    def write_positions(self, postings):
+        """Writes the positions of every posting, which are the fourth item of a posting, returning their offset"""
+        offset = self.offset
+        encoded = bytearray()
+        for posting in postings:
+            gaps = bytearray()
+            previous = 0
+            for position in posting[3]:
+                encode_varint(position - previous, gaps)
+                previous = position
+            encode_varint(len(gaps), encoded)
+            encoded += gaps
+        self.write(encoded)
+        return offset
+
+    def impact(self, posting):
+        length = self.lengths[posting[0]]
+        if not length or math.isnan(length):
+            return 0.0
+        return posting[2] / length
+
+    def close(self):
+        terms_offset = self.offset
+        term_blob_offset = terms_offset + len(self.term_entries)
+        docs_offset = term_blob_offset + len(self.term_blob)
+        self.file.write(self.term_entries)
+        self.file.write(self.term_blob)
+
+        doc_offsets = array("Q", [0])
+        doc_blob = bytearray()
+        for doc_key in self.doc_keys:
+            doc_blob += doc_key.encode("utf-8")
+            doc_offsets.append(len(doc_blob))
+        self.file.write(doc_offsets.tobytes())
+        self.file.write(doc_blob)
+        lengths_offset = (
+            docs_offset + len(doc_offsets) * doc_offsets.itemsize + len(doc_blob)
+        )
+        padding = -lengths_offset % 4
+        self.file.write(bytes(padding))
+        lengths_offset += padding
+
+        self.file.write(array("f", self.lengths).tobytes())
+
+        self.file.seek(0)
+        self.file.write(
+            HEADER.pack(
+                MAGIC,
+                self.num_documents,
+                len(self.doc_keys),
+                self.num_terms,
+                POSITIONS if self.positions else 0,
+                terms_offset,
+                term_blob_offset,
+                docs_offset,
+                lengths_offset,
+                HEADER.size,
+            )
+        )
+        self.file.close()
+        os.replace(self.path + ".tmp", self.path)
+
+
+class DocumentLengths:
+    """
+    Read-only mapping from doc key to document length backed by the lengths section of a BinaryIndex
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+    def __getitem__(self, doc_key):
+        length = self.index.length(self.index.doc_id(doc_key))
+        if math.isnan(length):
+            raise KeyError(doc_key)
+        return length
+
+    def __contains__(self, doc_key):
+        doc_id = self.index.doc_ids.get(doc_key)
+        return doc_id is not None and not math.isnan(self.index.length(doc_id))
+
+    def get(self, doc_key, default=None):
+        try:
+            return self[doc_key]
+        except KeyError:
+            return default
+
+
+class PositionsReader:
+    """
+    Reads the positions of a term one document at a time, in doc id order. The positions of the documents skipped on
+    the way are stepped over by their size without being decoded
+    """
+
+    def __init__(self, index, entry):
+        self.mm = index.mm
+        self.doc_ids = index.document_ids(entry)
+        self.i = 0
+        self.pos = entry.positions_offset
+        self.doc_id = None
+        self.positions = None
+
+    def seek(self, doc_id):
+        """Returns the sorted positions of the term in doc_id, a document holding it not before the last one read"""
+        mm = self.mm
+        pos = self.pos
+        while self.doc_id != doc_id:
+            shift = 0
+            size = 0
+            while True:
+                byte = mm[pos]
+                pos += 1
+                size |= (byte & 0x7F) << shift
+                if byte < 0x80:
+                    break
+                shift += 7
+            self.doc_id = self.doc_ids[self.i]
+            self.i += 1
+            if self.doc_id == doc_id:
+                self.positions = decode_positions(mm, pos, pos + size)
+            pos += size
+        self.pos = pos
+        return self.positions
+
+
+class BinaryIndex:
+    """
+    Memory-mapped reader for an index written by BinaryIndexWriter. Only the term dictionary lookup touches the file at
+    query time, the postings of a term are read and decoded when they are requested, so several processes opening the
+    same file share the page cache instead of holding their own copy of the index
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            magic,
+            self.num_documents,
+            self.num_docs,
+            self.num_terms,
+            flags,
+            self.terms_offset,
+            self.term_blob_offset,
+            self.docs_offset,
+            self.lengths_offset,
+            _,
+        ) = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a binary index")
+        self.has_positions = bool(flags & POSITIONS)
+
+        self.doc_blob_offset = self.docs_offset + (self.num_docs + 1) * 8
+        self.lengths_array = (
+            memoryview(self.mm)[
+                self.lengths_offset : self.lengths_offset + self.num_docs * 4
+            ].cast("f")
+        )
+        self.lengths = DocumentLengths(self)
+
+    def close(self):
+        self.lengths_array.release()
+        self.mm.close()
+
+    @cached_property
+    def doc_keys(self):
+        """The doc key of every doc id, only decoded when a caller needs all of them"""
+        doc_offsets = array("Q")
+        doc_offsets.frombytes(self.mm[self.docs_offset : self.doc_blob_offset])
+        doc_blob = self.mm[
+            self.doc_blob_offset : self.doc_blob_offset + doc_offsets[-1]
+        ].decode("utf-8")
+        return [
+            doc_blob[doc_offsets[i] : doc_offsets[i + 1]] for i in range(self.num_docs)
+        ]
+
+    @cached_property
+    def doc_ids(self):
+        return {doc_key: i for i, doc_key in enumerate(self.doc_keys)}
+
+    def find(self, term):
+        """
+        Binary searches the term dictionary, returning the TermEntry of a term or None if it is not indexed
+        """
+        encoded = term.encode("utf-8")
+        low = 0
+        high = self.num_terms
+        while low < high:
+            mid = (low + high) // 2
+            entry = TERM_ENTRY.unpack_from(
+                self.mm, self.terms_offset + mid * TERM_ENTRY.size
+            )
+            start = self.term_blob_offset + entry[1]
+            candidate = self.mm[start : start + entry[2]]
+            if candidate < encoded:
+                low = mid + 1
+            elif candidate > encoded:
+                high = mid
+            else:
+                return TermEntry(entry[0], *entry[3:])
+        return None
+
+    def document_frequency(self, term):
+        entry = self.find(term)
+        return entry.df if entry else 0
+
+    def postings(self, term):
+        """
+        Returns the (doc_ids, raw_tfs, weights) of a term, all in document order. Empty lists if the term is not indexed
+        """
+        entry = self.find(term)
+        if entry is None:
+            return [], [], array("f")
+        doc_ids, raw_tfs, weights = self.read_postings(entry.offset, entry.high_df)
+        if entry.df == entry.high_df:
+            return doc_ids, raw_tfs, weights
+        low_doc_ids, low_weights = self.low_tier(entry)
+        low_raw_tfs, _ = decode_varints(
+            self.mm, entry.low_offset + len(low_doc_ids) * 8, len(low_doc_ids)
+        )
+        merged = sorted(
+            zip(
+                doc_ids + low_doc_ids.tolist(),
+                raw_tfs + low_raw_tfs,
+                weights.tolist() + low_weights.tolist(),
+            )
+        )
+        return (
+            [posting[0] for posting in merged],
+            [posting[1] for posting in merged],
+            array("f", [posting[2] for posting in merged]),
+        )
+
+    def read_postings(self, offset, df):
+        """Decodes the high tier (the whole postings list of an untiered term) starting at offset"""
+        weights = array("f")
+        weights.frombytes(self.mm[offset : offset + df * weights.itemsize])
+        gaps, pos = decode_varints(self.mm, offset + df * weights.itemsize, df)
+        raw_tfs, _ = decode_varints(self.mm, pos, df)
+        doc_ids = []
+        doc_id = 0
+        for gap in gaps:
+            doc_id += gap
+            doc_ids.append(doc_id)
+        return doc_ids, raw_tfs, weights
+
+    def document_ids(self, entry):
+        """Returns the doc ids of both tiers of a term in document order"""
+        gaps, _ = decode_varints(
+            self.mm, entry.offset + entry.high_df * 4, entry.high_df
+        )
+        doc_ids = []
+        doc_id = 0
+        for gap in gaps:
+            doc_id += gap
+            doc_ids.append(doc_id)
+        if entry.df == entry.high_df:
+            return doc_ids
+        return sorted(doc_ids + self.low_tier(entry)[0].tolist())
+
+    def positions(self, entry, doc_ids=None):
+        """
+        Returns a dict from doc id to the sorted token positions of a term in the document, for the given doc ids or
+        for every document holding the term. The positions of the other documents are skipped without being decoded
+        """
+        wanted = None if doc_ids is None else set(doc_ids)
+        positions = {}
+        pos = entry.positions_offset
+        for doc_id in self.document_ids(entry):
+            shift = 0
+            size = 0
+            while True:
+                byte = self.mm[pos]
+                pos += 1
+                size |= (byte & 0x7F) << shift
+                if byte < 0x80:
+                    break
+                shift += 7
+            if wanted is None or doc_id in wanted:
+                positions[doc_id] = decode_positions(self.mm, pos, pos + size)
+            pos += size
+        return positions
+
+    def block_headers(self, entry):
+        """
+        Returns zero-copy views of the last doc id of every block of the high tier of a term and of the offsets of the
+        blocks, or None if the high tier is a single block
+        """
+        if not entry.skips_offset:
+            return None
+        count = -(-entry.high_df // SKIP_INTERVAL)
+        view = memoryview(self.mm)[
+            entry.skips_offset : entry.skips_offset + count * 8
+        ]
+        return view[: count * 4].cast("I"), view[count * 4 :].cast("I")
+
+    def read_block(self, entry, block, headers):
+        """Decodes the doc ids of one block of the high tier of a term, given the block_headers of the term"""
+        start = entry.offset + entry.high_df * 4
+        previous = 0
+        if headers is not None:
+            last_doc_ids, offsets = headers
+            start += offsets[block]
+            if block:
+                previous = last_doc_ids[block - 1]
+        count = min(SKIP_INTERVAL, entry.high_df - block * SKIP_INTERVAL)
+        gaps, _ = decode_varints(self.mm, start, count)
+        doc_ids = []
+        for gap in gaps:
+            previous += gap
+            doc_ids.append(previous)
+        return doc_ids
+
+    def low_tier(self, entry):
+        """Returns zero-copy (doc_ids, weights) views of the low tier of a term, which is left undecoded"""
+        size = entry.df - entry.high_df
+        view = memoryview(self.mm)[entry.low_offset : entry.low_offset + size * 8]
+        return view[: size * 4].cast("I"), view[size * 4 :].cast("f")
+
+    def doc_id(self, doc_key):
+        return self.doc_ids[doc_key]
+
+    def doc_key(self, doc_id):
+        start, end = struct.unpack_from("<QQ", self.mm, self.docs_offset + doc_id * 8)
+        return self.mm[
+            self.doc_blob_offset + start : self.doc_blob_offset + end
+        ].decode("utf-8")
+
+    def length(self, doc_id):
+        return self.lengths_array[doc_id]
+
+    def __len__(self):
+        return self.num_terms
+
+    def __iter__(self):
+        """Yields the indexed terms in sorted order"""
+        for i in range(self.num_terms):
+            entry = TERM_ENTRY.unpack_from(self.mm, self.terms_offset + i * TERM_ENTRY.size)
+            start = self.term_blob_offset + entry[1]
+            yield self.mm[start : start + entry[2]].decode("utf-8")
+
+    def __contains__(self, term):
+        return self.find(term) is not None
+
+    def __getitem__(self, term):
+        """
+        Returns the postings of a term as (doc_key, raw_tf, tf_idf) triples, the same shape as the JSON index
+        """
+        doc_ids, raw_tfs, weights = self.postings(term)
+        if not doc_ids:
+            raise KeyError(term)
+        return [
+            (self.doc_keys[doc_id], raw_tf, weight)
+            for doc_id, raw_tf, weight in zip(doc_ids, raw_tfs, weights)
+        ]
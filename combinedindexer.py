@@ -0,0 +1,135 @@
+from indexer import Indexer
+from bigramsindexer import BigramsIndexer
+from tokenizer import lemma_cache
+import timeit
+import argparse
+import json
+
+
+class CombinedIndexer(Indexer):
+    """
+    Builds the unigram and the bigram index in a single run. Every document is parsed and tokenized once and the same
+    token stream is fed to both indexers. With positions the unigram index answers phrase and proximity queries
+    itself, so no bigram index is built and bigrams is None
+    """
+
+    def __init__(
+        self,
+        base_url,
+        workers=1,
+        memory_budget=None,
+        store_documents=False,
+        positions=False,
+    ):
+        super().__init__(base_url, workers, memory_budget, store_documents, positions)
+        self.unigrams = Indexer(base_url, positions=positions)
+        self.bigrams = None if positions else BigramsIndexer(base_url)
+        self.indexers = [self.unigrams]
+        if self.bigrams is not None:
+            self.indexers.append(self.bigrams)
+        for indexer in self.indexers:
+            indexer.doc_keys = self.doc_keys
+
+    def index_analyzed(self, doc_id, tokens, tag_tokens, document):
+        for indexer in self.indexers:
+            indexer.index_tokens(doc_id, tokens, tag_tokens)
+        if self.store_documents:
+            self.add_documents([document])
+
+    def partial_indexers(self):
+        return self.indexers
+
+    def block_size(self):
+        return super().block_size() + sum(
+            indexer.block_size() for indexer in self.indexers
+        )
+
+    def flush_block(self):
+        super().flush_block()
+        for indexer in self.indexers:
+            indexer.flush_block()
+
+    def calculate_weights(self):
+        for indexer in self.indexers:
+            indexer.calculate_weights()
+
+    def close(self):
+        super().close()
+        for indexer in self.indexers:
+            indexer.close()
+
+    def get_unigrams(self):
+        return self.unigrams
+
+    def get_bigrams(self):
+        return self.bigrams
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("base_url")
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="write the legacy index/lengths JSON files instead of index.bin and index2.bin",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes the folders are indexed with",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        help="flush sorted blocks to disk whenever the in-memory indexes grow past this many megabytes",
+    )
+    parser.add_argument(
+        "--tier-size",
+        type=int,
+        help="split postings lists longer than this into a high and a low impact tier",
+    )
+    parser.add_argument(
+        "--lemma-cache",
+        help="file the (word, pos) -> lemma memo is loaded from and saved to, so later runs start warm",
+    )
+    parser.add_argument(
+        "--positions",
+        action="store_true",
+        help="store token positions in index.bin for phrase and proximity queries instead of building index2.bin",
+    )
+    args = parser.parse_args()
+    start = timeit.default_timer()
+    if args.lemma_cache:
+        lemma_cache.load(args.lemma_cache)
+    memory_budget = args.memory_budget * 2**20 if args.memory_budget else None
+    indexer = CombinedIndexer(
+        args.base_url,
+        workers=args.workers,
+        memory_budget=memory_budget,
+        store_documents=True,
+        positions=args.positions,
+    )
+    indexer.create_index()
+    indexer.save_docstore("docstore.bin")
+    unigrams = indexer.get_unigrams()
+    bigrams = indexer.get_bigrams()
+    if args.json:
+        unigrams.save_json("index.json")
+        with open("lengths.json", "a") as f:
+            json.dump(unigrams.get_lengths(), f, indent=4)
+        with open("size.json", "a") as f:
+            json.dump(unigrams.get_num_documents(), f, indent=4)
+        if bigrams is not None:
+            bigrams.save_json("index2.json")
+            with open("lengths2.json", "a") as f:
+                json.dump(bigrams.get_lengths(), f, indent=4)
+    else:
+        unigrams.save_binary("index.bin", args.tier_size)
+        if bigrams is not None:
+            bigrams.save_binary("index2.bin", args.tier_size)
+    indexer.close()
+    if args.lemma_cache:
+        lemma_cache.save(args.lemma_cache)
+    stop = timeit.default_timer()
+    print("Time: ", stop - start, "seconds")
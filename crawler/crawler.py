@@ -1,13 +1,56 @@
 import logging
-import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from urllib.parse import urlparse
-from urllib.parse import urljoin
-from urllib.parse import parse_qs
-from bs4 import BeautifulSoup
-from tokenizer import tokenize, compute_word_frequencies
+from pageparser import parse_html
+from tokenizer import iter_tokens, compute_word_frequencies
+from urlfilter import UrlFilter
 
 logger = logging.getLogger(__name__)
 
+# Urls handed to the worker pool per worker, so a worker never waits on the coordinator for its next url
+PAGES_PER_WORKER = 4
+# Seconds between checkpoints of the frontier, the most progress a crash can lose
+CHECKPOINT_INTERVAL = 5
+
+
+def parse_page(url_data):
+    """
+    Returns the words and the absolute outlinks of a page fetched by Corpus.fetch_url, or None for a page without
+    content
+    """
+    if (
+        url_data["url"] is None
+        or url_data["size"] == 0
+        or url_data["content_type"] is None
+        or url_data["http_code"] == 404
+    ):
+        return None
+
+    if url_data["is_redirected"]:
+        base_url = url_data["final_url"]
+    else:
+        base_url = url_data["url"]
+    page = parse_html(url_data["content"], base_url=base_url)
+    return page.text.split(), page.links
+
+
+def crawl_page(corpus, url):
+    """
+    Fetches and parses a url in a crawl worker process. Returns the url of the response with None for a page without
+    content, or with the number of words of the page, the frequencies of its tokens and its outlinks
+    """
+    url_data = corpus.fetch_url(url)
+    page = parse_page(url_data)
+    if page is None:
+        return url_data.get("url"), None
+    words, output_links = page
+    return url_data.get("url"), (
+        len(words),
+        compute_word_frequencies(iter_tokens(words)),
+        output_links,
+    )
+
 
 class Crawler:
     """
@@ -15,53 +58,135 @@ class Crawler:
     the frontier
     """
 
-    def __init__(self, frontier, corpus):
+    def __init__(self, frontier, corpus, workers=1):
         self.frontier = frontier
         self.corpus = corpus
-        self.valid_outlinks = {}
+        self.workers = workers
+        self.last_checkpoint = time.monotonic()
         self.subdomains_visited = {}
-        self.valid_outlinks = dict()
-        self.downloaded_urls = []
-        self.trap_urls = []
-        self.trap_urls_set = set()
+        # Only the page with the most valid outlinks is kept, and downloaded and trap urls are streamed to their
+        # analytics files as they are found, so memory does not grow with the number of pages crawled
+        self.most_outlinks = ("", 0)
+        self.downloaded_log = None
+        self.trap_log = None
+        self.url_filter = UrlFilter()
         self.longest_page = ("", 0)
         self.word_frequencies = {}
 
     def start_crawling(self):
         """
         This method starts the crawling process which is scraping urls from the next available link in frontier and adding
-        the scraped links to the frontier
+        the scraped links to the frontier. With more than one worker, pages are fetched and parsed concurrently
         """
+        self.downloaded_log = open("downloadedURLs.txt", "a")
+        self.trap_log = open("trapURLs.txt", "a")
+        try:
+            if self.workers > 1:
+                self.crawl_concurrently()
+            else:
+                self.crawl()
+        finally:
+            self.downloaded_log.close()
+            self.trap_log.close()
+        self.print_analytics()
+
+    def crawl(self):
+        """Fetches and parses the pages one at a time"""
         while self.frontier.has_next_url():
             url = self.frontier.get_next_url()
-            self.downloaded_urls.append(url)
-            netloc = urlparse(url).netloc
-            if netloc[0:3] != "www":
-                if netloc not in self.subdomains_visited:
-                    self.subdomains_visited[netloc] = 1
-                else:
-                    self.subdomains_visited[netloc] += 1
-
-            logger.info(
-                "Fetching URL %s ... Fetched: %s, Queue size: %s",
-                url,
-                self.frontier.fetched,
-                len(self.frontier),
-            )
+            if url is None:
+                time.sleep(self.frontier.wait_time())
+                continue
+            self.record_download(url)
             url_data = self.corpus.fetch_url(url)
+            self.add_outlinks(url_data.get("url"), self.extract_next_links(url_data))
+            self.frontier.complete(url)
+            self.checkpoint()
 
-            if url_data.get("url") not in self.valid_outlinks:
-                self.valid_outlinks[url_data.get("url")] = 0
-
-            for next_link in self.extract_next_links(url_data):
-                if self.is_valid(next_link):
-                    if self.corpus.get_file_name(next_link) is not None:
-                        self.frontier.add_url(next_link)
-                        self.valid_outlinks[url_data.get("url")] += 1
-                else:
-                    self.trap_urls.append(next_link)
-                    self.trap_urls_set.add(next_link)
-        self.print_analytics()
+    def crawl_concurrently(self):
+        """
+        Fetches and parses pages on a pool of worker processes, while this process hands out the urls of the frontier,
+        applying its per host politeness, and does all the bookkeeping of the pages in the order they complete
+        """
+        with ProcessPoolExecutor(self.workers) as executor:
+            pending = {}
+            while True:
+                while len(pending) < self.workers * PAGES_PER_WORKER:
+                    url = self.frontier.get_next_url()
+                    if url is None:
+                        break
+                    self.record_download(url)
+                    pending[executor.submit(crawl_page, self.corpus, url)] = url
+                if not pending:
+                    if not self.frontier.has_next_url():
+                        break
+                    time.sleep(self.frontier.wait_time())
+                    continue
+                # While the pool has room, hosts held back by their politeness delay are checked again as soon as it is
+                # over. A full pool only has room again once a page completes, so it is waited on without a timeout
+                timeout = None
+                if (
+                    len(pending) < self.workers * PAGES_PER_WORKER
+                    and self.frontier.has_next_url()
+                ):
+                    timeout = self.frontier.wait_time()
+                done, _ = wait(pending, timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url = pending.pop(future)
+                    response_url, page = future.result()
+                    output_links = []
+                    if page is not None:
+                        num_words, frequencies, output_links = page
+                        self.update_longest_page(num_words, response_url)
+                        for token, count in frequencies.items():
+                            self.word_frequencies[token] = (
+                                self.word_frequencies.get(token, 0) + count
+                            )
+                    self.add_outlinks(response_url, output_links)
+                    self.frontier.complete(url)
+                self.checkpoint()
+
+    def checkpoint(self):
+        """Checkpoints the frontier and flushes the url logs every CHECKPOINT_INTERVAL seconds"""
+        now = time.monotonic()
+        if now - self.last_checkpoint >= CHECKPOINT_INTERVAL:
+            self.downloaded_log.flush()
+            self.trap_log.flush()
+            self.frontier.checkpoint()
+            self.last_checkpoint = now
+
+    def record_download(self, url):
+        """Records a url handed out by the frontier as downloaded, counting the pages of every subdomain"""
+        print(url, file=self.downloaded_log)
+        netloc = urlparse(url).netloc
+        if netloc[0:3] != "www":
+            if netloc not in self.subdomains_visited:
+                self.subdomains_visited[netloc] = 1
+            else:
+                self.subdomains_visited[netloc] += 1
+
+        logger.info(
+            "Fetching URL %s ... Fetched: %s, Queue size: %s",
+            url,
+            self.frontier.fetched,
+            len(self.frontier),
+        )
+
+    def add_outlinks(self, url, output_links):
+        """
+        Adds the valid outlinks of a page to the frontier in their canonical form, counting them, and records the others
+        as traps
+        """
+        valid, invalid = self.url_filter.filter_links(output_links)
+        valid_outlinks = 0
+        for next_link, count in valid.items():
+            if self.corpus.get_file_name(next_link) is not None:
+                self.frontier.add_url(next_link)
+                valid_outlinks += count
+        for next_link in invalid:
+            print(next_link, file=self.trap_log)
+        if valid_outlinks > self.most_outlinks[1] or not self.most_outlinks[0]:
+            self.most_outlinks = (url, valid_outlinks)
 
     def extract_next_links(self, url_data):
         """
@@ -72,28 +197,12 @@ class Crawler:
         that have already been fetched. The frontier takes care of that.
         Suggested library: lxml
         """
-        if (
-            url_data["url"] is None
-            or url_data["size"] == 0
-            or url_data["content_type"] is None
-            or url_data["http_code"] == 404
-        ):
+        page = parse_page(url_data)
+        if page is None:
             return []
-
-        soup = BeautifulSoup(url_data["content"], "html.parser")
-
-        words = soup.get_text(separator=" ").split()
-        self.update_longest_page(words, url_data["url"])
+        words, output_links = page
+        self.update_longest_page(len(words), url_data["url"])
         self.update_word_frequencies(words)
-
-        output_links = []
-        for link in soup.find_all("a"):
-            if url_data["is_redirected"]:
-                base_url = url_data["final_url"]
-            else:
-                base_url = url_data["url"]
-            href = urljoin(base_url, link.get("href"))
-            output_links.append(href)
         return output_links
 
     def is_valid(self, url):
@@ -102,101 +211,19 @@ class Crawler:
         filter out crawler traps. Duplicated urls will be taken care of by frontier. You don't need to check for duplication
         in this method
         """
-        if url in self.trap_urls_set:
-            return False
-        parsed = urlparse(url)
-
-        if parsed.scheme not in set(["http", "https"]):
-            return False
-        if parsed.netloc == "":
-            return False
-
-        try:
-            return (
-                ".ics.uci.edu" in parsed.hostname
-                and not self.is_trap(parsed)
-                and not re.match(
-                    ".*\.(css|js|bmp|gif|jpe?g|ico"
-                    + "|png|tiff?|mid|mp2|mp3|mp4|wmz"
-                    + "|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf"
-                    + "|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso|epub|dll|cnf|tgz|sha1"
-                    + "|thmx|mso|arff|rtf|jar|csv"
-                    + "|rm|smil|wmv|swf|wma|zip|rar|gz|pdf"
-                    + "|lif|xml|htm|bam|h|cp|c|hqx|ff|py|.git|.gitignore|odp|java|ai|pov|bib|txt|class|)$",
-                    parsed.path.lower(),
-                )
-            )
-
-        except TypeError:
-            print("TypeError for ", parsed)
-            return False
-
-    def is_trap(self, parsed):
-        """Function returns true or false depending on if it detects a trap from the parsed object"""
-        if str(parsed.fragment) != "":
-            return True
-
-        path_directories = parsed.path.split("/")
-        if (
-            len(path_directories) > 6
-            or ("pix" in path_directories)
-            or ("pairs" in path_directories and "Data" in path_directories)
-            or ("archive" in parsed.netloc and "datasets" in parsed.path)
-            or ("wics" in parsed.netloc and "events" in path_directories)
-            or ("cbcl" in parsed.netloc and "public_data" in path_directories)
-            or (
-                "fano" in parsed.netloc
-                and "ca" in path_directories
-                and "rules" in path_directories
-            )
-        ):
-            return True
-
-        queries = parse_qs(parsed.query)
-        if (
-            len(queries) > 4
-            or "ical" in queries
-            or "do" in queries
-            or "version" in queries
-            or "share" in queries
-            or (
-                "action" in queries
-                and (queries["action"][0] in ["login", "download", "edit"])
-            )
-            or ("from" in queries and re.match("^20\d{2}-", queries["from"][0]))
-        ):
-            return True
-
-        if self.has_repeating_subdirectories(str(parsed.path).split("/")):
-            return True
-
-        return False
-
-    def has_repeating_subdirectories(self, path_list):
-        """Function checks if there are more than two repeating subdirectories in the url"""
-        max_count = 0
-        count = 1
-        for i in range(1, len(path_list)):
-            if path_list[i] == path_list[i - 1]:
-                count += 1
-            else:
-                max_count = max(max_count, count)
-                count = 1
-        max_count = max(max_count, count)
-        return max_count > 2
+        return self.url_filter.is_valid(url)
 
     def update_word_frequencies(self, words):
         """Function updates the word frequencies dictionary based on the tokens found in the HTML document"""
-        words = tokenize(words)
-        compute_word_frequencies(words, frequencies=self.word_frequencies)
+        compute_word_frequencies(iter_tokens(words), frequencies=self.word_frequencies)
 
-    def update_longest_page(self, words, url):
+    def update_longest_page(self, num_words, url):
         """Function updates the current longest page"""
-        if len(words) > self.longest_page[1]:
-            self.longest_page = (url, len(words))
+        if num_words > self.longest_page[1]:
+            self.longest_page = (url, num_words)
 
     def print_analytics(self):
-        """Print out all five analytics to files"""
+        """Print out the analytics that are not streamed to files during the crawl"""
         with open("subdomainsVisited.txt", "a") as f:
             for key, val in sorted(
                 self.subdomains_visited.items(),
@@ -205,16 +232,8 @@ class Crawler:
                 print(key, "\t", val, sep="", file=f)
 
         with open("pageWithMostOutlinks.txt", "a") as f:
-            print(max(self.valid_outlinks, key=self.valid_outlinks.get), file=f)
-            print(max(self.valid_outlinks.values()), "outlinks", file=f)
-
-        with open("downloadedURLs.txt", "a") as f:
-            for i in self.downloaded_urls:
-                print(i, file=f)
-
-        with open("trapURLs.txt", "a") as f:
-            for i in self.trap_urls:
-                print(i, file=f)
+            print(self.most_outlinks[0], file=f)
+            print(self.most_outlinks[1], "outlinks", file=f)
 
         with open("longestPage.txt", "a") as f:
             print(self.longest_page[0], file=f)
@@ -0,0 +1,121 @@
+import hashlib
+import math
+from array import array
+
+
+def fingerprint(url):
+    """Returns the 64-bit fingerprint of a url, never 0, which marks the empty slots of a FingerprintSet"""
+    value = int.from_bytes(
+        hashlib.blake2b(url.encode("utf-8", "surrogatepass"), digest_size=8).digest(),
+        "little",
+    )
+    return value or 1
+
+
+class BloomFilter:
+    """
+    Bit array answering whether a fingerprint may have been added, with no false negatives and about error_rate false
+    positives once capacity fingerprints were added. The bits tested for a fingerprint are derived from its two halves
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.num_bits = max(
+            8, int(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        )
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def positions(self, value):
+        step = (value >> 32) | 1
+        for i in range(self.num_hashes):
+            yield (value + i * step) % self.num_bits
+
+    def add(self, value):
+        for position in self.positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        for position in self.positions(value):
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class FingerprintSet:
+    """
+    Set of urls kept as their 64-bit fingerprints in an open addressing hash table, about 12 to 24 bytes a url instead
+    of the 100 or more of a url string in a set. With 64 bits, two urls of a crawl of n urls share a fingerprint with
+    a probability of about n^2 / 2^65, a few in a million for ten million urls. A Bloom filter front lets lookups of
+    urls that were never added, most of the lookups of a crawl, skip probing the table
+    """
+
+    # The table doubles once it is this full
+    MAX_LOAD = 2 / 3
+
+    def __init__(self, capacity=1024, bloom=False):
+        size = 1
+        while size * self.MAX_LOAD < capacity:
+            size *= 2
+        self.table = array("Q", [0]) * size
+        self.mask = size - 1
+        self.size = 0
+        self.bloom = BloomFilter(size) if bloom else None
+
+    def add(self, url):
+        """Adds a url, returning whether it was not in the set yet"""
+        return self.add_fingerprint(fingerprint(url))
+
+    def add_fingerprint(self, value):
+        if self.bloom is not None and value not in self.bloom:
+            self.bloom.add(value)
+        elif self.find(value):
+            return False
+        self.insert(value)
+        self.size += 1
+        if self.size > len(self.table) * self.MAX_LOAD:
+            self.resize(len(self.table) * 2)
+        return True
+
+    def find(self, value):
+        table = self.table
+        mask = self.mask
+        slot = value & mask
+        while True:
+            current = table[slot]
+            if current == value:
+                return True
+            if current == 0:
+                return False
+            slot = (slot + 1) & mask
+
+    def insert(self, value):
+        table = self.table
+        mask = self.mask
+        slot = value & mask
+        while table[slot]:
+            slot = (slot + 1) & mask
+        table[slot] = value
+
+    def resize(self, size):
+        values = [value for value in self.table if value]
+        self.table = array("Q", [0]) * size
+        self.mask = size - 1
+        if self.bloom is not None:
+            self.bloom = BloomFilter(size)
+        for value in values:
+            self.insert(value)
+            if self.bloom is not None:
+                self.bloom.add(value)
+
+    def __contains__(self, url):
+        value = fingerprint(url)
+        if self.bloom is not None and value not in self.bloom:
+            return False
+        return self.find(value)
+
+    def __iter__(self):
+        """Yields the fingerprints in the set"""
+        return (value for value in self.table if value)
+
+    def __len__(self):
+        return self.size
@@ -1,7 +1,11 @@
+import heapq
+import json
 import logging
 import os
+import time
 from collections import deque
-import pickle
+from urllib.parse import urlparse
+from fingerprints import FingerprintSet
 
 logger = logging.getLogger(__name__)
 
@@ -12,88 +16,248 @@ class Frontier:
     check if the frontier has any more urls. Additionally, it has methods to save the current state of the frontier and
     load existing state
 
+    Urls are queued per host. A host is only handed out again politeness_delay seconds after its last url was, and hosts
+    take turns, so the crawl spreads over every host instead of draining them one by one
+
     Attributes:
-        urls_queue: A queue of urls to be download by crawlers
-        urls_set: A set of urls to avoid duplicated urls
+        host_queues: A queue of urls to be download by crawlers for every host
+        ready_hosts: A heap of (time, order, host) of the hosts with queued urls, by the time they may be fetched again
+        in_flight: The urls handed out whose pages were not completed yet
+        urls_set: A FingerprintSet of the urls ever added, to avoid duplicated urls
         fetched: the number of fetched urls so far
     """
 
-    # File names to be used when loading and saving the frontier state
+    # File names to be used when loading and saving the frontier state. The snapshot holds the state of the frontier
+    # when it was last compacted and the log every url added or completed since, one event per line:
+    #
+    #   snapshot: {"generation": 3, "fetched": 1200}    log: {"generation": 3}
+    #             =5f2c9a0e8b1d4e37                          +"http://www.ics.uci.edu/about"
+    #             +"http://www.ics.uci.edu/faculty"          -"http://www.ics.uci.edu/faculty"
+    #
+    # where = is the fingerprint of a url that was added, + a url added to the queue and - a queued url that was
+    # completed. A log whose generation is not the one of the snapshot was already compacted into it and is ignored
     FRONTIER_DIR_NAME = "frontier_state"
-    URL_QUEUE_FILE_NAME = os.path.join(".", FRONTIER_DIR_NAME, "url_queue.pkl")
-    URL_SET_FILE_NAME = os.path.join(".", FRONTIER_DIR_NAME, "url_set.pkl")
-    FETCHED_FILE_NAME = os.path.join(".", FRONTIER_DIR_NAME, "fetched.pkl")
+    SNAPSHOT_FILE_NAME = os.path.join(".", FRONTIER_DIR_NAME, "snapshot")
+    LOG_FILE_NAME = os.path.join(".", FRONTIER_DIR_NAME, "log")
+
+    # The log is compacted into a new snapshot once it holds more events than this and than the snapshot holds urls,
+    # so compaction costs O(1) per event and recovery reads at most twice the state
+    COMPACT_MIN_EVENTS = 100_000
+
+    # Seconds a host is left alone after one of its urls is handed out, unless the crawl sets its own delay
+    POLITENESS_DELAY = 0.5
 
-    def __init__(self):
-        self.urls_queue = deque()
-        self.urls_set = set()
+    def __init__(self, politeness_delay=POLITENESS_DELAY):
+        self.politeness_delay = politeness_delay
+        self.host_queues = {}
+        self.ready_hosts = []
+        self.next_fetch = {}
+        self.order = 0
+        self.queued = 0
+        self.in_flight = set()
+        self.urls_set = FingerprintSet()
         self.fetched = 0
+        self.log = None
+        self.generation = 0
+        self.log_events = 0
+        self.snapshot_urls = 0
 
     def add_url(self, url):
         """
-        Adds a url to the urls queue
+        Adds a url to the queue of its host
         :param url: the url to be added
         """
-        if not self.is_duplicate(url):
-            self.urls_queue.append(url)
-            self.urls_set.add(url)
+        if self.urls_set.add(url):
+            self.queue_url(url)
+            self.record("+", url)
+
+    def queue_url(self, url):
+        host = urlparse(url).netloc
+        queue = self.host_queues.get(host)
+        if queue is None:
+            queue = self.host_queues[host] = deque()
+        if not queue:
+            self.schedule(host, self.next_fetch.get(host, 0.0))
+        queue.append(url)
+        self.queued += 1
+
+    def schedule(self, host, when):
+        heapq.heappush(self.ready_hosts, (when, self.order, host))
+        self.order += 1
 
     def is_duplicate(self, url):
         return url in self.urls_set
 
     def get_next_url(self):
         """
-        Returns the next url to be fetched
+        Returns the next url to be fetched, or None if every host with queued urls was fetched too recently
         """
-        if self.has_next_url():
-            self.fetched += 1
-            return self.urls_queue.popleft()
+        if not self.ready_hosts:
+            return None
+        now = time.monotonic()
+        when, _, host = self.ready_hosts[0]
+        if when > now:
+            return None
+        heapq.heappop(self.ready_hosts)
+        queue = self.host_queues[host]
+        url = queue.popleft()
+        self.queued -= 1
+        self.next_fetch[host] = now + self.politeness_delay
+        if queue:
+            self.schedule(host, self.next_fetch[host])
+        self.in_flight.add(url)
+        self.fetched += 1
+        return url
+
+    def complete(self, url):
+        """
+        Records that the page of a url handed out by get_next_url was processed, so it is not queued again on a restart
+        """
+        self.in_flight.discard(url)
+        self.record("-", url)
+
+    def record(self, event, url):
+        if self.log is not None:
+            self.log.write(event + json.dumps(url) + "\n")
+            self.log_events += 1
+
+    def wait_time(self):
+        """
+        Returns the number of seconds until a host with queued urls may be fetched again
+        """
+        if not self.ready_hosts:
+            return 0.0
+        return max(0.0, self.ready_hosts[0][0] - time.monotonic())
 
     def has_next_url(self):
         """
         Returns true if there are more urls in the queue, otherwise false
         """
-        return len(self.urls_queue) != 0
+        return self.queued != 0
+
+    def checkpoint(self):
+        """
+        Makes the events logged so far durable, compacting the log into a new snapshot once it outgrew the snapshot
+        """
+        if self.log is None:
+            return
+        self.log.flush()
+        os.fsync(self.log.fileno())
+        if self.log_events > max(self.COMPACT_MIN_EVENTS, self.snapshot_urls):
+            self.compact()
+
+    def compact(self):
+        """
+        Writes the state of the frontier to a new snapshot and starts a new log. Urls that were handed out but not
+        completed are saved as queued
+        """
+        self.generation += 1
+        with open(self.SNAPSHOT_FILE_NAME + ".tmp", "w") as f:
+            header = {"generation": self.generation, "fetched": self.fetched}
+            header["fetched"] -= len(self.in_flight)
+            print(json.dumps(header), file=f)
+            for value in self.urls_set:
+                print(f"={value:016x}", file=f)
+            for url in self.in_flight:
+                print("+", json.dumps(url), sep="", file=f)
+            for queue in self.host_queues.values():
+                for url in queue:
+                    print("+", json.dumps(url), sep="", file=f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.SNAPSHOT_FILE_NAME + ".tmp", self.SNAPSHOT_FILE_NAME)
+        self.snapshot_urls = len(self.urls_set) + len(self.in_flight) + len(self)
+        self.log.close()
+        self.start_log()
+
+    def start_log(self):
+        with open(self.LOG_FILE_NAME + ".tmp", "w") as f:
+            print(json.dumps({"generation": self.generation}), file=f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.LOG_FILE_NAME + ".tmp", self.LOG_FILE_NAME)
+        self.log = open(self.LOG_FILE_NAME, "a")
+        self.log_events = 0
 
     def save_frontier(self):
         """
-        saves the current state of the frontier in two files using pickle
+        Checkpoints the frontier and closes its log, which is all that is left to save, as every change to the frontier
+        was logged as it was made
+        """
+        if self.log is not None:
+            self.checkpoint()
+            self.log.close()
+            self.log = None
+
+    def load_frontier(self):
+        """
+        loads the previous state of the frontier into memory, if exists, by replaying its log on top of its snapshot, and
+        logs every change to the frontier from then on. Urls that were handed out but not completed are queued again. A
+        line torn by a crash in the middle of a write ends the log and is cut off
         """
         if not os.path.exists(self.FRONTIER_DIR_NAME):
             os.makedirs(self.FRONTIER_DIR_NAME)
 
-        url_queue_file = open(self.URL_QUEUE_FILE_NAME, "wb")
-        url_set_file = open(self.URL_SET_FILE_NAME, "wb")
-        fetched_file = open(self.FETCHED_FILE_NAME, "wb")
-        pickle.dump(self.urls_queue, url_queue_file)
-        pickle.dump(self.urls_set, url_set_file)
-        pickle.dump(self.fetched, fetched_file)
+        queued = {}
+        if os.path.isfile(self.SNAPSHOT_FILE_NAME):
+            with open(self.SNAPSHOT_FILE_NAME) as f:
+                header = json.loads(f.readline())
+                self.generation = header["generation"]
+                self.fetched = header["fetched"]
+                for line in f:
+                    self.replay(line, queued)
+                    self.snapshot_urls += 1
 
-    def load_frontier(self):
-        """
-        loads the previous state of the frontier into memory, if exists
-        """
-        if (
-            os.path.isfile(self.URL_QUEUE_FILE_NAME)
-            and os.path.isfile(self.URL_SET_FILE_NAME)
-            and os.path.isfile(self.FETCHED_FILE_NAME)
-        ):
-            try:
-                self.urls_queue = pickle.load(open(self.URL_QUEUE_FILE_NAME, "rb"))
-                self.urls_set = pickle.load(open(self.URL_SET_FILE_NAME, "rb"))
-                self.fetched = pickle.load(open(self.FETCHED_FILE_NAME, "rb"))
-                logger.info(
-                    "Loaded previous frontier state into memory. Fetched: %s, Queue size: %s",
-                    self.fetched,
-                    len(self.urls_queue),
-                )
-            except:
-                pass
+        if os.path.isfile(self.LOG_FILE_NAME):
+            with open(self.LOG_FILE_NAME, "rb+") as f:
+                header = json.loads(f.readline())
+                if header["generation"] == self.generation:
+                    end = f.tell()
+                    for line in f:
+                        try:
+                            if not line.endswith(b"\n"):
+                                raise ValueError("unterminated line")
+                            self.replay(line.decode("utf-8"), queued)
+                        except ValueError:
+                            logger.warning(
+                                "Cutting off the frontier log at a torn line: %r", line
+                            )
+                            f.truncate(end)
+                            break
+                        end += len(line)
+                        self.log_events += 1
+                    self.log = open(self.LOG_FILE_NAME, "a")
+        if self.log is None:
+            self.start_log()
+
+        for url in queued:
+            self.queue_url(url)
+        if self.urls_set:
+            logger.info(
+                "Loaded previous frontier state into memory. Fetched: %s, Queue size: %s",
+                self.fetched,
+                len(self),
+            )
         else:
             logger.info(
                 "No previous frontier state found. Starting from the seed URL ..."
             )
             self.add_url("http://www.ics.uci.edu/")
 
+    def replay(self, line, queued):
+        """Applies a snapshot or log line to the seen urls, the queued urls and the number of fetched urls"""
+        event = line[0]
+        if event == "+":
+            url = json.loads(line[1:])
+            self.urls_set.add(url)
+            queued[url] = None
+        elif event == "-":
+            queued.pop(json.loads(line[1:]), None)
+            self.fetched += 1
+        elif event == "=":
+            self.urls_set.add_fingerprint(int(line[1:], 16))
+        else:
+            raise ValueError(f"unknown frontier event {event!r}")
+
     def __len__(self):
-        return len(self.urls_queue)
+        return self.queued
@@ -1,5 +1,6 @@
 import atexit
 import logging
+import os
 
 import sys
 
@@ -15,8 +16,12 @@ if __name__ == "__main__":
         level=logging.INFO,
     )
 
-    # Instantiates frontier and loads the last state if exists
-    frontier = Frontier()
+    # Instantiates frontier and loads the last state if exists, with the politeness delay given after the number of
+    # workers, if any
+    politeness_delay = (
+        float(sys.argv[3]) if len(sys.argv) > 3 else Frontier.POLITENESS_DELAY
+    )
+    frontier = Frontier(politeness_delay)
     frontier.load_frontier()
 
     # Instantiates corpus object with the given cmd arg
@@ -25,6 +30,7 @@ if __name__ == "__main__":
     # Registers a shutdown hook to save frontier state upon unexpected shutdown
     atexit.register(frontier.save_frontier)
 
-    # Instantiates a crawler object and starts crawling
-    crawler = Crawler(frontier, corpus)
+    # Instantiates a crawler object and starts crawling, on every core unless a number of workers is given
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    crawler = Crawler(frontier, corpus, workers)
     crawler.start_crawling()
@@ -0,0 +1,46 @@
+import pytest
+from fingerprints import BloomFilter, FingerprintSet, fingerprint
+
+URLS = [f"http://www.ics.uci.edu/page/{i}" for i in range(5000)]
+
+
+def test_fingerprints_are_stable_and_never_zero():
+    assert fingerprint(URLS[0]) == fingerprint(URLS[0])
+    assert fingerprint(URLS[0]) != fingerprint(URLS[1])
+    assert all(0 < fingerprint(url) < 2**64 for url in URLS[:100])
+
+
+@pytest.mark.parametrize("bloom", [False, True], ids=["table", "bloom"])
+def test_set_grows_without_losing_urls(bloom):
+    urls_set = FingerprintSet(capacity=4, bloom=bloom)
+    initial_size = len(urls_set.table)
+    assert all(urls_set.add(url) for url in URLS)
+    assert len(urls_set.table) > initial_size
+    assert len(urls_set) == len(URLS)
+    assert len(urls_set) <= len(urls_set.table) * FingerprintSet.MAX_LOAD
+    assert all(url in urls_set for url in URLS)
+    assert not any(urls_set.add(url) for url in URLS)
+    assert not any(f"http://www.ics.uci.edu/other/{i}" in urls_set for i in range(5000))
+
+
+@pytest.mark.parametrize("bloom", [False, True], ids=["table", "bloom"])
+def test_fingerprints_are_restored(bloom):
+    urls_set = FingerprintSet(bloom=bloom)
+    for url in URLS:
+        urls_set.add(url)
+    restored = FingerprintSet(bloom=bloom)
+    for value in urls_set:
+        assert restored.add_fingerprint(value)
+    assert sorted(restored) == sorted(urls_set)
+    assert all(url in restored for url in URLS)
+
+
+def test_bloom_filter_has_no_false_negatives_and_few_false_positives():
+    bloom = BloomFilter(len(URLS), error_rate=0.01)
+    for url in URLS:
+        bloom.add(fingerprint(url))
+    assert all(fingerprint(url) in bloom for url in URLS)
+    false_positives = sum(
+        fingerprint(f"http://www.ics.uci.edu/other/{i}") in bloom for i in range(5000)
+    )
+    assert false_positives < 5000 * 0.03
@@ -0,0 +1,188 @@
+import logging
+import os
+import shutil
+import pytest
+import frontier
+from frontier import Frontier
+
+SEED = "http://www.ics.uci.edu/"
+
+
+class Clock:
+    """Stands in for time.monotonic, so politeness is tested without sleeping"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_same_host_is_held_back_until_the_delay_passed(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(frontier.time, "monotonic", clock)
+    f = Frontier(politeness_delay=2.0)
+    f.add_url("http://www.ics.uci.edu/a")
+    f.add_url("http://www.ics.uci.edu/b")
+
+    assert f.get_next_url() == "http://www.ics.uci.edu/a"
+    assert f.get_next_url() is None
+    assert f.has_next_url()
+    assert f.wait_time() == 2.0
+
+    clock.now += 1.5
+    assert f.get_next_url() is None
+    assert f.wait_time() == 0.5
+
+    clock.now += 0.5
+    assert f.get_next_url() == "http://www.ics.uci.edu/b"
+    assert not f.has_next_url()
+
+
+def test_other_hosts_are_not_held_back(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(frontier.time, "monotonic", clock)
+    f = Frontier(politeness_delay=2.0)
+    f.add_url("http://www.ics.uci.edu/a")
+    f.add_url("http://www.ics.uci.edu/b")
+    f.add_url("http://vision.ics.uci.edu/c")
+
+    assert f.get_next_url() == "http://www.ics.uci.edu/a"
+    assert f.get_next_url() == "http://vision.ics.uci.edu/c"
+    assert f.get_next_url() is None
+
+
+def test_default_delay_is_polite():
+    assert Frontier().politeness_delay > 0
+
+
+@pytest.fixture
+def in_tmp_path(tmp_path, monkeypatch):
+    # The frontier state lives in ./frontier_state
+    monkeypatch.chdir(tmp_path)
+
+
+def started():
+    f = Frontier(politeness_delay=0.0)
+    f.load_frontier()
+    return f
+
+
+def queued_urls(f):
+    return sorted(url for queue in f.host_queues.values() for url in queue)
+
+
+def crawl(f, count):
+    """Hands out and completes count urls, returning them"""
+    urls = []
+    for _ in range(count):
+        url = f.get_next_url()
+        f.complete(url)
+        urls.append(url)
+    return urls
+
+
+def test_log_is_replayed_on_restart(in_tmp_path):
+    f = started()
+    f.add_url("http://www.ics.uci.edu/a")
+    f.add_url("http://vision.ics.uci.edu/b")
+    crawl(f, 2)
+    f.save_frontier()
+
+    g = started()
+    assert g.fetched == 2
+    assert len(g) == 1
+    assert len(g.urls_set) == 3
+    assert g.is_duplicate(SEED) and g.is_duplicate("http://www.ics.uci.edu/a")
+    g.add_url(SEED)
+    assert len(g) == 1
+
+
+def test_urls_in_flight_are_queued_again(in_tmp_path):
+    f = started()
+    f.add_url("http://www.ics.uci.edu/a")
+    handed_out = f.get_next_url()
+    f.save_frontier()
+
+    g = started()
+    assert g.fetched == 0
+    assert handed_out in queued_urls(g)
+    assert len(g) == 2
+
+
+def test_torn_line_is_cut_off(in_tmp_path, caplog):
+    f = started()
+    f.add_url("http://www.ics.uci.edu/a")
+    f.save_frontier()
+    size = os.path.getsize(Frontier.LOG_FILE_NAME)
+    with open(Frontier.LOG_FILE_NAME, "a") as log:
+        log.write('+"http://www.ics.uci.edu/tor')
+
+    with caplog.at_level(logging.WARNING):
+        g = started()
+    assert "torn line" in caplog.text
+    assert os.path.getsize(Frontier.LOG_FILE_NAME) == size
+    assert queued_urls(g) == [SEED, "http://www.ics.uci.edu/a"]
+
+    # The log goes on from the last whole line
+    g.add_url("http://www.ics.uci.edu/b")
+    g.save_frontier()
+    h = started()
+    assert len(h) == 3
+
+
+def test_unknown_event_is_cut_off(in_tmp_path):
+    f = started()
+    f.save_frontier()
+    with open(Frontier.LOG_FILE_NAME, "a") as log:
+        log.write("?garbage\n")
+    g = started()
+    assert queued_urls(g) == [SEED]
+
+
+def test_state_is_recovered_after_compaction(in_tmp_path):
+    f = started()
+    for i in range(10):
+        f.add_url(f"http://www.ics.uci.edu/{i}")
+    crawl(f, 4)
+    in_flight = f.get_next_url()
+    f.compact()
+    f.add_url("http://www.ics.uci.edu/after")
+    crawl(f, 1)
+    f.save_frontier()
+
+    g = started()
+    assert g.fetched == 5
+    assert len(g.urls_set) == 12
+    assert in_flight in queued_urls(g)
+    assert len(g) == 12 - 5
+    assert g.is_duplicate("http://www.ics.uci.edu/after")
+
+
+def test_log_of_a_compacted_generation_is_ignored(in_tmp_path):
+    f = started()
+    f.add_url("http://www.ics.uci.edu/a")
+    f.checkpoint()
+    # A crash between writing the new snapshot and starting the new log leaves the old log behind
+    shutil.copy(Frontier.LOG_FILE_NAME, "old_log")
+    f.compact()
+    f.save_frontier()
+    shutil.copy("old_log", Frontier.LOG_FILE_NAME)
+
+    g = started()
+    assert queued_urls(g) == [SEED, "http://www.ics.uci.edu/a"]
+    assert len(g.urls_set) == 2
+
+
+def test_checkpoint_compacts_a_long_log(in_tmp_path, monkeypatch):
+    monkeypatch.setattr(Frontier, "COMPACT_MIN_EVENTS", 5)
+    f = started()
+    for i in range(10):
+        f.add_url(f"http://www.ics.uci.edu/{i}")
+    f.checkpoint()
+    assert f.generation == 1
+    assert f.log_events == 0
+    f.save_frontier()
+
+    g = started()
+    assert len(g) == 11
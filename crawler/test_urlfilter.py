@@ -0,0 +1,209 @@
+import random
+import re
+from urllib.parse import parse_qs, urlparse
+import pytest
+from urlfilter import UrlFilter
+
+
+def old_is_valid(url):
+    """The rules of Crawler.is_valid before UrlFilter, which the filter is checked against"""
+    parsed = urlparse(url)
+    if parsed.scheme not in set(["http", "https"]):
+        return False
+    if parsed.netloc == "":
+        return False
+    try:
+        return (
+            ".ics.uci.edu" in parsed.hostname
+            and not old_is_trap(parsed)
+            and not re.match(
+                r".*\.(css|js|bmp|gif|jpe?g|ico"
+                + "|png|tiff?|mid|mp2|mp3|mp4|wmz"
+                + "|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf"
+                + "|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso|epub"
+                + "|dll|cnf|tgz|sha1"
+                + "|thmx|mso|arff|rtf|jar|csv"
+                + "|rm|smil|wmv|swf|wma|zip|rar|gz|pdf"
+                + "|lif|xml|htm|bam|h|cp|c|hqx|ff|py|.git|.gitignore|odp|java|ai|pov|bib|txt|class|)$",
+                parsed.path.lower(),
+            )
+        )
+    except TypeError:
+        return False
+
+
+def old_is_trap(parsed):
+    if str(parsed.fragment) != "":
+        return True
+    path_directories = parsed.path.split("/")
+    if (
+        len(path_directories) > 6
+        or ("pix" in path_directories)
+        or ("pairs" in path_directories and "Data" in path_directories)
+        or ("archive" in parsed.netloc and "datasets" in parsed.path)
+        or ("wics" in parsed.netloc and "events" in path_directories)
+        or ("cbcl" in parsed.netloc and "public_data" in path_directories)
+        or (
+            "fano" in parsed.netloc
+            and "ca" in path_directories
+            and "rules" in path_directories
+        )
+    ):
+        return True
+    queries = parse_qs(parsed.query)
+    if (
+        len(queries) > 4
+        or "ical" in queries
+        or "do" in queries
+        or "version" in queries
+        or "share" in queries
+        or (
+            "action" in queries
+            and (queries["action"][0] in ["login", "download", "edit"])
+        )
+        or ("from" in queries and re.match(r"^20\d{2}-", queries["from"][0]))
+    ):
+        return True
+    max_count = 0
+    count = 1
+    for i in range(1, len(path_directories)):
+        if path_directories[i] == path_directories[i - 1]:
+            count += 1
+        else:
+            max_count = max(max_count, count)
+            count = 1
+    return max(max_count, count) > 2
+
+
+def expected_is_valid(url):
+    """old_is_valid with the changes UrlFilter makes on purpose"""
+    # A #fragment is dropped by canonicalization, so the link is the page itself rather than a trap
+    url = url.partition("#")[0]
+    parsed = urlparse(url)
+    try:
+        parsed.port
+    except ValueError:
+        # Malformed ports are rejected
+        return False
+    # Hosts have to end with the allowed suffix instead of merely containing it
+    if not (parsed.hostname or "").endswith(".ics.uci.edu"):
+        return False
+    # .git and .gitignore are extensions, as the old pattern meant them to be
+    if parsed.path.lower().endswith((".git", ".gitignore")):
+        return False
+    return old_is_valid(url)
+
+
+SCHEMES = ["http", "https", "HTTP", "ftp", "mailto", ""]
+HOSTS = [
+    "www.ics.uci.edu",
+    "WWW.ICS.UCI.EDU",
+    "vision.ics.uci.edu",
+    "archive.ics.uci.edu",
+    "wics.ics.uci.edu",
+    "cbcl.ics.uci.edu",
+    "fano.ics.uci.edu",
+    "www.ics.uci.edu:80",
+    "www.ics.uci.edu:8080",
+    "www.ics.uci.edu:abc",
+    "user@www.ics.uci.edu",
+    "ics.uci.edu.evil.com",
+    "www.uci.edu",
+    "",
+]
+DIRECTORIES = [
+    "a", "a", "b", "pix", "pairs", "Data", "datasets", "events",
+    "public_data", "ca", "rules", "",
+]
+FILES = [
+    "", "page.html", "index.php", "file.pdf", "FILE.PDF",
+    "x.git", "x.gitignore", "data.csv", "a.", "p;x.pdf",
+]
+QUERIES = [
+    "", "", "id=3", "ical=1", "do=edit", "action=edit", "action=view", "from=2020-01",
+    "a=1&b=2&c=3&d=4&e=5",
+]
+FRAGMENTS = ["", "", "", "top"]
+
+
+def random_url(rng):
+    url = ""
+    scheme = rng.choice(SCHEMES)
+    if scheme:
+        url += scheme + ":"
+    if scheme or rng.random() < 0.5:
+        url += "//" + rng.choice(HOSTS)
+    directories = [rng.choice(DIRECTORIES) for _ in range(rng.randint(0, 6))]
+    url += "/" + "/".join(directories + [rng.choice(FILES)])
+    query = rng.choice(QUERIES)
+    if query:
+        url += "?" + query
+    fragment = rng.choice(FRAGMENTS)
+    if fragment:
+        url += "#" + fragment
+    return url
+
+
+URLS = [random_url(random.Random(seed)) for seed in range(20000)]
+
+
+def test_is_valid_agrees_with_the_old_rules_but_for_the_documented_changes():
+    url_filter = UrlFilter()
+    disagreements = [
+        url for url in URLS if url_filter.is_valid(url) != expected_is_valid(url)
+    ]
+    assert disagreements == []
+    # The generated urls exercise both verdicts and every documented change
+    assert any(url_filter.is_valid(url) for url in URLS)
+    assert any(old_is_valid(url) != expected_is_valid(url) for url in URLS)
+
+
+def test_filter_links_agrees_with_is_valid():
+    url_filter = UrlFilter()
+    for start in range(0, len(URLS), 500):
+        links = URLS[start : start + 500]
+        links += links[:50]
+        valid, invalid = url_filter.filter_links(links)
+        assert sum(valid.values()) + len(invalid) == len(links)
+        for link in links:
+            url = url_filter.canonicalize(link)
+            if url_filter.is_valid(link):
+                assert valid.get(url, 0) >= 1
+            else:
+                assert url not in valid
+
+
+def test_filter_links_counts_every_link_to_a_url():
+    valid, invalid = UrlFilter().filter_links(
+        [
+            "http://www.ics.uci.edu/a",
+            "HTTP://WWW.ICS.UCI.EDU:80/a#top",
+            "http://www.ics.uci.edu/a.pdf",
+            "http://www.ics.uci.edu/a.pdf",
+        ]
+    )
+    assert valid == {"http://www.ics.uci.edu/a": 2}
+    assert invalid == ["http://www.ics.uci.edu/a.pdf", "http://www.ics.uci.edu/a.pdf"]
+
+
+def test_verdict_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(UrlFilter, "VERDICT_CACHE_SIZE", 100)
+    url_filter = UrlFilter()
+    for start in range(0, 2000, 200):
+        url_filter.filter_links(URLS[start : start + 200])
+    assert len(url_filter.verdicts) <= 100 + 200
+
+
+@pytest.mark.parametrize(
+    "url, canonical",
+    [
+        ("HTTP://WWW.ICS.UCI.EDU:80#top", "http://www.ics.uci.edu/"),
+        ("https://www.ics.uci.edu:443/a?x=1#y", "https://www.ics.uci.edu/a?x=1"),
+        ("http://www.ics.uci.edu:8080/A/B", "http://www.ics.uci.edu:8080/A/B"),
+        ("http://User@WWW.ICS.UCI.EDU:80/a", "http://User@WWW.ICS.UCI.EDU/a"),
+        ("http://www.ics.uci.edu:abc/", None),
+        ("http://[::1", None),
+    ],
+)
+def test_canonicalize(url, canonical):
+    assert UrlFilter().canonicalize(url) == canonical
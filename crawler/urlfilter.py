@@ -0,0 +1,183 @@
+import re
+from collections import namedtuple
+from urllib.parse import parse_qs, urlsplit
+
+SCHEMES = frozenset(["http", "https"])
+
+# scheme:, //netloc, path and ?query of a url as RFC 3986 splits them, leaving out the #fragment. Every part is
+# optional, so any string matches
+URL_PARTS = re.compile(r"(?:([A-Za-z][A-Za-z0-9+.-]*):)?(?://([^/?#]*))?([^?#]*)(?:\?([^#]*))?")
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# Extensions of the files that are not web pages. The empty extension rejects paths ending with a dot
+EXTENSIONS = frozenset(
+    (
+        "css|js|bmp|gif|jpeg|jpg|ico"
+        + "|png|tif|tiff|mid|mp2|mp3|mp4|wmz"
+        + "|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf"
+        + "|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso|epub|dll|cnf|tgz|sha1"
+        + "|thmx|mso|arff|rtf|jar|csv"
+        + "|rm|smil|wmv|swf|wma|zip|rar|gz"
+        + "|lif|xml|htm|bam|h|cp|c|hqx|ff|py|git|gitignore|odp|java|ai|pov|bib|txt|class|"
+    ).split("|")
+)
+
+# Traps recognized by where they are: (a substring of the host, the directories the path holds, a substring of the
+# path). An empty substring matches anything
+TRAP_LOCATIONS = (
+    ("", frozenset(["pix"]), ""),
+    ("", frozenset(["pairs", "Data"]), ""),
+    ("archive", frozenset(), "datasets"),
+    ("wics", frozenset(["events"]), ""),
+    ("cbcl", frozenset(["public_data"]), ""),
+    ("fano", frozenset(["ca", "rules"]), ""),
+)
+
+# Query parameters of calendars, wiki actions and other pages generating endless variations of themselves
+TRAP_PARAMETERS = frozenset(["ical", "do", "version", "share"])
+TRAP_ACTIONS = frozenset(["login", "download", "edit"])
+CALENDAR_DATE = re.compile(r"20\d{2}-")
+
+
+class Url(namedtuple("Url", ["scheme", "netloc", "host", "path", "query"])):
+    """The parts of a canonical url. host is the lowercased netloc without its port or user name"""
+
+    def url(self):
+        url = f"{self.scheme}:" if self.scheme else ""
+        if self.netloc:
+            url += f"//{self.netloc}"
+        url += self.path
+        if self.query:
+            url += f"?{self.query}"
+        return url
+
+
+class UrlFilter:
+    """
+    Decides which links the crawler follows. The rules are compiled once into sets and precompiled patterns, and links
+    are canonicalized before they are checked, so links differing only in the case of their scheme or host, a default
+    port, an empty path or a #fragment are the same url to the filter and to the frontier
+    """
+
+    # Canonical urls whose verdict is remembered across pages, as the navigation links of a site repeat on all its pages
+    VERDICT_CACHE_SIZE = 100_000
+
+    def __init__(
+        self, host_suffixes=(".ics.uci.edu",), max_depth=6, max_parameters=4
+    ):
+        self.host_suffixes = tuple(host_suffixes)
+        self.max_depth = max_depth
+        self.max_parameters = max_parameters
+        self.verdicts = {}
+
+    def split(self, url):
+        """Returns the Url of the canonical form of a url, or None if it cannot be parsed"""
+        scheme, netloc, path, query = URL_PARTS.match(url).groups()
+        scheme = scheme.lower() if scheme is not None else ""
+        if netloc is None:
+            return Url(scheme, "", "", path, query or "")
+        if "@" in netloc or "[" in netloc:
+            # User names and IPv6 addresses are left to urlsplit
+            try:
+                parts = urlsplit(url)
+                port = parts.port
+            except ValueError:
+                return None
+            host = parts.hostname or ""
+            if port is not None and port == DEFAULT_PORTS.get(scheme):
+                netloc = netloc.rpartition(":")[0]
+        else:
+            netloc = netloc.lower()
+            host, _, port = netloc.partition(":")
+            if port and not (port.isascii() and port.isdigit() and int(port) < 65536):
+                return None
+            if not port or int(port) == DEFAULT_PORTS.get(scheme):
+                netloc = host
+        return Url(scheme, netloc, host, path or "/", query or "")
+
+    def canonicalize(self, url):
+        """Returns the canonical form of a url, or None if it cannot be parsed"""
+        parts = self.split(url)
+        return parts.url() if parts is not None else None
+
+    def is_valid(self, url):
+        """Returns whether a url is to be fetched"""
+        parts = self.split(url)
+        return parts is not None and self.accepts(parts)
+
+    def filter_links(self, links):
+        """
+        Canonicalizes and checks all the outlinks of a page at once, checking every distinct url once. Returns a dict
+        of the valid canonical urls with the number of links to each, and the invalid links, one per link
+        """
+        valid = {}
+        invalid = []
+        verdicts = self.verdicts
+        if len(verdicts) > self.VERDICT_CACHE_SIZE:
+            verdicts.clear()
+        for link in links:
+            parts = self.split(link)
+            url = parts.url() if parts is not None else link
+            verdict = verdicts.get(url)
+            if verdict is None:
+                verdict = verdicts[url] = parts is not None and self.accepts(parts)
+            if verdict:
+                valid[url] = valid.get(url, 0) + 1
+            else:
+                invalid.append(url)
+        return valid, invalid
+
+    def accepts(self, parts):
+        """Checks the Url of a canonical url against the rules"""
+        if parts.scheme not in SCHEMES or not parts.netloc:
+            return False
+        if not parts.host.endswith(self.host_suffixes):
+            return False
+        path = parts.path.partition(";")[0]
+        _, dot, extension = path.rpartition(".")
+        if dot and extension.lower() in EXTENSIONS:
+            return False
+        return not self.is_trap(parts.netloc, path, parts.query)
+
+    def is_trap(self, netloc, path, query):
+        """Returns whether a url looks like a crawler trap from its host, its path and its query"""
+        directories = path.split("/")
+        if len(directories) > self.max_depth:
+            return True
+        directory_set = set(directories)
+        for host_part, trap_directories, path_part in TRAP_LOCATIONS:
+            if (
+                host_part in netloc
+                and trap_directories <= directory_set
+                and path_part in path
+            ):
+                return True
+
+        if query:
+            parameters = parse_qs(query)
+            if (
+                len(parameters) > self.max_parameters
+                or not TRAP_PARAMETERS.isdisjoint(parameters)
+                or ("action" in parameters and parameters["action"][0] in TRAP_ACTIONS)
+                or (
+                    "from" in parameters
+                    and CALENDAR_DATE.match(parameters["from"][0])
+                )
+            ):
+                return True
+
+        return has_repeating_subdirectories(directories)
+
+
+def has_repeating_subdirectories(path_list):
+    """Function checks if there are more than two repeating subdirectories in the url"""
+    count = 1
+    for i in range(1, len(path_list)):
+        if path_list[i] == path_list[i - 1]:
+            count += 1
+            if count > 2:
+                return True
+        else:
+            count = 1
+    return False
@@ -0,0 +1,147 @@
+import mmap
+import os
+import struct
+from array import array
+
+# File layout (all integers little endian):
+#
+#   header   MAGIC, num_docs
+#   offsets  (num_docs + 1) uint64 offsets of the records, indexed by doc id
+#   records  per doc: title length, url length, text length and word count as
+#            uint32, the utf-8 title, url and text extract, padding to 4 bytes
+#            and word count uint32 offsets of the words inside the text
+MAGIC = b"SEDOC002"
+HEADER = struct.Struct("<8sI")
+RECORD = struct.Struct("<IIII")
+
+# Number of words of visible text kept for each document
+EXTRACT_WORDS = 200
+# Number of words shown in a snippet
+SNIPPET_WORDS = 30
+
+
+def make_extract(text):
+    return " ".join(text.split()[:EXTRACT_WORDS])
+
+
+def normalize_word(word):
+    return "".join(c for c in word.lower() if c.isalnum() and c.isascii())
+
+
+class DocStoreWriter:
+    """
+    Streams the title, text extract and url of every document, in doc id order, into the file read by DocStore
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offsets = array("Q")
+        self.file = open(path + ".tmp", "wb")
+        self.file.write(HEADER.pack(MAGIC, 0))
+        self.offset = HEADER.size
+
+    def add(self, title, text, url=""):
+        encoded_title = title.encode("utf-8")
+        encoded_url = url.encode("utf-8")
+        encoded_text = text.encode("utf-8")
+        word_offsets = array("I")
+        position = 0
+        if encoded_text:
+            for word in encoded_text.split(b" "):
+                word_offsets.append(position)
+                position += len(word) + 1
+        record = bytearray(
+            RECORD.pack(
+                len(encoded_title),
+                len(encoded_url),
+                len(encoded_text),
+                len(word_offsets),
+            )
+        )
+        record += encoded_title
+        record += encoded_url
+        record += encoded_text
+        record += bytes(-(self.offset + len(record)) % 4)
+        record += word_offsets.tobytes()
+        self.offsets.append(self.offset)
+        self.file.write(record)
+        self.offset += len(record)
+
+    def close(self):
+        num_docs = len(self.offsets)
+        self.offsets.append(self.offset)
+        self.file.write(self.offsets.tobytes())
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, num_docs))
+        self.file.close()
+        os.replace(self.path + ".tmp", self.path)
+
+
+class DocStore:
+    """
+    Memory-mapped reader for the titles, text extracts and urls written by DocStoreWriter, so result pages are built
+    without opening or parsing any HTML
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.num_docs = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a document store")
+        self.offsets_start = len(self.mm) - (self.num_docs + 1) * 8
+
+    def close(self):
+        self.mm.close()
+
+    def document(self, doc_id):
+        """Returns the (title, text, word_offsets) of a document, with the text as the utf-8 bytes the offsets point into"""
+        (offset,) = struct.unpack_from("<Q", self.mm, self.offsets_start + doc_id * 8)
+        title_length, url_length, text_length, num_words = RECORD.unpack_from(
+            self.mm, offset
+        )
+        offset += RECORD.size
+        title = self.mm[offset : offset + title_length].decode("utf-8")
+        offset += title_length + url_length
+        text = self.mm[offset : offset + text_length]
+        offset += text_length
+        offset += -offset % 4
+        word_offsets = array("I")
+        word_offsets.frombytes(self.mm[offset : offset + num_words * 4])
+        return title, text, word_offsets
+
+    def url(self, doc_id):
+        (offset,) = struct.unpack_from("<Q", self.mm, self.offsets_start + doc_id * 8)
+        title_length, url_length, _, _ = RECORD.unpack_from(self.mm, offset)
+        offset += RECORD.size + title_length
+        return self.mm[offset : offset + url_length].decode("utf-8")
+
+    def snippet(self, doc_id, terms):
+        """
+        Returns the (title, snippet) of a document, where the snippet is the window of SNIPPET_WORDS words of the extract
+        containing the most words that start with one of the query terms
+        """
+        title, text, word_offsets = self.document(doc_id)
+        word_offsets.append(len(text) + 1)
+        words = [
+            text[word_offsets[i] : word_offsets[i + 1] - 1].decode("utf-8")
+            for i in range(len(word_offsets) - 1)
+        ]
+        matches = [
+            any(normalize_word(word).startswith(term) for term in terms)
+            for word in words
+        ]
+        best_start = 0
+        best_count = count = sum(matches[:SNIPPET_WORDS])
+        for start in range(1, len(words) - SNIPPET_WORDS + 1):
+            count += matches[start + SNIPPET_WORDS - 1] - matches[start - 1]
+            if count > best_count:
+                best_start = start
+                best_count = count
+        snippet = " ".join(words[best_start : best_start + SNIPPET_WORDS])
+        if best_start > 0:
+            snippet = "... " + snippet
+        if best_start + SNIPPET_WORDS < len(words):
+            snippet += " ..."
+        return title, snippet
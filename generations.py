@@ -0,0 +1,58 @@
+import logging
+import threading
+import time
+from resultcache import files_signature
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationWatcher:
+    """
+    Holds the current generation of the loaded index and replaces it when the watched files change. A new generation is
+    loaded and warmed up in a background thread while the current one keeps serving, then swapped in with a single
+    assignment. Requests read current once and use that generation until they finish, so the old one stays alive for
+    as long as a request is still using it and is released by the garbage collector afterwards
+    """
+
+    def __init__(self, load, paths, interval=10, warm=None):
+        self.load = load
+        self.paths = paths
+        self.interval = interval
+        self.warm = warm
+        self.signature = files_signature(paths)
+        self.pending = None
+        self.current = load()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Failed to load a new index generation")
+
+    def check(self):
+        """
+        Loads a new generation once the watched files have changed and then stayed the same for a whole interval, so
+        files that are still being written are not loaded. Returns whether the generation was replaced
+        """
+        signature = files_signature(self.paths)
+        if signature == self.signature:
+            self.pending = None
+            return False
+        if signature != self.pending:
+            self.pending = signature
+            return False
+        generation = self.load()
+        if self.warm is not None:
+            self.warm(self.current, generation)
+        self.current = generation
+        self.signature = signature
+        self.pending = None
+        logger.info("Loaded a new index generation")
+        return True
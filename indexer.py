@@ -1,20 +1,114 @@
-import sys
-from bs4 import BeautifulSoup
-from tokenizer import tokenize, compute_word_frequencies
+import argparse
+from tokenizer import tokenize_batch, compute_word_frequencies, lemma_cache
 import json
 import timeit
 from nltk.tokenize import word_tokenize
 import math
-from collections import defaultdict, Counter
+from array import array
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import groupby
+from operator import itemgetter
+import heapq
+import os
+import pickle
+import shutil
+import tempfile
+from binaryindex import BinaryIndexWriter
+from docstore import DocStoreWriter, make_extract
+from pageparser import parse_html
+
+
+NUM_FOLDERS = 75
+FILES_PER_FOLDER = 500
+# Number of documents whose words are POS tagged in one call
+BATCH_SIZE = 50
+
+# Rough in-memory cost of a posting list entry, of a token position and of a dictionary term, used to decide when a
+# block is flushed
+POSTING_BYTES = 120
+POSITION_BYTES = 4
+TERM_BYTES = 150
+
+
+def load_bookkeeping(base_url):
+    """Returns the doc key -> URL table written by the crawler next to the documents, empty if there is none"""
+    try:
+        path = "/".join([base_url, "bookkeeping.json"])
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+# What a worker sends back of the folder it indexed: the doc keys and documents it read and the postings of each of
+# its partial_indexers(). Documents have no url yet, it is looked up in the parent's bookkeeping on merge
+Shard = namedtuple("Shard", ["doc_keys", "documents", "indexes"])
+
+
+def index_shard(indexer_class, base_url, store_documents, positions, folder_num):
+    """
+    Indexes a single folder in a worker process, returning its Shard, whether the folder was complete and the lemmas
+    the worker cached meanwhile, which only exist in the worker's copy of the lemma cache
+    """
+    # Documents are stored without reading bookkeeping.json in every worker
+    indexer = indexer_class(base_url, positions=positions)
+    indexer.store_documents = store_documents
+    added = lemma_cache.added
+    complete = True
+    try:
+        indexer.index_folder(folder_num)
+    except FileNotFoundError:
+        complete = False
+    shard = Shard(
+        indexer.doc_keys,
+        indexer.documents,
+        [partial_indexer.index for partial_indexer in indexer.partial_indexers()],
+    )
+    return shard, complete, lemma_cache.added_since(added)
+
+
+def read_block(path):
+    """Streams the (term, postings) pairs of a block written by Indexer.flush_block"""
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
 
 
 class Indexer:
-    def __init__(self, base_url):
+    def __init__(
+        self,
+        base_url,
+        workers=1,
+        memory_budget=None,
+        store_documents=False,
+        positions=False,
+    ):
         self.base_url = base_url
+        self.workers = workers
+        self.memory_budget = memory_budget
+        self.store_documents = store_documents
+        # Postings keep the token positions of their term in the document, for phrase and proximity queries
+        self.positions = positions
+        self.documents = []
+        self.document_bytes = 0
+        self.document_blocks = []
+        self.block_dir = None
+        self.blocks = []
+        self.block_postings = 0
+        self.block_positions = 0
+        self.posted_docs = set()
+        self.merged_path = None
         self.index = {}
+        self.doc_keys = []
         self.num_documents = 0
         self.document_frequencies = {}
-        self.lengths = defaultdict(float)
+        self.lengths = array("d")
+        self.bookkeeping = load_bookkeeping(base_url) if store_documents else {}
         self.tags = {"title": 3, "h1": 3, "h2": 2, "a": 2, "h3": 1, "b": 1}
 
     def create_index(self):
@@ -22,42 +116,272 @@ class Indexer:
             self.first_pass()
         except FileNotFoundError:
             pass
-        self.calculate_document_frequencies()
-        self.calculate_num_documents()
-        self.second_pass()
+        self.calculate_weights()
+
+    def calculate_weights(self):
+        self.lengths = array("d", [0.0]) * len(self.doc_keys)
+        if self.blocks:
+            self.flush_block()
+            self.merge_blocks()
+        else:
+            self.calculate_document_frequencies()
+            self.calculate_num_documents()
+            self.second_pass()
         self.normalize_lengths()
 
     def first_pass(self):
-        for folder_num in range(0, 75):
-            for file_num in range(0, 500):
-                full_path = "/".join([self.base_url, str(folder_num), str(file_num)])
-                content = ""
+        if self.workers > 1:
+            self.first_pass_parallel()
+            return
+        for folder_num in range(0, NUM_FOLDERS):
+            self.index_folder(folder_num)
+
+    def first_pass_parallel(self):
+        # Every folder is indexed into a partial index by a worker process. Shards are merged back in folder order, so
+        # the postings stay ordered by document, and the merge stops at the first folder with a missing file just like
+        # the sequential pass does. Shards number their documents from 0, so their doc ids are shifted on merge.
+        shard = partial(
+            index_shard,
+            type(self),
+            self.base_url,
+            self.store_documents,
+            self.positions,
+        )
+        with ProcessPoolExecutor(self.workers) as executor:
+            for indexed, complete, lemmas in executor.map(
+                shard, range(0, NUM_FOLDERS)
+            ):
+                self.merge_shard(indexed)
+                lemma_cache.update(lemmas)
+                self.check_memory()
+                if not complete:
+                    executor.shutdown(cancel_futures=True)
+                    break
+
+    def partial_indexers(self):
+        """The indexers whose postings are sent back by the workers of a parallel run, in a fixed order"""
+        return [self]
+
+    def merge_shard(self, shard):
+        offset = len(self.doc_keys)
+        self.doc_keys.extend(shard.doc_keys)
+        self.add_documents(
+            (title, text, self.bookkeeping.get(doc_key, ""))
+            for doc_key, (title, text, _) in zip(shard.doc_keys, shard.documents)
+        )
+        for indexer, index in zip(self.partial_indexers(), shard.indexes):
+            indexer.merge_postings(index, offset)
+
+    def merge_postings(self, index, offset=0):
+        for key, postings in index.items():
+            if offset:
+                for posting in postings:
+                    posting[0] += offset
+            if key not in self.index:
+                self.index[key] = postings
+            else:
+                self.index[key].extend(postings)
+            self.block_postings += len(postings)
+            if self.positions:
+                self.block_positions += sum(len(posting[3]) for posting in postings)
+
+    def block_size(self):
+        return (
+            self.block_postings * POSTING_BYTES
+            + self.block_positions * POSITION_BYTES
+            + len(self.index) * TERM_BYTES
+            + self.document_bytes
+        )
+
+    def check_memory(self):
+        if self.memory_budget is not None and self.block_size() >= self.memory_budget:
+            self.flush_block()
+
+    def flush_block(self):
+        """Writes the in-memory postings to disk as a run sorted by term and starts a new, empty block"""
+        if self.block_dir is None and (self.index or self.documents):
+            self.block_dir = tempfile.mkdtemp(prefix="index-blocks-")
+        if self.documents:
+            path = os.path.join(self.block_dir, f"documents{len(self.document_blocks)}.pkl")
+            with open(path, "wb") as f:
+                pickle.dump(self.documents, f, pickle.HIGHEST_PROTOCOL)
+            self.document_blocks.append(path)
+            self.documents = []
+            self.document_bytes = 0
+        if not self.index:
+            return
+        path = os.path.join(self.block_dir, f"block{len(self.blocks)}.pkl")
+        with open(path, "wb") as f:
+            for key in sorted(self.index):
+                postings = self.index[key]
+                for posting in postings:
+                    self.posted_docs.add(posting[0])
+                pickle.dump((key, postings), f, pickle.HIGHEST_PROTOCOL)
+        self.blocks.append(path)
+        self.index = {}
+        self.block_postings = 0
+        self.block_positions = 0
+
+    def merge_runs(self):
+        # Blocks were written in document order, and heapq.merge keeps equal terms in the order of the blocks, so the
+        # concatenated postings of a term stay ordered by document.
+        runs = [read_block(path) for path in self.blocks]
+        for key, group in groupby(heapq.merge(*runs, key=itemgetter(0)), itemgetter(0)):
+            postings = []
+            for _, block_postings in group:
+                postings.extend(block_postings)
+            yield key, postings
+
+    def merge_blocks(self):
+        """
+        K-way merges the flushed blocks into a single run of weighted postings, holding only one term's postings in
+        memory at a time
+        """
+        self.num_documents = len(self.posted_docs)
+        self.merged_path = os.path.join(self.block_dir, "merged.pkl")
+        with open(self.merged_path, "wb") as f:
+            for key, postings in self.merge_runs():
+                df = len(postings)
+                self.document_frequencies[key] = df
+                for posting in postings:
+                    tf_idf = self.calculate_tf_idf(posting[1], df)
+                    posting[2] = tf_idf
+                    self.lengths[posting[0]] += tf_idf**2
+                pickle.dump((key, postings), f, pickle.HIGHEST_PROTOCOL)
+        for path in self.blocks:
+            os.remove(path)
+        self.blocks = []
+
+    def close(self):
+        """Removes the temporary block files of a block-based run"""
+        if self.block_dir is not None:
+            shutil.rmtree(self.block_dir, ignore_errors=True)
+            self.block_dir = None
+            self.merged_path = None
+
+    def index_folder(self, folder_num):
+        # Documents are analyzed in batches so their words are POS tagged together. A missing file still ends the
+        # folder, after the documents read before it have been indexed.
+        doc_keys = []
+        contents = []
+        for file_num in range(0, FILES_PER_FOLDER):
+            full_path = "/".join([self.base_url, str(folder_num), str(file_num)])
+            content = ""
+            try:
                 with open(full_path, "r", encoding="utf-8") as f:
                     content = f.read()
-                soup = BeautifulSoup(content, "html.parser")
-                words = word_tokenize(soup.get_text(separator=" "))
-                tokens = tokenize(words)
-                word_frequencies = compute_word_frequencies(tokens)
-                weighted_words = self.extract_weighted_tags(soup)
-                raw_tfs = dict(Counter(word_frequencies) + Counter(weighted_words))
-                for key in tokens:
-                    doc_key = str(folder_num) + "/" + str(file_num)
-                    raw_tf = raw_tfs[key]
-                    pair = [doc_key, raw_tf, 0]
-                    if key not in self.index:
-                        self.index[key] = [pair]
-                    else:
-                        if self.index[key][-1][0] != doc_key:
-                            self.index[key].append(pair)
-                print("Folder", folder_num, "File", file_num)
-
-    def extract_weighted_tags(self, soup):
+            except FileNotFoundError:
+                self.index_documents(doc_keys, contents)
+                raise
+            doc_keys.append(str(folder_num) + "/" + str(file_num))
+            contents.append(content)
+            if len(contents) == BATCH_SIZE:
+                self.index_documents(doc_keys, contents)
+                doc_keys = []
+                contents = []
+        self.index_documents(doc_keys, contents)
+
+    def index_files(self, doc_keys):
+        """Indexes the documents stored under base_url at the given doc keys, such as "0/12", in batches"""
+        for start in range(0, len(doc_keys), BATCH_SIZE):
+            batch = doc_keys[start : start + BATCH_SIZE]
+            contents = []
+            for doc_key in batch:
+                path = "/".join([self.base_url, doc_key])
+                with open(path, "r", encoding="utf-8") as f:
+                    contents.append(f.read())
+            self.index_documents(batch, contents)
+
+    def index_documents(self, doc_keys, contents):
+        # Doc ids are assigned densely in the order documents are read, and are the positions in doc_keys
+        for doc_key, (tokens, tag_tokens, summary) in zip(
+            doc_keys, self.analyze_batch(contents)
+        ):
+            doc_id = len(self.doc_keys)
+            self.doc_keys.append(doc_key)
+            document = summary + (self.bookkeeping.get(doc_key, ""),)
+            self.index_analyzed(doc_id, tokens, tag_tokens, document)
+            folder_num, file_num = doc_key.split("/")
+            print("Folder", folder_num, "File", file_num)
+        self.check_memory()
+
+    def index_document(self, doc_key, content):
+        self.index_documents([doc_key], [content])
+
+    def index_analyzed(self, doc_id, tokens, tag_tokens, document):
+        self.index_tokens(doc_id, tokens, tag_tokens)
+        if self.store_documents:
+            self.add_documents([document])
+
+    def add_documents(self, documents):
+        """Keeps the (title, extract, url) of documents for the document store"""
+        for title, text, url in documents:
+            self.documents.append((title, text, url))
+            self.document_bytes += len(title) + len(text) + len(url)
+
+    def analyze(self, content):
+        return self.analyze_batch([content])[0]
+
+    def analyze_batch(self, contents):
+        """
+        Parses every document once, returning for each its tokens, the tokens found inside each weighted tag and a
+        (title, extract) summary for the document store. The word lists of the whole batch are tokenized together
+        """
+        if not contents:
+            return []
+        word_lists = []
+        summaries = []
+        for content in contents:
+            page = parse_html(content, self.tags)
+            summaries.append((page.title, make_extract(page.text)))
+            word_lists.append(word_tokenize(page.text))
+            for tag in self.tags:
+                words = []
+                for element_text in page.tag_text[tag]:
+                    words += word_tokenize(element_text.strip())
+                word_lists.append(words)
+
+        token_lists = iter(tokenize_batch(word_lists))
+        analyzed = []
+        for summary in summaries:
+            tokens = next(token_lists)
+            tag_tokens = {tag: next(token_lists) for tag in self.tags}
+            analyzed.append((tokens, tag_tokens, summary))
+        return analyzed
+
+    def index_tokens(self, doc_id, tokens, tag_tokens):
+        word_frequencies = compute_word_frequencies(tokens)
+        weighted_words = self.extract_weighted_tags(tag_tokens)
+        raw_tfs = dict(Counter(word_frequencies) + Counter(weighted_words))
+        if self.positions:
+            positions = {}
+            for position, key in enumerate(tokens):
+                if key not in positions:
+                    positions[key] = array("I")
+                positions[key].append(position)
+            for key, key_positions in positions.items():
+                self.add_posting(key, doc_id, raw_tfs[key], key_positions)
+            return
+        for key in tokens:
+            self.add_posting(key, doc_id, raw_tfs[key])
+
+    def add_posting(self, key, doc_id, raw_tf, positions=None):
+        pair = [doc_id, raw_tf, 0]
+        if key not in self.index:
+            self.index[key] = [pair]
+        else:
+            if self.index[key][-1][0] == doc_id:
+                return
+            self.index[key].append(pair)
+        self.block_postings += 1
+        if positions is not None:
+            pair.append(positions)
+            self.block_positions += len(positions)
+
+    def extract_weighted_tags(self, tag_tokens):
         weighted_tag_words = {}
         for tag in self.tags:
-            words = []
-            for i in soup.find_all(tag):
-                words += word_tokenize(i.text.strip())
-            for word in tokenize(words):
+            for word in tag_tokens[tag]:
                 if word not in weighted_tag_words:
                     weighted_tag_words[word] = self.tags[tag]
                 else:
@@ -79,11 +403,11 @@ class Indexer:
         for key in self.index:
             df = self.document_frequencies[key]
             for i in range(len(self.index[key])):
-                doc_key = self.index[key][i][0]
+                doc_id = self.index[key][i][0]
                 raw_tf = self.index[key][i][1]
                 tf_idf = self.calculate_tf_idf(raw_tf, df)
                 self.index[key][i][2] = tf_idf
-                self.lengths[doc_key] += tf_idf**2
+                self.lengths[doc_id] += tf_idf**2
 
     def calculate_tf_idf(self, raw_tf, df):
         tf = 1 + math.log10(raw_tf)
@@ -91,12 +415,24 @@ class Indexer:
         return tf * idf
 
     def normalize_lengths(self):
-        for i in self.lengths:
-            self.lengths[i] = math.log10(math.sqrt(self.lengths[i]))
+        # Documents without postings have no length
+        for i in range(len(self.lengths)):
+            if self.lengths[i] > 0:
+                self.lengths[i] = math.log10(math.sqrt(self.lengths[i]))
+            else:
+                self.lengths[i] = math.nan
 
     def get_index(self):
         return self.index
 
+    def iter_index(self):
+        """Yields (term, postings) pairs in term order, from memory or from the merged run of a block-based run"""
+        if self.merged_path is None:
+            for key in sorted(self.index):
+                yield key, self.index[key]
+        else:
+            yield from read_block(self.merged_path)
+
     def get_num_documents(self):
         return self.num_documents
 
@@ -104,19 +440,108 @@ class Indexer:
         return self.document_frequencies
 
     def get_lengths(self):
-        return self.lengths
+        """Returns the lengths keyed by doc key, the shape of the legacy lengths.json"""
+        return {
+            self.doc_keys[doc_id]: length
+            for doc_id, length in enumerate(self.lengths)
+            if not math.isnan(length)
+        }
+
+    def save_binary(self, path, tier_size=None):
+        writer = BinaryIndexWriter(
+            path,
+            self.doc_keys,
+            self.lengths,
+            self.num_documents,
+            tier_size,
+            self.positions,
+        )
+        for key, postings in self.iter_index():
+            writer.add(key, postings)
+        writer.close()
+
+    def save_docstore(self, path):
+        writer = DocStoreWriter(path)
+        for block in self.document_blocks:
+            with open(block, "rb") as f:
+                for document in pickle.load(f):
+                    writer.add(*document)
+        for document in self.documents:
+            writer.add(*document)
+        writer.close()
+
+    def save_json(self, path):
+        with open(path, "w") as f:
+            f.write("{")
+            separator = ""
+            for key, postings in self.iter_index():
+                postings = [
+                    [self.doc_keys[posting[0]], posting[1], posting[2]]
+                    + [list(positions) for positions in posting[3:]]
+                    for posting in postings
+                ]
+                f.write(separator + json.dumps(key) + ": " + json.dumps(postings))
+                separator = ", "
+            f.write("}")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("base_url")
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="write the legacy index.json/lengths.json/size.json files instead of index.bin",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes the folders are indexed with",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        help="flush sorted blocks to disk whenever the in-memory index grows past this many megabytes",
+    )
+    parser.add_argument(
+        "--tier-size",
+        type=int,
+        help="split postings lists longer than this into a high and a low impact tier",
+    )
+    parser.add_argument(
+        "--lemma-cache",
+        help="file the (word, pos) -> lemma memo is loaded from and saved to, so later runs start warm",
+    )
+    parser.add_argument(
+        "--positions",
+        action="store_true",
+        help="store token positions for phrase and proximity queries, which makes index2.bin unnecessary",
+    )
+    args = parser.parse_args()
     start = timeit.default_timer()
-    base_url = sys.argv[1]
-    indexer = Indexer(base_url)
+    if args.lemma_cache:
+        lemma_cache.load(args.lemma_cache)
+    memory_budget = args.memory_budget * 2**20 if args.memory_budget else None
+    indexer = Indexer(
+        args.base_url,
+        workers=args.workers,
+        memory_budget=memory_budget,
+        store_documents=True,
+        positions=args.positions,
+    )
     indexer.create_index()
-    with open("index.json", "a") as f:
-        json.dump(indexer.get_index(), f, indent=4)
-    with open("lengths.json", "a") as f:
-        json.dump(indexer.get_lengths(), f, indent=4)
-    with open("size.json", "a") as f:
-        json.dump(indexer.get_num_documents, f, indent=4)
+    indexer.save_docstore("docstore.bin")
+    if args.json:
+        indexer.save_json("index.json")
+        with open("lengths.json", "a") as f:
+            json.dump(indexer.get_lengths(), f, indent=4)
+        with open("size.json", "a") as f:
+            json.dump(indexer.get_num_documents(), f, indent=4)
+    else:
+        indexer.save_binary("index.bin", args.tier_size)
+    indexer.close()
+    if args.lemma_cache:
+        lemma_cache.save(args.lemma_cache)
     stop = timeit.default_timer()
     print("Time: ", stop - start, "seconds")
@@ -0,0 +1,142 @@
+import math
+import numpy as np
+from ranker import Ranker, proximity
+
+# Doc id gaps are below 2**32, so none of their varints is longer than this
+MAX_GAP_BYTES = 5
+
+
+def decode_varints(buffer, offset, count):
+    """
+    Decodes count varints starting at offset all at once, returning them as an int64 array. Every byte below 0x80 ends
+    a value, and the 7 bit groups of a value are shifted by their position inside it and summed with reduceat
+    """
+    if count == 0:
+        return np.zeros(0, np.int64)
+    size = min(count * MAX_GAP_BYTES, len(buffer) - offset)
+    data = np.frombuffer(buffer, np.uint8, size, offset)
+    ends = np.flatnonzero(data < 0x80)[:count]
+    starts = np.zeros(count, np.int64)
+    starts[1:] = ends[:-1] + 1
+    groups = (data[: ends[-1] + 1] & 0x7F).astype(np.int64)
+    shifts = np.arange(len(groups)) - np.repeat(starts, ends - starts + 1)
+    return np.add.reduceat(groups << (7 * shifts), starts)
+
+
+def postings_arrays(index, entry):
+    """Returns the doc ids and weights of both tiers of a term as arrays, leaving the raw term frequencies undecoded"""
+    weights = np.frombuffer(index.mm, np.float32, entry.high_df, entry.offset)
+    gaps = decode_varints(index.mm, entry.offset + 4 * entry.high_df, entry.high_df)
+    doc_ids = np.cumsum(gaps)
+    if entry.high_df < entry.df:
+        size = entry.df - entry.high_df
+        low_doc_ids = np.frombuffer(index.mm, np.uint32, size, entry.low_offset)
+        low_weights = np.frombuffer(index.mm, np.float32, size, entry.low_offset + 4 * size)
+        doc_ids = np.concatenate([doc_ids, low_doc_ids])
+        weights = np.concatenate([weights, low_weights])
+    return doc_ids, weights
+
+
+class NumpyRanker(Ranker):
+    """
+    Ranker scoring every posting of the query terms at once. The postings of all terms are decoded into arrays, their
+    contributions are scattered into a dense score vector with bincount and the top k is picked with argpartition. Ties
+    are broken by doc id, so the results are the same as the MaxScore evaluation of Ranker, and the number of results is
+    counted exactly instead of estimated. Incremental indexes are still ranked segment by segment by Ranker
+    """
+
+    def rankIndex(self, index, bigramsIndex, query, k):
+        if any(index.find(term) is None for term in query.required):
+            return [], 0
+        doc_ids = []
+        contributions = []
+        required = np.ones(index.num_docs, bool)
+        lengths = np.asarray(index.lengths_array)
+        sources = [(index, query.terms)]
+        if query.bigrams:
+            sources.append((bigramsIndex, query.bigrams))
+        for term_index, term_list in sources:
+            term_lengths = np.asarray(term_index.lengths_array)
+            for term in term_list:
+                entry = term_index.find(term)
+                if entry is None:
+                    continue
+                ids, weights = postings_arrays(term_index, entry)
+                # Bigrams are weighted against the number of documents of the collection, like the terms are
+                weight_tq = 1 * math.log(index.num_documents / entry.df)
+                if term_index is index and term in query.required:
+                    held = np.zeros(index.num_docs, bool)
+                    held[ids] = True
+                    required &= held
+                doc_ids.append(ids)
+                contributions.append(
+                    weight_tq * weights.astype(np.float64) / term_lengths[ids]
+                )
+        if not doc_ids:
+            return [], 0
+
+        entries = {}
+        if query.pairs or query.phrases:
+            entries = {term: index.find(term) for term in query.terms}
+        for pair_doc_ids, proximities in self.pairProximities(
+            index, entries, query.pairs
+        ):
+            if pair_doc_ids:
+                ids = np.array(pair_doc_ids, np.int64)
+                idf = index.num_documents / len(ids)
+                doc_ids.append(ids)
+                contributions.append(
+                    math.log(idf)
+                    * math.log10(idf)
+                    * np.array(proximities)
+                    / lengths[ids]
+                )
+
+        doc_ids = np.concatenate(doc_ids)
+        scores = np.bincount(
+            doc_ids, weights=np.concatenate(contributions), minlength=index.num_docs
+        )
+        matched = np.zeros(index.num_docs, bool)
+        matched[doc_ids] = True
+        matched &= required
+        matched[list(self.excludedDocuments(index, query.excluded))] = False
+        if query.phrases:
+            # Only documents containing every phrase are results
+            phrase_matched = np.zeros(index.num_docs, bool)
+            phrase_matched[self.matchPhrases(index, entries, query.phrases)] = True
+            matched &= phrase_matched
+        candidates = np.flatnonzero(matched)
+        candidate_scores = scores[candidates]
+        if len(candidates) > k:
+            # Every document scoring at least the k-th best score is kept, so ties at the cut are broken by doc id.
+            kth = np.argpartition(-candidate_scores, k - 1)[k - 1]
+            best = candidate_scores >= candidate_scores[kth]
+            candidates = candidates[best]
+            candidate_scores = candidate_scores[best]
+        order = np.lexsort((candidates, -candidate_scores))[:k]
+        return candidates[order].tolist(), int(np.count_nonzero(matched))
+
+    def pairProximities(self, index, entries, pairs):
+        """
+        Returns the (doc_ids, proximities) of every pair of terms: the documents holding both terms and the proximity
+        of the terms in each of them. Every posting is scored here, so the positions of all of them are decoded
+        """
+        proximities = []
+        for (first, second), doc_ids in zip(
+            pairs, self.pairDocuments(index, entries, pairs)
+        ):
+            if not doc_ids:
+                proximities.append(([], []))
+                continue
+            first_positions = index.positions(entries[first], doc_ids)
+            second_positions = index.positions(entries[second], doc_ids)
+            proximities.append(
+                (
+                    doc_ids,
+                    [
+                        proximity(first_positions[doc_id], second_positions[doc_id])
+                        for doc_id in doc_ids
+                    ],
+                )
+            )
+        return proximities
@@ -0,0 +1,209 @@
+from html.parser import HTMLParser
+from typing import NamedTuple
+from urllib.parse import urljoin
+
+# lxml parses pages in C and is used when it is installed, with the standard library parser as the fallback. Both feed
+# the same PageBuilder, so a page is parsed the same whichever parser is used
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+# Elements whose text is not shown on the page
+HIDDEN_ELEMENTS = frozenset(["script", "style", "template"])
+# Elements without an end tag, which html.parser reports no end for
+VOID_ELEMENTS = frozenset(
+    [
+        "area",
+        "base",
+        "br",
+        "col",
+        "embed",
+        "hr",
+        "img",
+        "input",
+        "link",
+        "meta",
+        "param",
+        "source",
+        "track",
+        "wbr",
+    ]
+)
+
+
+class Page(NamedTuple):
+    """
+    What the crawler and the indexer use of a page: its visible text, the text of its first title, the text of every
+    element of each of the tags asked for and the targets of its links, made absolute when the page was parsed with a
+    base url
+    """
+
+    text: str
+    title: str
+    tag_text: dict[str, list[str]]
+    links: list[str]
+
+
+class PageBuilder:
+    """
+    Parser target collecting a Page from the start, end and text events of a single pass over the page. An end tag
+    closes every element opened after the last open element it names, and an end tag naming no open element is
+    ignored, the way browsers recover from tags closed out of order
+
+    The text is built the way BeautifulSoup's get_text(separator=" ") and .text build it: the visible text puts a
+    space between strings separated by a tag or a comment, while the text of an element joins its strings as they are
+    """
+
+    def __init__(self, tags=(), base_url=None):
+        self.base_url = base_url
+        # The names of the open elements, with the strings of those of a tag asked for
+        self.open_elements = []
+        self.hidden = 0
+        self.strings = []
+        self.tag_strings = {tag: [] for tag in tags}
+        # The strings of the open elements of the tags asked for, which the text is also added to
+        self.open_strings = []
+        self.title_strings = None
+        self.in_title = False
+        self.hrefs = []
+        # Whether the last event was text, which the next text continues
+        self.in_text = False
+
+    def start(self, tag, attrib):
+        self.in_text = False
+        if tag == "a":
+            href = attrib.get("href")
+            if href is not None:
+                self.hrefs.append(href)
+        if tag in VOID_ELEMENTS:
+            return
+        strings = None
+        if tag in self.tag_strings:
+            # Elements are kept in the order they start, as find_all returns them
+            strings = []
+            self.tag_strings[tag].append(strings)
+            self.open_strings.append(strings)
+        self.open_elements.append((tag, strings))
+        if tag in HIDDEN_ELEMENTS:
+            self.hidden += 1
+        elif tag == "title" and self.title_strings is None:
+            self.title_strings = []
+            self.in_title = True
+
+    def end(self, tag):
+        self.in_text = False
+        if not any(name == tag for name, _ in self.open_elements):
+            return
+        while True:
+            closed, strings = self.open_elements.pop()
+            if closed in HIDDEN_ELEMENTS:
+                self.hidden -= 1
+            elif closed == "title":
+                self.in_title = False
+            if strings is not None:
+                self.open_strings.pop()
+            if closed == tag:
+                return
+
+    def data(self, data):
+        if self.hidden:
+            return
+        for strings in self.open_strings:
+            strings.append(data)
+        if self.in_title:
+            self.title_strings.append(data)
+        if self.in_text:
+            # lxml splits text at entities, which is glued back so words such as AT&amp;T stay whole
+            self.strings[-1] += data
+        else:
+            self.in_text = True
+            self.strings.append(data)
+
+    def comment(self, text):
+        self.in_text = False
+
+    def pi(self, target, data=None):
+        self.in_text = False
+
+    def close(self):
+        links = []
+        for href in self.hrefs:
+            if self.base_url is None:
+                links.append(href)
+                continue
+            try:
+                links.append(urljoin(self.base_url, href))
+            except ValueError:
+                # Malformed targets such as an unclosed IPv6 address
+                continue
+        return Page(
+            " ".join(self.strings),
+            "".join(self.title_strings or []).strip(),
+            {
+                tag: ["".join(strings) for strings in elements]
+                for tag, elements in self.tag_strings.items()
+            },
+            links,
+        )
+
+
+class StreamingParser(HTMLParser):
+    """Feeds the events of the standard library parser to a PageBuilder"""
+
+    def __init__(self, target):
+        super().__init__(convert_charrefs=True)
+        self.target = target
+
+    def handle_starttag(self, tag, attrs):
+        self.target.start(tag, dict(attrs))
+
+    def handle_endtag(self, tag):
+        self.target.end(tag)
+
+    def handle_data(self, data):
+        self.target.data(data)
+
+    def handle_comment(self, data):
+        self.target.comment(data)
+
+    def handle_pi(self, data):
+        self.target.pi(data)
+
+    def handle_decl(self, decl):
+        self.target.comment(decl)
+
+    def unknown_decl(self, data):
+        self.target.comment(data)
+
+
+def decode(content):
+    """Decodes the bytes of a page as UTF-8, or as Windows-1252 as browsers do when they are not UTF-8"""
+    try:
+        return content.decode("utf-8")
+    except UnicodeDecodeError:
+        return content.decode("cp1252", "replace")
+
+
+def parse_html(content, tags=(), base_url=None):
+    """
+    Parses a page, given as bytes or str, in a single pass, returning its Page with the text of the elements of each
+    of the tags. Links are made absolute against base_url when one is given
+    """
+    if isinstance(content, bytes):
+        content = decode(content)
+    builder = PageBuilder(tags, base_url)
+    if not content:
+        return builder.close()
+    if etree is not None:
+        parser = etree.HTMLParser(target=builder)
+        try:
+            parser.feed(content)
+            return parser.close()
+        except etree.LxmlError:
+            # What was parsed before the error is kept
+            return builder.close()
+    parser = StreamingParser(builder)
+    parser.feed(content)
+    parser.close()
+    return builder.close()
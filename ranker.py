@@ -1,74 +1,777 @@
-from collections import defaultdict
+from bisect import bisect_left
+from collections import namedtuple
+import heapq
 import math
-from bs4 import BeautifulSoup
+from binaryindex import SKIP_INTERVAL, PositionsReader
+from segments import SegmentedIndex
+from shards import ShardedIndex
+from tokenizer import parse_query
+
+RESULTS_PER_PAGE = 20
+
+# The distinct terms of a query and how its word order is scored: bigrams looked up in the bigram index, or for an
+# index with positions the adjacent term pairs scored by their proximity and the quoted phrases every result contains.
+# required holds the terms every result contains and excluded the token tuples of the words and phrases none contains
+AnalyzedQuery = namedtuple(
+    "AnalyzedQuery", ["terms", "bigrams", "pairs", "phrases", "required", "excluded"]
+)
+
+# What a query looked up in one segment or shard of a collection: the TermEntry of every term, or None, the doc ids of
+# the documents holding both terms of every term pair and the TermEntry of every bigram
+PartLookup = namedtuple("PartLookup", ["entries", "pair_doc_ids", "bigram_entries"])
+# The document count and the document frequencies of the terms, term pairs and bigrams of a query, in query order.
+# The statistics of the segments or shards of a collection add up to its own
+Statistics = namedtuple(
+    "Statistics", ["num_documents", "dfs", "pair_dfs", "bigram_dfs"]
+)
+
+
+def add_statistics(parts):
+    """Sums the Statistics of the segments or shards of a collection"""
+    return Statistics(
+        sum(part.num_documents for part in parts),
+        [sum(dfs) for dfs in zip(*(part.dfs for part in parts))],
+        [sum(dfs) for dfs in zip(*(part.pair_dfs for part in parts))],
+        [sum(dfs) for dfs in zip(*(part.bigram_dfs for part in parts))],
+    )
+
+
+def proximity(first, second):
+    """Returns 1 / the smallest distance between a position in first and a position in second, both sorted"""
+    i = 0
+    j = 0
+    distance = math.inf
+    while i < len(first) and j < len(second):
+        if first[i] < second[j]:
+            distance = min(distance, second[j] - first[i])
+            i += 1
+        else:
+            distance = min(distance, first[i] - second[j])
+            j += 1
+    return 1 / distance
+
+
+def occurs_as_phrase(positions):
+    """Returns whether the position lists of the consecutive terms of a phrase hold a run of consecutive positions"""
+    starts = set(positions[0])
+    for offset, term_positions in enumerate(positions[1:], 1):
+        starts.intersection_update(position - offset for position in term_positions)
+        if not starts:
+            return False
+    return True
+
+
+def common_documents(index, entries):
+    """Returns the sorted doc ids of the documents holding every term of the entries"""
+    entries = sorted(entries, key=lambda entry: entry.df)
+    doc_ids = set(index.document_ids(entries[0]))
+    for entry in entries[1:]:
+        doc_ids.intersection_update(index.document_ids(entry))
+    return sorted(doc_ids)
+
+
+class RankedResults(namedtuple("RankedResults", ["doc_ids", "num_results", "terms"])):
+    """
+    The ranked doc ids of a query, best first, with the estimated number of matching documents and the analyzed query
+    terms the snippets of the results are biased towards
+    """
+
+    def page(self, offset):
+        return self._replace(doc_ids=self.doc_ids[offset : offset + RESULTS_PER_PAGE])
+
+
+class PostingsCursor:
+    """
+    Walks the postings of one query term in document order. The contribution of a posting to a document's score is
+    weight_tq * tf_idf / length, and bound is the largest contribution any posting of the term can make
+    """
+
+    def __init__(self, index, entry, num_documents=None, df=None, corpus_size=None):
+        self.doc_ids, _, self.weights = index.read_postings(entry.offset, entry.high_df)
+        self.size = entry.high_df
+        self.weigh(index, entry, num_documents, df, entry.max_impact, corpus_size)
+
+    def weigh(self, index, entry, num_documents, df, max_impact, corpus_size=None):
+        """
+        Sets the query weight of the term. Segments of an incremental index store term frequencies without idf, so
+        when the document count and frequency of the whole collection are given the idf is applied here instead.
+        Otherwise the idf is taken against corpus_size, the document count of the unigram index for bigrams, or the
+        document count of the term's own index
+        """
+        self.lengths = index.lengths_array
+        if num_documents is None:
+            if corpus_size is None:
+                corpus_size = index.num_documents
+            self.weight_tq = 1 * math.log(corpus_size / entry.df)
+        else:
+            idf = num_documents / df
+            self.weight_tq = math.log(idf) * math.log10(idf)
+        self.bound = max(0.0, self.weight_tq * max_impact)
+        self.pos = 0
+
+    def doc(self):
+        if self.pos < self.size:
+            return self.doc_ids[self.pos]
+        return None
+
+    def score(self):
+        doc_id = self.doc_ids[self.pos]
+        return self.weight_tq * self.weights[self.pos] / self.lengths[doc_id]
+
+    def next(self):
+        self.pos += 1
+
+    def advance(self, doc_id):
+        """Moves to the first posting whose doc id is greater than or equal to doc_id"""
+        self.pos = bisect_left(self.doc_ids, doc_id, self.pos)
+
+    def position(self):
+        """Returns the number of postings walked past"""
+        return self.pos
+
+
+class TierCursor(PostingsCursor):
+    """
+    Cursor over the low tier of a tiered term. The tier is read in place from the index, so advancing it only costs a
+    binary search and its postings are never decoded as a whole
+    """
+
+    def __init__(self, index, entry, num_documents=None, df=None, corpus_size=None):
+        self.doc_ids, self.weights = index.low_tier(entry)
+        self.size = entry.df - entry.high_df
+        self.weigh(index, entry, num_documents, df, entry.low_max_impact, corpus_size)
+
+
+class ScoredCursor(PostingsCursor):
+    """Cursor over documents whose scores are computed up front, such as the proximity scores of a pair of terms"""
+
+    def __init__(self, doc_ids, scores):
+        self.doc_ids = doc_ids
+        self.scores = scores
+        self.size = len(doc_ids)
+        self.bound = max(0.0, max(scores, default=0.0))
+        self.pos = 0
+
+    def score(self):
+        return self.scores[self.pos]
+
+
+class ProximityCursor(PostingsCursor):
+    """
+    Cursor over the documents holding both terms of a pair, scored by the proximity of the terms. The positions of the
+    terms are only decoded for the documents that are scored, so a pair of common words is not read as a whole when
+    its documents are only looked up for the candidates of the other cursors
+    """
+
+    def __init__(self, index, first, second, doc_ids, weight):
+        self.doc_ids = doc_ids
+        self.size = len(doc_ids)
+        self.weight = weight
+        self.lengths = index.lengths_array
+        self.first = PositionsReader(index, first)
+        self.second = PositionsReader(index, second)
+        # The terms are at least one position apart, so a proximity is at most 1
+        self.bound = max(
+            0.0, weight / min(self.lengths[doc_id] for doc_id in doc_ids)
+        )
+        self.pos = 0
+
+    def score(self):
+        doc_id = self.doc_ids[self.pos]
+        doc_proximity = proximity(self.first.seek(doc_id), self.second.seek(doc_id))
+        return self.weight * doc_proximity / self.lengths[doc_id]
+
+
+class BlockCursor(PostingsCursor):
+    """
+    Cursor over both tiers of a term that only decodes the blocks of the high tier it lands in. Advancing binary
+    searches the last doc ids of the blocks, so jumping ahead skips whole blocks without decoding them, and the low tier
+    is binary searched in place
+    """
+
+    def __init__(self, index, entry, num_documents=None, df=None):
+        self.index = index
+        self.entry = entry
+        self.size = entry.df
+        self.high_weights = memoryview(index.mm)[
+            entry.offset : entry.offset + entry.high_df * 4
+        ].cast("f")
+        self.headers = index.block_headers(entry)
+        self.num_blocks = -(-entry.high_df // SKIP_INTERVAL)
+        self.low_doc_ids, self.low_weights = index.low_tier(entry)
+        self.low_pos = 0
+        self.load(0)
+        self.update()
+        self.weigh(
+            index,
+            entry,
+            num_documents,
+            df,
+            max(entry.max_impact, entry.low_max_impact),
+        )
+
+    def load(self, block):
+        self.block = block
+        self.offset = 0
+        self.block_doc_ids = []
+        if block < self.num_blocks:
+            self.block_doc_ids = self.index.read_block(self.entry, block, self.headers)
+
+    def update(self):
+        """Sets the current document to the lower of the current documents of the tiers"""
+        high = None
+        if self.offset < len(self.block_doc_ids):
+            high = self.block_doc_ids[self.offset]
+        self.in_high = True
+        self.current = high
+        if self.low_pos < len(self.low_doc_ids):
+            low = self.low_doc_ids[self.low_pos]
+            if high is None or low < high:
+                self.in_high = False
+                self.current = low
+
+    def doc(self):
+        return self.current
+
+    def score(self):
+        if self.in_high:
+            weight = self.high_weights[self.block * SKIP_INTERVAL + self.offset]
+        else:
+            weight = self.low_weights[self.low_pos]
+        return self.weight_tq * weight / self.lengths[self.current]
+
+    def next(self):
+        if self.in_high:
+            self.offset += 1
+            if self.offset == len(self.block_doc_ids):
+                self.load(self.block + 1)
+        else:
+            self.low_pos += 1
+        self.update()
+
+    def advance(self, doc_id):
+        if self.current is None or self.current >= doc_id:
+            return
+        if self.block_doc_ids and self.block_doc_ids[-1] < doc_id:
+            block = self.num_blocks
+            if self.headers is not None:
+                block = bisect_left(self.headers[0], doc_id, self.block + 1)
+            self.load(block)
+        self.offset = bisect_left(self.block_doc_ids, doc_id, self.offset)
+        self.low_pos = bisect_left(self.low_doc_ids, doc_id, self.low_pos)
+        self.update()
+
+    def position(self):
+        high_pos = min(self.block * SKIP_INTERVAL + self.offset, self.entry.high_df)
+        return high_pos + self.low_pos
+
+
+class ConjunctionCursor(PostingsCursor):
+    """
+    Cursor over the documents held by every one of its cursors that are not in exclude, scored by the sum of their
+    scores. The cursors are intersected starting from the rarest: every other cursor jumps straight to its current
+    document, and a cursor overshooting it makes its own document the next candidate
+    """
+
+    def __init__(self, cursors, exclude=frozenset()):
+        self.cursors = sorted(cursors, key=lambda cursor: cursor.size)
+        self.exclude = exclude
+        self.size = self.cursors[0].size
+        self.bound = sum(cursor.bound for cursor in cursors)
+        self.count = 0
+        self.settle(0)
+
+    def settle(self, doc_id):
+        """Moves to the first document from doc_id on that every cursor holds"""
+        while True:
+            for cursor in self.cursors:
+                cursor.advance(doc_id)
+                current = cursor.doc()
+                if current is None:
+                    self.current = None
+                    return
+                if current != doc_id:
+                    doc_id = current
+                    break
+            else:
+                if doc_id not in self.exclude:
+                    self.current = doc_id
+                    self.count += 1
+                    return
+                doc_id += 1
+
+    def doc(self):
+        return self.current
+
+    def score(self):
+        return sum(cursor.score() for cursor in self.cursors)
+
+    def next(self):
+        self.settle(self.current + 1)
+
+    def advance(self, doc_id):
+        if self.current is not None and self.current < doc_id:
+            self.settle(doc_id)
+
+    def estimate(self):
+        """
+        Returns the number of documents matched, extrapolated from the part of the rarest cursor walked so far if the
+        evaluation stopped before the end of the intersection
+        """
+        if self.current is None:
+            return self.count
+        walked = self.cursors[0].position() + 1
+        return round(self.count * self.size / walked)
 
 
 class Ranker:
-    def __init__(self):
-        self.num_results = 0
-        self.docs = []
-
-    def getRankedResults(
-        self,
-        index,
-        corpusSize,
-        lengths,
-        bigramsIndex,
-        bigramsLengths,
-        bookkeeping,
-        query,
-        offset,
+    """
+    Ranks queries against the indexes it is given. A Ranker keeps no state between calls, so one instance can serve
+    concurrent requests from many threads. A conjunctive Ranker requires every query word, as if each were a +word
+    """
+
+    def __init__(self, conjunctive=False):
+        self.conjunctive = conjunctive
+
+    def getRankedResults(self, index, bigramsIndex, query, offset):
+        """Returns the RankedResults of the page of a query starting at offset"""
+        ranked = self.rankDocuments(
+            index, bigramsIndex, query, offset + RESULTS_PER_PAGE
+        )
+        return ranked.page(offset)
+
+    def rankDocuments(self, index, bigramsIndex, query, k):
+        """
+        Returns the RankedResults of the k best scoring documents for a query. +words have to occur in every result and
+        -words and -"phrases" in none. An index with positions needs no bigram index: word order is scored by the
+        proximity of adjacent query terms, and "quoted phrases" have to occur in every result. Without positions
+        phrases are ranked like the rest of the query
+        """
+        parsed = parse_query(query)
+        tokens = parsed.tokens
+        terms = list(dict.fromkeys(tokens))
+        required = terms if self.conjunctive else list(dict.fromkeys(parsed.required))
+        if index.has_positions:
+            pairs = [
+                pair
+                for pair in dict.fromkeys(zip(tokens[:-1], tokens[1:]))
+                if pair[0] != pair[1]
+            ]
+            analyzed = AnalyzedQuery(
+                terms, [], pairs, parsed.phrases, required, parsed.excluded
+            )
+        else:
+            bigrams = list(dict.fromkeys(map(" ".join, zip(tokens[:-1], tokens[1:]))))
+            analyzed = AnalyzedQuery(terms, bigrams, [], (), required, parsed.excluded)
+        if isinstance(index, ShardedIndex):
+            doc_ids, num_results = self.rankShards(index, analyzed, k)
+        elif isinstance(index, SegmentedIndex):
+            doc_ids, num_results = self.rankSegments(index, bigramsIndex, analyzed, k)
+        else:
+            doc_ids, num_results = self.rankIndex(index, bigramsIndex, analyzed, k)
+        return RankedResults(doc_ids, num_results, tokens)
+
+    def rankIndex(self, index, bigramsIndex, query, k):
+        """
+        Returns the doc ids of the k best scoring documents for an AnalyzedQuery, best first, and the estimated number
+        of results
+        """
+        entries = {term: index.find(term) for term in query.terms}
+        found = [entry for entry in entries.values() if entry is not None]
+        if not found or any(entries[term] is None for term in query.required):
+            return [], 0
+
+        exclude = self.excludedDocuments(index, query.excluded)
+        driver = self.openConjunction(index, entries, query, exclude)
+        cursors, tiers = self.openCursors(
+            index, [entries[term] for term in query.terms if term not in query.required]
+        )
+        pair_doc_ids = self.pairDocuments(index, entries, query.pairs)
+        cursors += self.openProximityCursors(
+            index,
+            entries,
+            query.pairs,
+            pair_doc_ids,
+            index.num_documents,
+            [len(doc_ids) for doc_ids in pair_doc_ids],
+        )
+        if query.bigrams:
+            bigram_entries = [
+                entry
+                for entry in map(bigramsIndex.find, query.bigrams)
+                if entry is not None
+            ]
+            # Bigrams are weighted against the number of documents of the collection, like the terms are
+            bigram_cursors, bigram_tiers = self.openCursors(
+                bigramsIndex, bigram_entries, corpus_size=index.num_documents
+            )
+            cursors += bigram_cursors
+            tiers += bigram_tiers
+        heap = self.evaluate(cursors, tiers, k, exclude, driver)
+        if driver is not None:
+            num_results = driver.estimate()
+        else:
+            num_results = self.estimateResults(
+                index.num_documents, [entry.df for entry in found]
+            )
+        return [-doc for _, doc in sorted(heap, reverse=True)], num_results
+
+    def rankSegments(self, index, bigramsIndex, query, k):
+        """
+        Ranks a query over the segments of an incremental index. A document is live in a single segment, so every
+        segment is evaluated on its own, weighting the terms and term pairs with the document frequencies of all the
+        segments, and the best k documents of the segments are merged
+        """
+        lookups = []
+        parts = []
+        for i, segment in enumerate(index.segments):
+            bigram_index = None
+            if bigramsIndex is not None:
+                bigram_index = bigramsIndex.segments[i].index
+            lookup = self.lookupPart(segment.index, bigram_index, query)
+            lookups.append(lookup)
+            parts.append(self.partStatistics(segment.index, lookup))
+        statistics = add_statistics(parts)
+        if self.matchesNothing(query, statistics):
+            return [], 0
+
+        ranked = []
+        for i, segment in enumerate(index.segments):
+            bigram_index = None
+            if bigramsIndex is not None:
+                bigram_index = bigramsIndex.segments[i].index
+            ranked.append(
+                self.rankPart(
+                    segment.index,
+                    bigram_index,
+                    query,
+                    k,
+                    lookups[i],
+                    statistics,
+                    segment.deleted,
+                )
+            )
+        return self.mergeParts(index, ranked, query, statistics, k)
+
+    def rankShards(self, index, query, k):
+        """
+        Ranks a query over a ShardedIndex in two scatter-gather rounds: the shards first return their statistics for
+        the query, which add up to the statistics of the whole collection, then all rank the query with them at once,
+        and their best k documents are merged. The shards open their own bigram indexes
+        """
+        statistics = add_statistics(index.scatter(shard_statistics, query))
+        if self.matchesNothing(query, statistics):
+            return [], 0
+        ranked = index.scatter(rank_shard, query, k, statistics)
+        return self.mergeParts(index, ranked, query, statistics, k)
+
+    def lookupPart(self, index, bigramsIndex, query):
+        """Returns the PartLookup of a query in one segment or shard"""
+        entries = {term: index.find(term) for term in query.terms}
+        bigram_entries = []
+        if query.bigrams:
+            bigram_entries = [bigramsIndex.find(bigram) for bigram in query.bigrams]
+        return PartLookup(
+            entries, self.pairDocuments(index, entries, query.pairs), bigram_entries
+        )
+
+    def partStatistics(self, index, lookup):
+        """Returns the Statistics of a query in one segment or shard from its PartLookup"""
+        return Statistics(
+            index.num_documents,
+            [entry.df if entry is not None else 0 for entry in lookup.entries.values()],
+            [len(doc_ids) for doc_ids in lookup.pair_doc_ids],
+            [entry.df if entry is not None else 0 for entry in lookup.bigram_entries],
+        )
+
+    def matchesNothing(self, query, statistics):
+        """Returns whether no document of the collection can match the query, going by its Statistics"""
+        required_dfs = [
+            df
+            for term, df in zip(query.terms, statistics.dfs)
+            if term in query.required
+        ]
+        return not any(statistics.dfs) or not all(required_dfs)
+
+    def rankPart(
+        self, index, bigramsIndex, query, k, lookup, statistics, exclude=frozenset()
+    ):
+        """
+        Evaluates a query on one segment or shard, weighting it with the Statistics of the whole collection. Returns a
+        heap of the (score, -doc_id) of its k best documents that are not in exclude, with the number of documents
+        matching the required terms and phrases of the query, or None if it requires nothing
+        """
+        entries = lookup.entries
+        if any(entries[term] is None for term in query.required):
+            return [], 0
+        exclude = exclude | self.excludedDocuments(index, query.excluded)
+        driver = self.openConjunction(
+            index, entries, query, exclude, statistics.num_documents, statistics.dfs
+        )
+        cursors, tiers = self.openCursors(
+            index,
+            [None if term in query.required else entries[term] for term in query.terms],
+            statistics.num_documents,
+            statistics.dfs,
+        )
+        cursors += self.openProximityCursors(
+            index,
+            entries,
+            query.pairs,
+            lookup.pair_doc_ids,
+            statistics.num_documents,
+            statistics.pair_dfs,
+        )
+        if query.bigrams:
+            bigram_cursors, bigram_tiers = self.openCursors(
+                bigramsIndex,
+                lookup.bigram_entries,
+                statistics.num_documents,
+                statistics.bigram_dfs,
+            )
+            cursors += bigram_cursors
+            tiers += bigram_tiers
+        heap = self.evaluate(cursors, tiers, k, exclude, driver)
+        return heap, driver.estimate() if driver is not None else None
+
+    def mergeParts(self, index, ranked, query, statistics, k):
+        """
+        Merges the (heap, count) rankings of every segment or shard of an index into the doc ids of its k best
+        documents, best first, and the number of results
+        """
+        results = []
+        num_results = 0
+        for part, (heap, count) in zip(index.segments, ranked):
+            results += [(score, doc - part.base) for score, doc in heap]
+            num_results += count or 0
+        if not (query.required or query.phrases):
+            num_results = self.estimateResults(
+                statistics.num_documents, [df for df in statistics.dfs if df]
+            )
+        return [-doc for _, doc in heapq.nlargest(k, results)], num_results
+
+    def openConjunction(
+        self, index, entries, query, exclude, num_documents=None, dfs=None
     ):
-        self.docs = []
-        scores = defaultdict(int)
-        query = query.lower()
-        for term in query.split():
-            if term not in index.keys():
+        """
+        Returns a ConjunctionCursor over the documents holding every required term and every phrase of the query that
+        are not in exclude, or None if the query requires nothing. The TermEntry of every required term has to be in
+        entries, and dfs holds the document frequencies of the query terms in the whole collection
+        """
+        cursors = [
+            BlockCursor(index, entries[term], num_documents, df)
+            for term, df in zip(query.terms, dfs or [None] * len(query.terms))
+            if term in query.required
+        ]
+        if query.phrases:
+            matches = self.matchPhrases(index, entries, query.phrases)
+            cursors.append(ScoredCursor(matches, [0.0] * len(matches)))
+        if not cursors:
+            return None
+        return ConjunctionCursor(cursors, exclude)
+
+    def excludedDocuments(self, index, excluded):
+        """
+        Returns the set of doc ids of the documents holding any of the excluded words or phrases. Without positions a
+        phrase excludes the documents holding all of its terms
+        """
+        doc_ids = set()
+        for tokens in excluded:
+            entries = {token: index.find(token) for token in tokens}
+            if any(entry is None for entry in entries.values()):
                 continue
-            weight_tq = 1 * math.log(corpusSize / len(index[term]))
-            for doc in index[term]:
-                weight_td = doc[2]
-                scores[doc[0]] += weight_tq * weight_td
-
-        bigramsScores = defaultdict(int)
-        terms = query.split()
-        for term in list(map(" ".join, zip(terms[:-1], terms[1:]))):
-            if term not in bigramsIndex.keys():
+            if len(entries) == 1:
+                doc_ids.update(index.document_ids(entries[tokens[0]]))
+            elif index.has_positions:
+                doc_ids.update(self.matchPhrases(index, entries, [tokens]))
+            else:
+                doc_ids.update(common_documents(index, list(entries.values())))
+        return doc_ids
+
+    def matchPhrases(self, index, entries, phrases):
+        """
+        Returns the sorted doc ids of the documents containing every phrase, where entries maps the query terms to
+        their TermEntry in the index. Positions are only decoded for the documents holding all the terms of a phrase
+        """
+        matches = None
+        for phrase in phrases:
+            phrase_entries = [entries[term] for term in phrase]
+            if any(entry is None for entry in phrase_entries):
+                return []
+            doc_ids = common_documents(index, phrase_entries)
+            if matches is not None:
+                doc_ids = [doc_id for doc_id in doc_ids if doc_id in matches]
+            positions = [index.positions(entry, doc_ids) for entry in phrase_entries]
+            matches = {
+                doc_id
+                for doc_id in doc_ids
+                if occurs_as_phrase([term[doc_id] for term in positions])
+            }
+        return sorted(matches)
+
+    def pairDocuments(self, index, entries, pairs):
+        """Returns the sorted doc ids of the documents holding both terms of every pair of terms"""
+        return [
+            common_documents(index, [entries[first], entries[second]])
+            if entries[first] is not None and entries[second] is not None
+            else []
+            for first, second in pairs
+        ]
+
+    def openProximityCursors(
+        self, index, entries, pairs, pair_doc_ids, num_documents, dfs
+    ):
+        """
+        Opens a cursor scoring the proximity of every pair of terms held together by the documents of pair_doc_ids. A
+        pair is weighted like a term held by the df documents holding both terms, with the proximity of the terms, 1
+        when they are adjacent, as its term frequency
+        """
+        cursors = []
+        for (first, second), doc_ids, df in zip(pairs, pair_doc_ids, dfs):
+            if doc_ids:
+                idf = num_documents / df
+                weight = math.log(idf) * math.log10(idf)
+                cursors.append(
+                    ProximityCursor(
+                        index, entries[first], entries[second], doc_ids, weight
+                    )
+                )
+        return cursors
+
+    def openCursors(
+        self, index, entries, num_documents=None, dfs=None, corpus_size=None
+    ):
+        """Opens a cursor for every term entry that is not None, and a cursor over the low tier of tiered terms"""
+        cursors = []
+        tiers = []
+        for entry, df in zip(entries, dfs or [None] * len(entries)):
+            if entry is not None:
+                cursors.append(
+                    PostingsCursor(index, entry, num_documents, df, corpus_size)
+                )
+                if entry.high_df < entry.df:
+                    tiers.append(
+                        TierCursor(index, entry, num_documents, df, corpus_size)
+                    )
+        return cursors, tiers
+
+    def evaluate(self, cursors, tiers, k, exclude=frozenset(), driver=None):
+        """
+        Returns a heap of the (score, -doc_id) of the k best scoring documents that are not in exclude, and are
+        documents of the driver if one is given
+        """
+        if driver is not None:
+            # Only the documents of the driver can be results, so it is the only essential cursor and every other
+            # cursor is just looked up in them.
+            return self.topK([driver], k, pinned=cursors + tiers, exclude=exclude)
+        # The high tiers are evaluated first, looking the low tiers up only for the documents found there. Documents
+        # that are in no high tier can only score the sum of the low tier bounds, so the low tiers are only walked if
+        # that is enough to reach the top k.
+        heap = self.topK(cursors, k, pinned=tiers, exclude=exclude)
+        if tiers and (
+            len(heap) < k or heap[0][0] <= sum(cursor.bound for cursor in tiers)
+        ):
+            seen = set(exclude)
+            for cursor in cursors:
+                seen.update(cursor.doc_ids)
+            for cursor in tiers:
+                cursor.pos = 0
+            heap = self.topK(tiers, k, heap=heap, exclude=seen)
+        return heap
+
+    def topK(self, cursors, k, pinned=(), heap=None, exclude=()):
+        """
+        Returns a heap of the (score, -doc_id) of the k best scoring documents using MaxScore. Cursors are ordered by
+        their bound and the ones whose bounds add up to less than the current k-th best score are non-essential: they
+        are only advanced to score documents found in the essential cursors, and only while the document can still make
+        it into the top k. Pinned cursors are always non-essential, documents in exclude are skipped and heap can hold
+        documents scored by an earlier call. Ties are broken by doc id, so the results are the same as scoring every
+        posting
+        """
+        cursors = sorted(pinned, key=lambda cursor: cursor.bound) + sorted(
+            cursors, key=lambda cursor: cursor.bound
+        )
+        upper_bounds = []
+        total = 0
+        for cursor in cursors:
+            total += cursor.bound
+            upper_bounds.append(total)
+
+        heap = heap or []
+        threshold = -math.inf
+        first_essential = len(pinned)
+        while True:
+            if len(heap) == k:
+                threshold = heap[0][0]
+                while (
+                    first_essential < len(cursors)
+                    and upper_bounds[first_essential] < threshold
+                ):
+                    first_essential += 1
+
+            doc_id = None
+            for cursor in cursors[first_essential:]:
+                current = cursor.doc()
+                if current is not None and (doc_id is None or current < doc_id):
+                    doc_id = current
+            if doc_id is None:
+                break
+
+            score = 0
+            for cursor in cursors[first_essential:]:
+                if cursor.doc() == doc_id:
+                    score += cursor.score()
+                    cursor.next()
+            if doc_id in exclude:
                 continue
-            weight_tq = 1 * math.log(corpusSize / len(bigramsIndex[term]))
-            for doc in bigramsIndex[term]:
-                weight_td = doc[2]
-                bigramsScores[doc[0]] += weight_tq * weight_td
-
-        if not scores:
-            self.num_results = 0
-            return []
-        else:
-            self.num_results = len(scores)
-            for doc in scores:
-                scores[doc] = scores[doc] / lengths[doc]
-                if doc in bigramsLengths:
-                    scores[doc] += bigramsScores[doc] / bigramsLengths[doc]
-
-            url_results = []
-            counter = 0
-            scores = dict(sorted(scores.items(), key=lambda x: x[1], reverse=True))
-            for doc_key in list(scores.keys())[offset:]:
-                self.docs.append(doc_key)
-                url_results.append(bookkeeping[doc_key])
-                counter += 1
-                if counter == 20:
+            for i in range(first_essential - 1, -1, -1):
+                if score + upper_bounds[i] < threshold:
                     break
-            return url_results
-
-    def getSnippets(self):
-        snippets = []
-        for i in self.docs:
-            soup = BeautifulSoup(open(f"WEBPAGES_RAW/{i}"), "html.parser")
-            title = soup.find("title")
-            description = soup.get_text().strip()
-            if title:
-                snippets.append([title.text, description])
-            else:
-                snippets.append(["", ""])
-        return snippets
+                cursor = cursors[i]
+                cursor.advance(doc_id)
+                if cursor.doc() == doc_id:
+                    score += cursor.score()
+
+            if len(heap) < k:
+                heapq.heappush(heap, (score, -doc_id))
+            elif (score, -doc_id) > heap[0]:
+                heapq.heapreplace(heap, (score, -doc_id))
+
+        return heap
+
+    def estimateResults(self, num_documents, dfs):
+        """
+        Estimates how many documents contain any of the query terms, assuming the terms occur independently. Counting
+        them exactly would mean reading every posting, which the top k evaluation avoids
+        """
+        missing = 1.0
+        for df in dfs:
+            missing *= 1 - df / num_documents
+        return max(max(dfs), round(num_documents * (1 - missing)))
+
+    def getSnippets(self, docstore, results):
+        """Returns the [title, snippet] of every result from the document store, biased towards the query terms"""
+        return [
+            self.getSnippet(docstore, doc_id, results.terms)
+            for doc_id in results.doc_ids
+        ]
+
+    def getSnippet(self, docstore, doc_id, terms):
+        title, description = docstore.snippet(doc_id, terms)
+        if title:
+            return [title, description]
+        return ["", ""]
+
+
+def shard_statistics(index, bigramsIndex, query):
+    """Returns the Statistics of an AnalyzedQuery in a shard, in the process serving the shard"""
+    ranker = Ranker()
+    lookup = ranker.lookupPart(index, bigramsIndex, query)
+    return ranker.partStatistics(index, lookup)
+
+
+def rank_shard(index, bigramsIndex, query, k, statistics):
+    """Ranks an AnalyzedQuery on a shard with the Statistics of the whole collection, in the process serving the shard"""
+    ranker = Ranker()
+    lookup = ranker.lookupPart(index, bigramsIndex, query)
+    return ranker.rankPart(index, bigramsIndex, query, k, lookup, statistics)
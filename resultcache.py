@@ -0,0 +1,100 @@
+from collections import OrderedDict
+from itertools import islice
+import os
+import sys
+import threading
+import time
+
+
+def files_signature(paths):
+    """Returns the (path, mtime, size) of every path, with None for the files that do not exist"""
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append((path, None, None))
+    return signature
+
+
+class ResultCache:
+    """
+    Bounded LRU cache of ranked results keyed by the normalized query, using the normalize function if one is given.
+    The cache is limited by an estimate of the bytes its entries hold, entries can expire after ttl seconds, and
+    everything is dropped when one of the watched index files changes on disk. Every entry also keeps the query it was
+    put with, so the queries can be ranked again whatever their normalized key looks like
+    """
+
+    def __init__(self, max_bytes, ttl=None, paths=(), normalize=None):
+        self.max_bytes = max_bytes
+        if normalize is not None:
+            self.normalize = normalize
+        self.ttl = ttl
+        self.paths = paths
+        self.entries = OrderedDict()
+        self.size = 0
+        self.signature = self.files_signature()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def normalize(query):
+        return " ".join(query.lower().split())
+
+    def files_signature(self):
+        return files_signature(self.paths)
+
+    def get(self, query):
+        key = self.normalize(query)
+        signature = self.files_signature()
+        with self.lock:
+            if signature != self.signature:
+                self.clear()
+                self.signature = signature
+            if key not in self.entries:
+                return None
+            value, size, expires, _ = self.entries[key]
+            if expires is not None and expires < time.monotonic():
+                del self.entries[key]
+                self.size -= size
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, query, value):
+        key = self.normalize(query)
+        size = self.estimate_size(key, value)
+        if size > self.max_bytes:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size, expires, query)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size, _, _) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def queries(self, n):
+        """Returns the queries of the n most recently used entries, as they were put"""
+        with self.lock:
+            return [entry[3] for entry in islice(reversed(self.entries.values()), n)]
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def estimate_size(self, key, value):
+        """Approximates the bytes held by an entry, counting the strings and lists inside the cached value"""
+        size = sys.getsizeof(key)
+        pending = [value]
+        while pending:
+            item = pending.pop()
+            size += sys.getsizeof(item)
+            if isinstance(item, (list, tuple)):
+                pending.extend(item)
+        return size
+
+    def __len__(self):
+        return len(self.entries)
@@ -1,53 +1,162 @@
-import json
 import sys
-from flask import Flask, render_template, request, send_from_directory
-from ranker import Ranker
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from flask import Flask, request, send_from_directory, stream_template
+from ranker import Ranker, RESULTS_PER_PAGE
+from binaryindex import BinaryIndex
+from docstore import DocStore
+from generations import GenerationWatcher
+from resultcache import ResultCache
+from segments import MANIFEST, SegmentedDocStore, SegmentedIndex, load_manifest
+from shards import ShardedIndex
+from tokenizer import parse_query
 import timeit
 import os
 
+# The NumPy scoring engine ranks whole indexes when NumPy is installed
+try:
+    from numpyranker import NumpyRanker
+except ImportError:
+    NumpyRanker = None
+
 app = Flask(__name__)
 
-index = json.load(open("index.json"))
-lengths = json.load(open("lengths.json"))
-bigramsIndex = json.load(open("index2.json"))
-bigramsLengths = json.load(open("lengths2.json"))
-corpusSize = int(open("size.json").read())
-bookkeeping = json.load(open("WEBPAGES_RAW/bookkeeping.json"))
-ranker = Ranker()
+# An incremental index built by segmentindexer.py is served instead of the full build when there is one
+SEGMENTS_DIR = "segments"
+# A sharded index built by shardindexer.py is served before either of them
+SHARDS_DIR = "shards"
+# Processes the shards are searched on, unless SHARD_SERVERS lists the (host, port) of a shard server per shard
+SHARD_WORKERS = os.cpu_count()
+SHARD_SERVERS = []
+# The worker processes of the shards, only started once a sharded index is loaded
+shardExecutor = None
+# Seconds between checks for a new index generation
+RELOAD_INTERVAL = 10
+# Number of the most recent cached queries ranked on a new generation before it is swapped in
+WARM_QUERIES = 100
+# Ranked doc keys are cached this many pages deep, so paging through a query is served from the cache
+CACHED_PAGES = 10
+# Require every query word in the results, as if each were written +word
+CONJUNCTIVE = False
+
+Generation = namedtuple(
+    "Generation", ["index", "bigramsIndex", "docstore", "resultCache"]
+)
+
+
+def loadGeneration():
+    global shardExecutor
+    # An index with positions scores phrases itself, so no bigram index is loaded next to it. Shards load their own
+    if os.path.isfile(os.path.join(SHARDS_DIR, MANIFEST)):
+        manifest = load_manifest(SHARDS_DIR)
+        if shardExecutor is None and not SHARD_SERVERS:
+            shardExecutor = ProcessPoolExecutor(SHARD_WORKERS)
+        index = ShardedIndex(SHARDS_DIR, manifest, shardExecutor, SHARD_SERVERS)
+        bigramsIndex = None
+        docstore = SegmentedDocStore(SHARDS_DIR, manifest)
+    elif os.path.isfile(os.path.join(SEGMENTS_DIR, MANIFEST)):
+        manifest = load_manifest(SEGMENTS_DIR)
+        index = SegmentedIndex(SEGMENTS_DIR, "index.bin", manifest)
+        bigramsIndex = None
+        if not index.has_positions:
+            bigramsIndex = SegmentedIndex(SEGMENTS_DIR, "index2.bin", manifest)
+        docstore = SegmentedDocStore(SEGMENTS_DIR, manifest)
+    else:
+        index = BinaryIndex("index.bin")
+        bigramsIndex = None
+        if not index.has_positions:
+            bigramsIndex = BinaryIndex("index2.bin")
+        docstore = DocStore("docstore.bin")
+        if index.num_docs != docstore.num_docs or (
+            bigramsIndex is not None and bigramsIndex.num_docs != index.num_docs
+        ):
+            raise ValueError(
+                "index.bin, index2.bin and docstore.bin are from different builds"
+            )
+    resultCache = ResultCache(
+        64 * 2**20,
+        ttl=3600,
+        normalize=lambda query: repr(parse_query(query)),
+    )
+    return Generation(index, bigramsIndex, docstore, resultCache)
+
+
+def warmGeneration(old, new):
+    """Ranks the queries most recently served by the old generation on the new one, filling its cache and page cache"""
+    for query in old.resultCache.queries(WARM_QUERIES):
+        rankedResults(new, query, 0)
+
+
+# The Ranker is stateless, so requests on any number of threads share it and the loaded generation
+ranker = (NumpyRanker if NumpyRanker is not None else Ranker)(CONJUNCTIVE)
+generations = GenerationWatcher(
+    loadGeneration,
+    [
+        "index.bin",
+        "index2.bin",
+        "docstore.bin",
+        os.path.join(SEGMENTS_DIR, MANIFEST),
+        os.path.join(SHARDS_DIR, MANIFEST),
+    ],
+    interval=RELOAD_INTERVAL,
+    warm=warmGeneration,
+)
+generations.start()
+
+
+def rankedResults(generation, query, offset):
+    """Returns the cached RankedResults of a query, ranking it again if the page is not cached"""
+    depth = max(CACHED_PAGES * RESULTS_PER_PAGE, offset + RESULTS_PER_PAGE)
+    cached = generation.resultCache.get(query)
+    if cached is not None:
+        ranked, cached_depth = cached
+        if (
+            offset + RESULTS_PER_PAGE <= cached_depth
+            or len(ranked.doc_ids) < cached_depth
+        ):
+            return ranked
+    ranked = ranker.rankDocuments(
+        generation.index, generation.bigramsIndex, query, depth
+    )
+    generation.resultCache.put(query, (ranked, depth))
+    return ranked
+
+
+def pageEntries(docstore, page):
+    """Yields the (url, [title, snippet]) of every result of a page in ranked order, building each as it is rendered"""
+    for doc_id in page.doc_ids:
+        yield docstore.url(doc_id), ranker.getSnippet(docstore, doc_id, page.terms)
 
 
 @app.route("/", methods=["GET"])
 def search():
+    # The page is streamed: everything up to the result list is sent as soon as the query is ranked, and every result
+    # is sent as soon as its snippet is built. Snippets are read from the memory-mapped document store without any I/O
+    # to wait on, so they are built inline. The time shown under the results is taken once they are all rendered.
     start = timeit.default_timer()
     args = request.args
-    results = []
-    snippets = []
+    entries = []
     query = ""
     offset = 0
-    ranker.num_results = 0
+    num_results = 0
     print(args, file=sys.stderr)
     if "search" in args:
         if "page" in args:
             offset = int(args["page"]) * 20
-        results = ranker.getRankedResults(
-            index,
-            corpusSize,
-            lengths,
-            bigramsIndex,
-            bigramsLengths,
-            bookkeeping,
-            args["search"],
-            offset,
-        )
-        snippets = ranker.getSnippets()
+        generation = generations.current
+        page = rankedResults(generation, args["search"], offset).page(offset)
+        num_results = page.num_results
+        # Doc ids are only turned into urls for the results on the page
+        entries = pageEntries(generation.docstore, page)
         query = args["search"]
-    stop = timeit.default_timer()
-    query_time = round(stop - start, 2)
-    return render_template(
+
+    def query_time():
+        return round(timeit.default_timer() - start, 2)
+
+    return stream_template(
         "index.html",
-        num_results=ranker.num_results,
-        results=results,
-        snippets=snippets,
+        num_results=num_results,
+        entries=entries,
         query=query,
         query_time=query_time,
         page=offset // 20,
@@ -0,0 +1,430 @@
+from combinedindexer import CombinedIndexer
+from binaryindex import BinaryIndex, BinaryIndexWriter
+from docstore import DocStore, DocStoreWriter
+from segments import SegmentedIndex, load_manifest, save_manifest, locked
+from tokenizer import lemma_cache
+from array import array
+from itertools import groupby
+import argparse
+import heapq
+import math
+import os
+import shutil
+import time
+import timeit
+
+# Segments are merged once there are more than this many
+MAX_SEGMENTS = 8
+
+
+def segment_name(number):
+    return f"seg{number:06d}"
+
+
+def normalized_lengths(squares):
+    return array(
+        "d",
+        [
+            math.log10(math.sqrt(square)) if square > 0 else math.nan
+            for square in squares
+        ],
+    )
+
+
+def weigh_postings(indexer, collection=None):
+    """
+    Stores the term frequency weight 1 + log10(raw_tf) in every posting of the indexer and computes the document
+    lengths with the idf of the collection the documents are added to
+    """
+    indexer.calculate_num_documents()
+    indexer.calculate_document_frequencies()
+    num_documents = indexer.num_documents
+    if collection is not None:
+        num_documents += collection.num_documents
+    squares = array("d", [0.0]) * len(indexer.doc_keys)
+    for key, postings in indexer.index.items():
+        df = indexer.document_frequencies[key]
+        if collection is not None:
+            df += collection.document_frequency(key)
+        idf = math.log10(num_documents / df)
+        for posting in postings:
+            posting[2] = 1 + math.log10(posting[1])
+            squares[posting[0]] += (posting[2] * idf) ** 2
+    indexer.lengths = normalized_lengths(squares)
+
+
+class SegmentIndexer(CombinedIndexer):
+    """
+    Indexes a list of documents into a new segment. Postings keep their term frequency weight and leave the idf to
+    query time, and the document lengths are computed with the idf of the segments the new one is added to, until a
+    merge recomputes them
+    """
+
+    def __init__(
+        self, base_url, unigrams_index=None, bigrams_index=None, positions=False
+    ):
+        super().__init__(base_url, store_documents=True, positions=positions)
+        self.unigrams_index = unigrams_index
+        self.bigrams_index = bigrams_index
+
+    def calculate_weights(self):
+        weigh_postings(self.unigrams, self.unigrams_index)
+        if self.bigrams is not None:
+            weigh_postings(self.bigrams, self.bigrams_index)
+
+    def save_segment(self, path):
+        os.makedirs(path)
+        self.unigrams.save_binary(os.path.join(path, "index.bin"))
+        if self.bigrams is not None:
+            self.bigrams.save_binary(os.path.join(path, "index2.bin"))
+        self.save_docstore(os.path.join(path, "docstore.bin"))
+
+
+def merged_postings(indexes, new_ids, positions=False):
+    """
+    Yields the (term, postings) pairs of the union of the indexes in term order. new_ids maps the doc ids of every
+    index to the doc ids of the merged index, with None for deleted documents, which are left out. Postings are
+    [doc_id, raw_tf, tf] triples, followed by the token positions of the term when positions is set
+    """
+    for term, _ in groupby(heapq.merge(*indexes)):
+        postings = []
+        for index, ids in zip(indexes, new_ids):
+            doc_ids, raw_tfs, _ = index.postings(term)
+            if positions and doc_ids:
+                term_positions = index.positions(index.find(term))
+            for doc_id, raw_tf in zip(doc_ids, raw_tfs):
+                if ids[doc_id] is not None:
+                    posting = [ids[doc_id], raw_tf, 1 + math.log10(raw_tf)]
+                    if positions:
+                        posting.append(term_positions[doc_id])
+                    postings.append(posting)
+        if postings:
+            yield term, postings
+
+
+def merge_indexes(
+    paths, new_ids, doc_keys, output, tier_size=None, collection=None
+):
+    # The postings are read twice: once to compute the document lengths from the merged document frequencies, or from
+    # the ones of the collection index the merged documents are a part of when it is given, and once to write them,
+    # so only one term's postings are held in memory at a time. Positions are only kept if every index has them.
+    indexes = [BinaryIndex(path) for path in paths]
+    positions = all(index.has_positions for index in indexes)
+    num_documents = 0
+    for index, ids in zip(indexes, new_ids):
+        for doc_id, new_id in enumerate(ids):
+            if new_id is not None and not math.isnan(index.length(doc_id)):
+                num_documents += 1
+    squares = array("d", [0.0]) * len(doc_keys)
+    for term, postings in merged_postings(indexes, new_ids):
+        if collection is None:
+            idf = math.log10(num_documents / len(postings))
+        else:
+            idf = math.log10(
+                collection.num_documents / collection.document_frequency(term)
+            )
+        for posting in postings:
+            squares[posting[0]] += (posting[2] * idf) ** 2
+    writer = BinaryIndexWriter(
+        output,
+        doc_keys,
+        normalized_lengths(squares),
+        num_documents,
+        tier_size,
+        positions,
+    )
+    for term, postings in merged_postings(indexes, new_ids, positions):
+        writer.add(term, postings)
+    writer.close()
+    for index in indexes:
+        index.close()
+
+
+def merge_segments(
+    paths, deleted, output, tier_size=None, collection=None, manifest=None
+):
+    """
+    Merges the segments stored in paths, oldest first, into a new segment at output. deleted holds the set of deleted
+    doc keys of every segment, which are dropped for good. Segments whose index.bin has positions have no index2.bin,
+    which is only merged when none of them has positions. The document lengths are computed with the statistics of
+    the indexes in the collection directory if one is given: the segments of manifest when one is given, otherwise a
+    full build. Returns the number of documents of the new segment
+    """
+    os.makedirs(output)
+    doc_keys = []
+    new_ids = []
+    positions = True
+    writer = DocStoreWriter(os.path.join(output, "docstore.bin"))
+    for path, dead in zip(paths, deleted):
+        index = BinaryIndex(os.path.join(path, "index.bin"))
+        positions = positions and index.has_positions
+        store = DocStore(os.path.join(path, "docstore.bin"))
+        ids = []
+        for doc_id, doc_key in enumerate(index.doc_keys):
+            if doc_key in dead:
+                ids.append(None)
+                continue
+            ids.append(len(doc_keys))
+            title, text, _ = store.document(doc_id)
+            writer.add(title, text.decode("utf-8"), store.url(doc_id))
+            doc_keys.append(doc_key)
+        new_ids.append(ids)
+        store.close()
+        index.close()
+    writer.close()
+    for filename in ("index.bin",) if positions else ("index.bin", "index2.bin"):
+        collection_index = None
+        if collection is not None and manifest is not None:
+            collection_index = SegmentedIndex(collection, filename, manifest)
+        elif collection is not None:
+            collection_index = BinaryIndex(os.path.join(collection, filename))
+        merge_indexes(
+            [os.path.join(path, filename) for path in paths],
+            new_ids,
+            doc_keys,
+            os.path.join(output, filename),
+            tier_size,
+            collection_index,
+        )
+        if collection_index is not None:
+            collection_index.close()
+    return len(doc_keys)
+
+
+def allocate_segment(directory, manifest):
+    name = segment_name(manifest["next_segment"])
+    manifest["next_segment"] += 1
+    save_manifest(directory, manifest)
+    return name
+
+
+def tombstone(directory, manifest, doc_keys):
+    """Records the doc keys as deleted in the segments of the manifest that hold a live copy of them"""
+    for info in manifest["segments"]:
+        index = BinaryIndex(os.path.join(directory, info["name"], "index.bin"))
+        deleted = set(info["deleted"])
+        info["deleted"] += [
+            doc_key
+            for doc_key in doc_keys
+            if doc_key in index.doc_ids and doc_key not in deleted
+        ]
+        index.close()
+
+
+def add_documents(directory, base_url, doc_keys, positions=False):
+    """
+    Indexes the documents into a new segment, replacing the copies of them that were indexed before. Whether segments
+    store positions is fixed by the first segment of a directory, so positions only matters for an empty one
+    """
+    doc_keys = list(dict.fromkeys(doc_keys))
+    if not doc_keys:
+        return
+    with locked(directory):
+        manifest = load_manifest(directory)
+        if "positions" not in manifest:
+            manifest["positions"] = positions and not manifest["segments"]
+        positions = manifest["positions"]
+        name = allocate_segment(directory, manifest)
+        unigrams = SegmentedIndex(directory, "index.bin", manifest)
+        bigrams = None
+        if not positions:
+            bigrams = SegmentedIndex(directory, "index2.bin", manifest)
+    indexer = SegmentIndexer(base_url, unigrams, bigrams, positions)
+    indexer.index_files(doc_keys)
+    indexer.calculate_weights()
+    unigrams.close()
+    if bigrams is not None:
+        bigrams.close()
+    indexer.save_segment(os.path.join(directory, name))
+    with locked(directory):
+        manifest = load_manifest(directory)
+        tombstone(directory, manifest, doc_keys)
+        manifest["segments"].append(
+            {"name": name, "num_docs": len(indexer.doc_keys), "deleted": []}
+        )
+        save_manifest(directory, manifest)
+
+
+def delete_documents(directory, doc_keys):
+    with locked(directory):
+        manifest = load_manifest(directory)
+        tombstone(directory, manifest, doc_keys)
+        save_manifest(directory, manifest)
+
+
+def import_index(directory, tier_size=None):
+    """
+    Turns the index.bin, index2.bin and docstore.bin of a full build into the first segment of an empty directory. A
+    build whose index.bin has positions needs no index2.bin
+    """
+    with locked(directory):
+        manifest = load_manifest(directory)
+        if manifest["segments"]:
+            raise ValueError(f"{directory} already holds segments")
+        index = BinaryIndex("index.bin")
+        manifest["positions"] = index.has_positions
+        index.close()
+        name = allocate_segment(directory, manifest)
+    num_docs = merge_segments(["."], [set()], os.path.join(directory, name), tier_size)
+    with locked(directory):
+        manifest = load_manifest(directory)
+        manifest["segments"].insert(
+            0, {"name": name, "num_docs": num_docs, "deleted": []}
+        )
+        save_manifest(directory, manifest)
+
+
+def choose_run(segments, max_segments, full):
+    """
+    Picks the adjacent segments to merge: all of them for a full merge, otherwise the run with the fewest documents
+    that brings the count back to max_segments, so fresh small segments are merged together before they are merged
+    into large ones
+    """
+    if full:
+        if len(segments) > 1 or (segments and segments[0]["deleted"]):
+            return segments
+        return None
+    if len(segments) <= max_segments:
+        return None
+    count = len(segments) - max_segments + 1
+    start = min(
+        range(len(segments) - count + 1),
+        key=lambda i: sum(info["num_docs"] for info in segments[i : i + count]),
+    )
+    return segments[start : start + count]
+
+
+def compact(directory, max_segments=MAX_SEGMENTS, full=False, tier_size=None):
+    """
+    Merges segments in the background of the processes adding and searching them, returning whether a merge was
+    made. A full merge purges every deleted document and recomputes the lengths of all documents. The lengths of the
+    merged documents are computed with the statistics of every segment, as add_documents computes them, rather than
+    with those of the merged run alone
+    """
+    with locked(directory):
+        manifest = load_manifest(directory)
+        run = choose_run(manifest["segments"], max_segments, full)
+        if run is None:
+            return False
+        name = allocate_segment(directory, manifest)
+    output = os.path.join(directory, name)
+    num_docs = merge_segments(
+        [os.path.join(directory, info["name"]) for info in run],
+        [set(info["deleted"]) for info in run],
+        output,
+        tier_size,
+        collection=directory,
+        manifest=manifest,
+    )
+
+    # Documents deleted or replaced while the merge ran are still live in the new segment and are deleted there
+    names = [info["name"] for info in run]
+    with locked(directory):
+        manifest = load_manifest(directory)
+        current = {info["name"]: info for info in manifest["segments"]}
+        if any(name not in current for name in names):
+            shutil.rmtree(output, ignore_errors=True)
+            return False
+        deleted = []
+        for info in run:
+            merged = set(info["deleted"])
+            deleted += [
+                doc_key
+                for doc_key in current[info["name"]]["deleted"]
+                if doc_key not in merged
+            ]
+        start = manifest["segments"].index(current[names[0]])
+        manifest["segments"][start : start + len(run)] = [
+            {"name": name, "num_docs": num_docs, "deleted": deleted}
+        ]
+        save_manifest(directory, manifest)
+    for merged_name in names:
+        shutil.rmtree(os.path.join(directory, merged_name), ignore_errors=True)
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--dir",
+        default="segments",
+        help="directory holding the segments and their manifest",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser(
+        "import",
+        help="turn the index.bin, index2.bin and docstore.bin of a full build into the first segment",
+    )
+    import_parser.add_argument(
+        "--tier-size",
+        type=int,
+        help="split postings lists longer than this into a high and a low impact tier",
+    )
+    add_parser = commands.add_parser(
+        "add", help="index documents into a new segment, replacing their older copies"
+    )
+    add_parser.add_argument("base_url")
+    add_parser.add_argument("doc_keys", nargs="*")
+    add_parser.add_argument(
+        "--from-file", help="file listing one doc key, such as 0/12, per line"
+    )
+    add_parser.add_argument(
+        "--lemma-cache",
+        help="file the (word, pos) -> lemma memo is loaded from and saved to, so later runs start warm",
+    )
+    add_parser.add_argument(
+        "--positions",
+        action="store_true",
+        help="store token positions instead of an index2.bin when this creates the first segment of the directory",
+    )
+    delete_parser = commands.add_parser(
+        "delete", help="delete documents from the index"
+    )
+    delete_parser.add_argument("doc_keys", nargs="+")
+    merge_parser = commands.add_parser("merge", help="merge segments")
+    merge_parser.add_argument(
+        "--full",
+        action="store_true",
+        help="merge every segment, purging deleted documents and recomputing all lengths",
+    )
+    merge_parser.add_argument(
+        "--max-segments",
+        type=int,
+        default=MAX_SEGMENTS,
+        help="merge the smallest adjacent segments while there are more than this many",
+    )
+    merge_parser.add_argument(
+        "--tier-size",
+        type=int,
+        help="split postings lists longer than this into a high and a low impact tier",
+    )
+    merge_parser.add_argument(
+        "--watch",
+        type=int,
+        help="keep running, checking whether segments need merging every this many seconds",
+    )
+    args = parser.parse_args()
+    start = timeit.default_timer()
+    if args.command == "import":
+        import_index(args.dir, args.tier_size)
+    elif args.command == "add":
+        doc_keys = args.doc_keys
+        if args.from_file:
+            with open(args.from_file) as f:
+                doc_keys += [line.strip() for line in f if line.strip()]
+        if args.lemma_cache:
+            lemma_cache.load(args.lemma_cache)
+        add_documents(args.dir, args.base_url, doc_keys, args.positions)
+        if args.lemma_cache:
+            lemma_cache.save(args.lemma_cache)
+    elif args.command == "delete":
+        delete_documents(args.dir, args.doc_keys)
+    elif args.command == "merge":
+        while True:
+            while compact(args.dir, args.max_segments, args.full, args.tier_size):
+                pass
+            if args.watch is None:
+                break
+            time.sleep(args.watch)
+    stop = timeit.default_timer()
+    print("Time: ", stop - start, "seconds")
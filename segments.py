@@ -0,0 +1,139 @@
+from bisect import bisect_right
+from collections import namedtuple
+from contextlib import contextmanager
+import fcntl
+import json
+import os
+from binaryindex import BinaryIndex
+from docstore import DocStore
+
+# An incremental index is a directory of immutable segments, each holding an index.bin, an index2.bin and a
+# docstore.bin for the documents it was built from, plus a manifest listing the live segments from oldest to newest:
+#
+#   {"next_segment": 3, "positions": false,
+#    "segments": [{"name": "seg000000", "num_docs": 37497, "deleted": ["0/12"]}, ...]}
+#
+# When "positions" is set, every index.bin stores token positions and the segments have no index2.bin.
+#
+# Segments store term frequency weights without idf, which is computed at query time from the document frequencies
+# of all segments. Replacing or deleting a document only records its doc key in the "deleted" list of the segment
+# holding it, and the document stays out of the results until a merge drops it for good.
+MANIFEST = "manifest.json"
+LOCK = "manifest.lock"
+
+Segment = namedtuple("Segment", ["index", "base", "deleted"])
+
+
+def load_manifest(directory):
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.isfile(path):
+        return {"next_segment": 0, "segments": []}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(directory, manifest):
+    path = os.path.join(directory, MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(path + ".tmp", path)
+
+
+@contextmanager
+def locked(directory):
+    """Holds the manifest lock, so the processes adding, deleting and merging segments never lose each other's edits"""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class SegmentedIndex:
+    """
+    Reader for one of the indexes (index.bin or index2.bin) of every segment listed in a manifest. Doc ids are global:
+    the doc ids of a segment start at its base, the number of documents in the segments before it
+    """
+
+    def __init__(self, directory, filename="index.bin", manifest=None):
+        self.directory = directory
+        if manifest is None:
+            manifest = load_manifest(directory)
+        self.has_positions = manifest.get("positions", False)
+        self.segments = []
+        self.num_documents = 0
+        self.num_docs = 0
+        for info in manifest["segments"]:
+            index = BinaryIndex(os.path.join(directory, info["name"], filename))
+            deleted = {
+                index.doc_ids[doc_key]
+                for doc_key in info["deleted"]
+                if doc_key in index.doc_ids
+            }
+            self.segments.append(Segment(index, self.num_docs, deleted))
+            self.num_documents += index.num_documents
+            self.num_docs += index.num_docs
+        self.bases = [segment.base for segment in self.segments]
+
+    def close(self):
+        for segment in self.segments:
+            segment.index.close()
+
+    def document_frequency(self, term):
+        """Sums the document frequency of a term over the segments, counting deleted documents until they are merged"""
+        return sum(segment.index.document_frequency(term) for segment in self.segments)
+
+    def segment(self, doc_id):
+        return self.segments[bisect_right(self.bases, doc_id) - 1]
+
+    def doc_id(self, doc_key):
+        """Returns the global doc id of the live copy of a document"""
+        for segment in reversed(self.segments):
+            doc_id = segment.index.doc_ids.get(doc_key)
+            if doc_id is not None and doc_id not in segment.deleted:
+                return segment.base + doc_id
+        raise KeyError(doc_key)
+
+    def doc_key(self, doc_id):
+        segment = self.segment(doc_id)
+        return segment.index.doc_key(doc_id - segment.base)
+
+    def __contains__(self, term):
+        return any(term in segment.index for segment in self.segments)
+
+
+class SegmentedDocStore:
+    """
+    Reader for the document stores of every segment listed in a manifest, addressed by the global doc ids of a
+    SegmentedIndex
+    """
+
+    def __init__(self, directory, manifest=None):
+        if manifest is None:
+            manifest = load_manifest(directory)
+        self.stores = []
+        self.bases = []
+        num_docs = 0
+        for info in manifest["segments"]:
+            store = DocStore(os.path.join(directory, info["name"], "docstore.bin"))
+            self.stores.append(store)
+            self.bases.append(num_docs)
+            num_docs += store.num_docs
+
+    def close(self):
+        for store in self.stores:
+            store.close()
+
+    def store(self, doc_id):
+        i = bisect_right(self.bases, doc_id) - 1
+        return self.stores[i], doc_id - self.bases[i]
+
+    def url(self, doc_id):
+        store, doc_id = self.store(doc_id)
+        return store.url(doc_id)
+
+    def snippet(self, doc_id, terms):
+        store, doc_id = self.store(doc_id)
+        return store.snippet(doc_id, terms)
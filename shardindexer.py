@@ -0,0 +1,85 @@
+from binaryindex import BinaryIndex
+from segmentindexer import allocate_segment, merge_segments
+from segments import load_manifest, save_manifest, locked
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import os
+import shutil
+import timeit
+
+
+def build_shard(output, shard, num_shards, tier_size=None):
+    """
+    Builds one shard at output from the full build in the working directory, with the documents whose doc id is
+    shard modulo num_shards. Returns the number of documents of the shard
+    """
+    index = BinaryIndex("index.bin")
+    doc_keys = index.doc_keys
+    index.close()
+    deleted = set(doc_keys).difference(doc_keys[shard::num_shards])
+    return merge_segments(["."], [deleted], output, tier_size, collection=".")
+
+
+def split_index(directory, num_shards, tier_size=None, workers=1):
+    """
+    Partitions the documents of the index.bin, index2.bin and docstore.bin of a full build into num_shards shards,
+    replacing the shards the directory held before. Documents are dealt out in doc id order, so every shard holds
+    about as many documents of every folder. A build whose index.bin has positions needs no index2.bin
+    """
+    index = BinaryIndex("index.bin")
+    positions = index.has_positions
+    index.close()
+    with locked(directory):
+        manifest = load_manifest(directory)
+        names = [allocate_segment(directory, manifest) for _ in range(num_shards)]
+    with ProcessPoolExecutor(workers) as executor:
+        num_docs = list(
+            executor.map(
+                build_shard,
+                [os.path.join(directory, name) for name in names],
+                range(num_shards),
+                [num_shards] * num_shards,
+                [tier_size] * num_shards,
+            )
+        )
+    with locked(directory):
+        manifest = load_manifest(directory)
+        replaced = manifest["segments"]
+        manifest["positions"] = positions
+        manifest["segments"] = [
+            {"name": name, "num_docs": shard_docs, "deleted": []}
+            for name, shard_docs in zip(names, num_docs)
+        ]
+        save_manifest(directory, manifest)
+    for info in replaced:
+        shutil.rmtree(os.path.join(directory, info["name"]), ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Split the index.bin, index2.bin and docstore.bin of a full build into shards"
+    )
+    parser.add_argument(
+        "--dir",
+        default="shards",
+        help="directory holding the shards and their manifest",
+    )
+    parser.add_argument(
+        "--shards", type=int, required=True, help="number of shards to build"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes building shards in parallel",
+    )
+    parser.add_argument(
+        "--tier-size",
+        type=int,
+        help="split postings lists longer than this into a high and a low impact tier",
+    )
+    args = parser.parse_args()
+    start = timeit.default_timer()
+    split_index(args.dir, args.shards, args.tier_size, args.workers)
+    stop = timeit.default_timer()
+    print("Time: ", stop - start, "seconds")
@@ -0,0 +1,155 @@
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+import argparse
+import logging
+import os
+import threading
+from binaryindex import BinaryIndex
+from segments import SegmentedIndex, load_manifest
+
+logger = logging.getLogger(__name__)
+
+# A sharded index is a directory in the manifest format of segments.py whose segments are shards: partitions of the
+# documents of a full build made by shardindexer.py. Their document lengths are computed with the statistics of the
+# whole collection and the idf is applied at query time from the document frequencies of all the shards, so the
+# shards rank exactly like the full build. Shards have no deleted documents: a new build replaces them all.
+#
+# Queries are scattered to the shards and gathered back either on a pool of worker processes, each opening every
+# shard it is sent once and sharing the pages of the shard files with the others, or on shard servers:
+#
+#   SHARD_AUTHKEY=... python shards.py serve shards/seg000000 --port 7000
+
+# Environment variable holding the key shard servers and coordinators authenticate each other with. The messages are
+# pickled, so whoever knows the key can run code on a server: there is no default key, and servers do not start
+# without one
+AUTHKEY_VARIABLE = "SHARD_AUTHKEY"
+
+# The (signature, index, bigramsIndex) of every shard this process opened, by path
+open_shards = {}
+open_lock = threading.Lock()
+
+
+def authkey():
+    key = os.environ.get(AUTHKEY_VARIABLE)
+    if not key:
+        raise ValueError(
+            f"Set {AUTHKEY_VARIABLE} to a secret shared by the shard servers and retrieve.py"
+        )
+    return key.encode()
+
+
+def shard_signature(path):
+    """Identifies the files of a shard, so processes reopen a shard whose files were replaced by a new build"""
+    stat = os.stat(os.path.join(path, "index.bin"))
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def open_shard(path, signature):
+    """Returns the index and bigram index of a shard, opening them once per process"""
+    with open_lock:
+        opened = open_shards.get(path)
+        if opened is None or opened[0] != signature:
+            index = BinaryIndex(os.path.join(path, "index.bin"))
+            bigramsIndex = None
+            if not index.has_positions:
+                bigramsIndex = BinaryIndex(os.path.join(path, "index2.bin"))
+            opened = (signature, index, bigramsIndex)
+            open_shards[path] = opened
+        return opened[1], opened[2]
+
+
+def run_on_shard(path, signature, function, *args):
+    """Returns function(index, bigramsIndex, *args) for a shard, in the worker process or server it is run on"""
+    index, bigramsIndex = open_shard(path, signature)
+    return function(index, bigramsIndex, *args)
+
+
+class ShardedIndex(SegmentedIndex):
+    """
+    Coordinator of a sharded index. It reads the doc keys and counts of the shards like a SegmentedIndex, while the
+    shards are searched by scatter(), either on the worker processes of executor or on the shard servers at addresses,
+    one (host, port) per shard in manifest order
+    """
+
+    def __init__(self, directory, manifest=None, executor=None, addresses=None):
+        if manifest is None:
+            manifest = load_manifest(directory)
+        super().__init__(directory, "index.bin", manifest)
+        self.paths = [
+            os.path.join(directory, info["name"]) for info in manifest["segments"]
+        ]
+        self.signatures = [shard_signature(path) for path in self.paths]
+        if addresses and len(addresses) != len(self.paths):
+            raise ValueError(
+                f"{len(self.paths)} shards need as many servers, not {len(addresses)}"
+            )
+        self.executor = executor
+        self.addresses = addresses
+        self.authkey = authkey() if addresses else None
+
+    def scatter(self, function, *args):
+        """
+        Runs function(index, bigramsIndex, *args) on every shard at once, returning the results in shard order. The
+        function has to be a module level function, as it is pickled
+        """
+        if self.addresses:
+            connections = [
+                Client(tuple(address), authkey=self.authkey)
+                for address in self.addresses
+            ]
+            for connection in connections:
+                connection.send((function, args))
+            results = []
+            for connection in connections:
+                with connection:
+                    results.append(connection.recv())
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+            return results
+        futures = [
+            self.executor.submit(run_on_shard, path, signature, function, *args)
+            for path, signature in zip(self.paths, self.signatures)
+        ]
+        return [future.result() for future in futures]
+
+
+def handle(path, connection):
+    with connection:
+        function, args = connection.recv()
+        try:
+            result = run_on_shard(path, shard_signature(path), function, *args)
+        except Exception as error:
+            result = error
+        connection.send(result)
+
+
+def serve(path, address):
+    """Serves one shard to coordinators, answering every connection on its own thread"""
+    with Listener(address, authkey=authkey()) as listener:
+        while True:
+            try:
+                connection = listener.accept()
+            except (AuthenticationError, EOFError, OSError) as error:
+                # A client that fails the authentication or hangs up during it is dropped
+                logger.warning("Dropped a shard client: %s", error)
+                continue
+            threading.Thread(
+                target=handle, args=(path, connection), daemon=True
+            ).start()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser(
+        "serve", help="serve one shard to the coordinator in retrieve.py"
+    )
+    serve_parser.add_argument("shard", help="directory of the shard")
+    serve_parser.add_argument("--host", default="localhost")
+    serve_parser.add_argument("--port", type=int, required=True)
+    args = parser.parse_args()
+    try:
+        serve(args.shard, (args.host, args.port))
+    except ValueError as error:
+        parser.error(str(error))
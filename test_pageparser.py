@@ -0,0 +1,54 @@
+import pytest
+import pageparser
+from pageparser import parse_html
+
+bs4 = pytest.importorskip("bs4")
+
+TAGS = ["title", "h1", "h2", "a", "h3", "b"]
+
+PAGES = [
+    "<p>foo<!-- c -->bar</p>",
+    "<p>foo<?php echo 1 ?>bar</p>",
+    '<a href="x">foo<b>bar</b></a>',
+    "<b>one <b>two</b></b> three",
+    "<p>AT&amp;T caf&eacute; &lt;tag&gt;</p>",
+    '<!DOCTYPE html><html><head><title> T &amp; c </title><script>var x = "<b>no</b>";</script>'
+    "<style>p { color: red }</style></head><body><h1>Head <a href='/a'>link</a></h1>"
+    "<h2>Sub<br>title</h2><h3>three</h3><a>no href</a></body></html>",
+    "<title>first</title><title>second</title><p>text</p>",
+]
+
+# lxml is checked as well as the standard library parser when it is installed
+BACKENDS = [None] + ([pageparser.etree] if pageparser.etree is not None else [])
+
+
+def soup_page(content):
+    """Returns what the crawler and the indexer took from a page when they parsed it with BeautifulSoup"""
+    soup = bs4.BeautifulSoup(content, "html.parser")
+    title = soup.find("title")
+    return (
+        soup.get_text(separator=" ").split(),
+        title.text.strip() if title else "",
+        {tag: [element.text for element in soup.find_all(tag)] for tag in TAGS},
+        [link.get("href") for link in soup.find_all("a") if link.get("href") is not None],
+    )
+
+
+@pytest.mark.parametrize("backend", BACKENDS, ids=["html.parser", "lxml"][: len(BACKENDS)])
+@pytest.mark.parametrize("content", PAGES)
+def test_parse_html_matches_beautifulsoup(monkeypatch, backend, content):
+    monkeypatch.setattr(pageparser, "etree", backend)
+    page = parse_html(content, TAGS)
+    assert (page.text.split(), page.title, page.tag_text, page.links) == soup_page(content)
+
+
+def test_links_are_made_absolute():
+    page = parse_html(
+        b'<a href="/x">x</a><a href="y#top">y</a><a href="http://[::1">bad</a>',
+        base_url="http://www.ics.uci.edu/dir/",
+    )
+    assert page.links == ["http://www.ics.uci.edu/x", "http://www.ics.uci.edu/dir/y#top"]
+
+
+def test_bytes_that_are_not_utf8_are_read_as_windows_1252():
+    assert parse_html("<p>café</p>".encode("cp1252")).text == "café"
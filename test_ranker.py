@@ -0,0 +1,132 @@
+import contextlib
+import io
+import math
+import os
+from collections import defaultdict
+import pytest
+
+pytest.importorskip("nltk")
+
+from binaryindex import BinaryIndex
+from combinedindexer import CombinedIndexer
+from ranker import Ranker
+from tokenizer import analyze_query
+
+# Most pages are a single word and hold no bigram, so the bigram index counts far fewer documents than the collection
+PAGES = {
+    "0/0": "<p>research research graphics graphics</p>",
+    "0/1": "<p>informatics research data data informatics</p>",
+    "0/2": "<p>research graphics</p>",
+    "0/3": "<p>informatics</p>",
+    "0/4": "<p>graphics</p>",
+    "0/5": "<p>informatics</p>",
+    "0/6": "<p>graphics</p>",
+    "0/7": "<p>graphics</p>",
+    "0/8": "<p>data</p>",
+    "0/9": "<p>data</p>",
+    "0/10": "<p>graphics</p>",
+    "0/11": "<p>graphics</p>",
+    "0/12": "<p>graphics</p>",
+    "0/13": "<p>informatics</p>",
+}
+
+
+@pytest.fixture
+def indexes(tmp_path):
+    for doc_key, content in PAGES.items():
+        os.makedirs(tmp_path / os.path.dirname(doc_key), exist_ok=True)
+        (tmp_path / doc_key).write_text(content, encoding="utf-8")
+    indexer = CombinedIndexer(str(tmp_path))
+    with contextlib.redirect_stdout(io.StringIO()):
+        indexer.index_files(list(PAGES))
+    indexer.calculate_weights()
+    indexer.get_unigrams().save_binary(str(tmp_path / "index.bin"))
+    indexer.get_bigrams().save_binary(str(tmp_path / "index2.bin"))
+    index = BinaryIndex(str(tmp_path / "index.bin"))
+    bigramsIndex = BinaryIndex(str(tmp_path / "index2.bin"))
+    yield index, bigramsIndex
+    index.close()
+    bigramsIndex.close()
+
+
+def exhaustive_ranking(index, bigramsIndex, query, bigram_num_documents):
+    """Scores every posting of the query like the original Ranker, weighting bigrams against bigram_num_documents"""
+    terms = list(analyze_query(query))
+    scores = defaultdict(float)
+    bigram_scores = defaultdict(float)
+    for term in dict.fromkeys(terms):
+        doc_ids, _, weights = index.postings(term)
+        for doc_id, weight in zip(doc_ids, weights):
+            scores[doc_id] += math.log(index.num_documents / len(doc_ids)) * weight
+    for bigram in dict.fromkeys(map(" ".join, zip(terms[:-1], terms[1:]))):
+        doc_ids, _, weights = bigramsIndex.postings(bigram)
+        for doc_id, weight in zip(doc_ids, weights):
+            idf = bigram_num_documents / len(doc_ids)
+            bigram_scores[doc_id] += math.log(idf) * weight
+    for doc_id in scores:
+        scores[doc_id] /= index.length(doc_id)
+        if doc_id in bigram_scores:
+            scores[doc_id] += bigram_scores[doc_id] / bigramsIndex.length(doc_id)
+    return sorted(scores, key=lambda doc_id: (-scores[doc_id], doc_id))
+
+
+def test_bigrams_are_weighted_against_the_collection_size(indexes):
+    index, bigramsIndex = indexes
+    query = "informatics research"
+    expected = exhaustive_ranking(index, bigramsIndex, query, index.num_documents)
+    # The bigram index's own document count would rank the query differently
+    assert bigramsIndex.num_documents < index.num_documents
+    assert expected != exhaustive_ranking(
+        index, bigramsIndex, query, bigramsIndex.num_documents
+    )
+
+    rankers = [Ranker()]
+    try:
+        from numpyranker import NumpyRanker
+
+        rankers.append(NumpyRanker())
+    except ImportError:
+        pass
+    for ranker in rankers:
+        ranked = ranker.rankDocuments(index, bigramsIndex, query, len(PAGES))
+        assert list(ranked.doc_ids) == expected
+
+
+def test_proximities_are_only_decoded_for_the_scored_documents(tmp_path, monkeypatch):
+    pytest.importorskip("numpy")
+    import binaryindex
+    from numpyranker import NumpyRanker
+
+    pages = {f"0/{i}": "<p>informatics students research</p>" for i in range(40)}
+    pages.update(
+        {
+            f"0/{i}": f"<p>informatics {'x ' * i}research seminar</p>"
+            for i in range(40, 44)
+        }
+    )
+    for doc_key, content in pages.items():
+        os.makedirs(tmp_path / os.path.dirname(doc_key), exist_ok=True)
+        (tmp_path / doc_key).write_text(content, encoding="utf-8")
+    indexer = CombinedIndexer(str(tmp_path), positions=True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        indexer.index_files(list(pages))
+    indexer.calculate_weights()
+    indexer.get_unigrams().save_binary(str(tmp_path / "index.bin"))
+    index = BinaryIndex(str(tmp_path / "index.bin"))
+
+    decoded = []
+    decode_positions = binaryindex.decode_positions
+
+    def counted(buffer, pos, end):
+        decoded.append(pos)
+        return decode_positions(buffer, pos, end)
+
+    query = "+seminar informatics research"
+    expected = NumpyRanker().rankDocuments(index, None, query, 10).doc_ids
+    monkeypatch.setattr(binaryindex, "decode_positions", counted)
+    ranked = Ranker().rankDocuments(index, None, query, 10)
+    index.close()
+    assert list(ranked.doc_ids) == expected
+    # Only the 4 documents holding the required term are scored, so the positions of the two terms of both pairs are
+    # read for those alone rather than for every document holding informatics and research
+    assert len(decoded) <= 2 * 2 * 4
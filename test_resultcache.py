@@ -0,0 +1,28 @@
+from resultcache import ResultCache
+
+
+def test_queries_are_returned_as_they_were_put():
+    cache = ResultCache(2**20, normalize=lambda query: repr(query.lower().split()))
+    cache.put("Machine  Learning", ["a"])
+    cache.put("informatics", ["b"])
+    cache.get("machine learning")
+    assert cache.queries(2) == ["Machine  Learning", "informatics"]
+
+
+def test_warming_from_queries_fills_the_same_keys():
+    normalize = lambda query: repr(query.lower().split())
+    old = ResultCache(2**20, normalize=normalize)
+    old.put("Machine Learning", ["a"])
+    new = ResultCache(2**20, normalize=normalize)
+    for query in old.queries(10):
+        new.put(query, ["a"])
+    assert new.get("machine learning") == ["a"]
+
+
+def test_evicted_entries_are_not_returned():
+    cache = ResultCache(2**20)
+    cache.put("one", ["a"])
+    cache.max_bytes = cache.size
+    cache.put("two", ["b"])
+    assert cache.get("one") is None
+    assert cache.queries(10) == ["two"]
@@ -0,0 +1,105 @@
+import contextlib
+import importlib
+import io
+import json
+import os
+import socket
+import sys
+import threading
+import pytest
+
+pytest.importorskip("nltk")
+pytest.importorskip("flask")
+
+from binaryindex import BinaryIndex
+from combinedindexer import CombinedIndexer
+from docstore import DocStore
+from ranker import Ranker
+from shardindexer import split_index
+import shards
+
+PAGES = {
+    "0/0": "<title>Graphics</title><p>computer graphics rendering shaders</p>",
+    "0/1": "<title>Learning</title><p>machine learning neural networks</p>",
+    "0/2": "<title>Databases</title><p>database systems query processing</p>",
+    "0/3": "<title>Research</title><p>informatics students research</p>",
+    "0/4": "<title>Seminar</title><p>informatics students research seminar</p>",
+    "0/5": "<title>Vision</title><p>computer vision research</p>",
+    "0/6": "<title>Systems</title><p>computer systems students</p>",
+}
+QUERIES = ["informatics", "students research", "computer", "machine learning"]
+
+
+@pytest.fixture
+def sharded_build(tmp_path, monkeypatch):
+    """A full build split into 3 shards in the working directory, with retrieve.py loaded on it"""
+    pages = tmp_path / "pages"
+    for doc_key, content in PAGES.items():
+        os.makedirs(pages / os.path.dirname(doc_key), exist_ok=True)
+        (pages / doc_key).write_text(content, encoding="utf-8")
+    bookkeeping = {doc_key: f"www.ics.uci.edu/{doc_key}" for doc_key in PAGES}
+    (pages / "bookkeeping.json").write_text(json.dumps(bookkeeping))
+    monkeypatch.chdir(tmp_path)
+    indexer = CombinedIndexer(str(pages), store_documents=True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        indexer.index_files(list(PAGES))
+    indexer.calculate_weights()
+    indexer.save_docstore("docstore.bin")
+    indexer.get_unigrams().save_binary("index.bin")
+    indexer.get_bigrams().save_binary("index2.bin")
+    split_index("shards", 3)
+
+    sys.modules.pop("retrieve", None)
+    retrieve = importlib.import_module("retrieve")
+    yield retrieve
+    if retrieve.shardExecutor is not None:
+        retrieve.shardExecutor.shutdown()
+    sys.modules.pop("retrieve", None)
+
+
+def full_build_urls(query):
+    index = BinaryIndex("index.bin")
+    bigramsIndex = BinaryIndex("index2.bin")
+    docstore = DocStore("docstore.bin")
+    ranked = Ranker().rankDocuments(index, bigramsIndex, query, len(PAGES))
+    urls = [docstore.url(doc_id) for doc_id in ranked.doc_ids]
+    index.close()
+    bigramsIndex.close()
+    return urls
+
+
+def served_urls(retrieve, query):
+    response = retrieve.app.test_client().get("/", query_string={"search": query})
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+    urls = [url for url in full_build_urls(query) if f'href="//{url}"' in html]
+    return sorted(urls, key=lambda url: html.index(f'href="//{url}"'))
+
+
+def test_sharded_build_is_served_on_worker_processes(sharded_build):
+    retrieve = sharded_build
+    assert isinstance(retrieve.generations.current.index, shards.ShardedIndex)
+    assert retrieve.shardExecutor is not None
+    for query in QUERIES:
+        assert full_build_urls(query)
+        assert served_urls(retrieve, query) == full_build_urls(query)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def test_sharded_build_is_served_on_shard_servers(sharded_build, monkeypatch):
+    retrieve = sharded_build
+    monkeypatch.setenv(shards.AUTHKEY_VARIABLE, "secret")
+    index = retrieve.generations.current.index
+    addresses = [("localhost", free_port()) for _ in index.paths]
+    for path, address in zip(index.paths, addresses):
+        threading.Thread(target=shards.serve, args=(path, address), daemon=True).start()
+    monkeypatch.setattr(retrieve, "SHARD_SERVERS", addresses)
+    monkeypatch.setattr(retrieve.generations, "current", retrieve.loadGeneration())
+    assert retrieve.generations.current.index.addresses == addresses
+    for query in QUERIES:
+        assert served_urls(retrieve, query) == full_build_urls(query)
@@ -0,0 +1,56 @@
+import math
+import os
+import pytest
+
+pytest.importorskip("nltk")
+
+from ranker import Ranker
+from segmentindexer import add_documents, compact
+from segments import SegmentedIndex, load_manifest
+
+PAGES = {
+    "0/0": "<title>Graphics</title><p>computer graphics rendering shaders</p>",
+    "0/1": "<title>Learning</title><p>machine learning neural networks</p>",
+    "0/2": "<title>Databases</title><p>database systems query processing</p>",
+    "0/3": "<p>informatics students research</p>",
+    "0/4": "<p>informatics students research seminar</p>",
+}
+QUERIES = ["informatics", "students research", "seminar", "machine learning", "computer"]
+
+
+def ranking(directory):
+    index = SegmentedIndex(directory, "index.bin")
+    bigrams = SegmentedIndex(directory, "index2.bin")
+    results = {}
+    for query in QUERIES:
+        ranked = Ranker().rankDocuments(index, bigrams, query, 10)
+        results[query] = [index.doc_key(doc_id) for doc_id in ranked.doc_ids]
+    lengths = [
+        segment.index.length(doc_id)
+        for segment in index.segments
+        for doc_id in range(segment.index.num_docs)
+    ]
+    index.close()
+    bigrams.close()
+    return results, lengths
+
+
+def test_compacted_segments_rank_the_same(tmp_path):
+    pages = tmp_path / "pages"
+    for doc_key, content in PAGES.items():
+        os.makedirs(pages / os.path.dirname(doc_key), exist_ok=True)
+        (pages / doc_key).write_text(content, encoding="utf-8")
+    directory = str(tmp_path / "segments")
+    add_documents(directory, str(pages), ["0/0", "0/1", "0/2"])
+    add_documents(directory, str(pages), ["0/3"])
+    add_documents(directory, str(pages), ["0/4"])
+    before, _ = ranking(directory)
+
+    # The two small segments share every word but one, so the statistics of the merged run alone would give the
+    # first of them no length at all
+    assert compact(directory, max_segments=2)
+    assert len(load_manifest(directory)["segments"]) == 2
+    after, lengths = ranking(directory)
+
+    assert after == before
+    assert not any(math.isnan(length) for length in lengths)
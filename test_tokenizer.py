@@ -0,0 +1,40 @@
+import pytest
+
+pytest.importorskip("nltk")
+
+from tokenizer import LemmaCache
+
+
+def test_added_entries_are_merged_into_another_cache():
+    worker = LemmaCache()
+    worker.put(("loaded", "v"), "load")
+    added = worker.added
+    worker.put(("running", "v"), "run")
+    worker.put(("mice", "n"), "mouse")
+    assert worker.added_since(added) == [(("running", "v"), "run"), (("mice", "n"), "mouse")]
+
+    parent = LemmaCache()
+    parent.put(("mice", "n"), "mouse")
+    parent.update(worker.added_since(added))
+    assert parent.lemmas == {("mice", "n"): "mouse", ("running", "v"): "run"}
+
+
+def test_evicted_entries_are_not_returned():
+    cache = LemmaCache(max_size=2)
+    for word in ["a", "b", "c"]:
+        cache.put((word, "n"), word)
+    assert cache.added_since(0) == [(("b", "n"), "b"), (("c", "n"), "c")]
+
+
+def test_loading_keeps_the_newest_entries(tmp_path):
+    path = str(tmp_path / "lemmas.pickle")
+    saved = LemmaCache(max_size=10)
+    for word in "abcdefghij":
+        saved.put((word, "n"), word)
+    saved.save(path)
+
+    cache = LemmaCache(max_size=3)
+    cache.load(path)
+    assert list(cache.lemmas) == [("h", "n"), ("i", "n"), ("j", "n")]
+    cache.put(("k", "n"), "k")
+    assert len(cache) == 3
@@ -1,37 +1,222 @@
-from nltk.tag import pos_tag
+from nltk.tag import pos_tag, pos_tag_sents
 from nltk.stem import WordNetLemmatizer
 from nltk.corpus import stopwords
+from nltk.tokenize import word_tokenize
 from collections import Counter
+from collections.abc import Iterable, Iterator
+from functools import lru_cache
+from itertools import chain, islice
+from typing import NamedTuple
+import os
+import pickle
+import re
 
 stopwords_set = set(stopwords.words("english"))
 
+# Runs of ASCII alphanumeric characters in a lowercased word, the pieces a token is made of
+alphanumeric_runs = re.compile(r"[a-z0-9]+")
+
+# Dictionary with each nltk identifiable part of speech, and its corresponding 'pos' tag.
+# The 'pos' tag will be used as a paramater in the WordNetLemmatizer.lemmatize() function
+# to identify what part of speech the given token is for the greatest lemmatization accuracy.
+# Any other part of speech is lemmatized as a noun, the WordNetLemmatizer default.
+# -------------------------------------------------------------------------------------------
+# n noun
+# v verb
+# a adjective
+# r adverb
+parts_of_speech = {
+    "JJ": "a",
+    "JJR": "a",
+    "JJS": "a",
+    "NN": "n",
+    "NNP": "n",
+    "NNS": "n",
+    "RB": "r",
+    "RBR": "r",
+    "RBS": "r",
+    "VBG": "v",
+    "VB": "v",
+    "VBD": "v",
+    "VBN": "v",
+    "VBP": "v",
+    "VBZ": "v",
+}
+
+lemmatizer = WordNetLemmatizer()
+
+
+class LemmaCache:
+    """
+    Bounded memo of (word, pos) -> lemma in front of the WordNetLemmatizer. The corpus vocabulary repeats heavily, so
+    almost every lookup is a hit; once max_size entries are cached the oldest ones are evicted. The memo can be saved
+    and loaded so later indexer runs start warm. Worker processes hand the entries they added back with added_since, for
+    the parent process to merge with update
+    """
+
+    def __init__(self, max_size=1_000_000):
+        self.max_size = max_size
+        self.lemmas = {}
+        # Number of entries ever added, which added_since counts from
+        self.added = 0
+
+    def lemma(self, word: str, pos: str) -> str:
+        key = (word, pos)
+        lemma = self.lemmas.get(key)
+        if lemma is None:
+            lemma = lemmatizer.lemmatize(word, pos=pos)
+            self.put(key, lemma)
+        return lemma
+
+    def put(self, key: tuple[str, str], lemma: str):
+        if len(self.lemmas) >= self.max_size:
+            # pop rather than del, as two threads can evict the same oldest entry
+            self.lemmas.pop(next(iter(self.lemmas)), None)
+        self.lemmas[key] = lemma
+        self.added += 1
+
+    def added_since(self, added: int) -> list[tuple[tuple[str, str], str]]:
+        """
+        Returns the (key, lemma) entries added since self.added was added, oldest first. Entries are added at the end
+        and evicted from the front, so they are the newest entries, less the ones already evicted
+        """
+        count = min(self.added - added, len(self.lemmas))
+        return list(islice(reversed(self.lemmas.items()), count))[::-1]
+
+    def update(self, entries: Iterable[tuple[tuple[str, str], str]]):
+        """Adds the entries that are not cached yet, such as the ones a worker process added to its copy of the cache"""
+        for key, lemma in entries:
+            if key not in self.lemmas:
+                self.put(key, lemma)
+
+    def load(self, path: str):
+        """Adds the entries of a saved cache, keeping the newest max_size ones if it was saved with a larger bound"""
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                self.lemmas.update(pickle.load(f))
+            excess = len(self.lemmas) - self.max_size
+            if excess > 0:
+                self.lemmas = dict(islice(self.lemmas.items(), excess, None))
+
+    def save(self, path: str):
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(self.lemmas, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+    def __len__(self):
+        return len(self.lemmas)
+
+
+lemma_cache = LemmaCache()
+
 
 def tokenize(words: list[str]) -> list[str]:
+    return list(iter_tokens(words))
+
+
+def iter_tokens(words: Iterable[str]) -> Iterator[str]:
+    """Lazily yields the tokens of a word list, so callers can count or index them without building a token list"""
+    for w in lemmatize(list(words)):
+        yield from split_token(w)
+
+
+def tokenize_batch(documents: list[list[str]]) -> list[list[str]]:
+    """Tokenizes many word lists at once, tagging all of them in a single pos_tag_sents call"""
+    return [
+        list(chain.from_iterable(map(split_token, lemmatized_words)))
+        for lemmatized_words in lemmatize_batch(documents)
+    ]
+
+
+def split_token(w: str) -> Iterator[str]:
+    """Yields the valid tokens of a lemmatized word: its lowercased runs of ASCII letters and digits"""
+    w = w.lower()
+    if w.isalnum() and w.isascii():
+        if is_valid_token(w):
+            yield w
+        return
+    for token in alphanumeric_runs.findall(w):
+        if is_valid_token(token):
+            yield token
+
+
+@lru_cache(maxsize=4096)
+def analyze_query(query: str) -> tuple[str, ...]:
+    # Applies the same normalization as tokenize(), but lemmatizes every query word on its own through the cached
+    # lemma table instead of tagging the whole query, so repeated words and queries cost a dictionary lookup.
+    tokens = []
+    for w in word_tokenize(query):
+        tokens += split_token(lemmatize_word(w))
+    return tuple(tokens)
+
+
+class ParsedQuery(NamedTuple):
+    """
+    A query analyzed into its tokens, the tokens of its "quoted phrases", its +required tokens and the tokens of each
+    of its -excluded words and -"excluded phrases", which are left out of the tokens
+    """
+
+    tokens: tuple[str, ...]
+    phrases: tuple[tuple[str, ...], ...]
+    required: tuple[str, ...]
+    excluded: tuple[tuple[str, ...], ...]
+
+
+@lru_cache(maxsize=4096)
+def parse_query(query: str) -> ParsedQuery:
+    """
+    Parses the operators of a query. A quote that is never closed is ignored, and so are phrases of a single token,
+    which match like any other query word
+    """
+    parts = query.split('"')
     tokens = []
-    lemmatized_words = lemmatize(words)
-
-    for w in lemmatized_words:
-        w = w.lower()
-        if w.isalnum() and w.isascii() and is_valid_token(w):
-            tokens.append(w)
-        else:
-            curr_word = ""
-            for l in w:
-                if l.isalnum() and l.isascii():
-                    curr_word += l
-                else:
-                    if is_valid_token(curr_word):
-                        tokens.append(curr_word)
-                    curr_word = ""
-            if is_valid_token(curr_word):
-                tokens.append(curr_word)
-    return tokens
+    phrases = []
+    required = []
+    excluded = []
+    exclude_phrase = False
+    for i, part in enumerate(parts):
+        if i % 2 == 1 and i < len(parts) - 1:
+            part_tokens = analyze_query(part)
+            if exclude_phrase:
+                if part_tokens:
+                    excluded.append(part_tokens)
+                continue
+            tokens += part_tokens
+            if len(part_tokens) > 1:
+                phrases.append(part_tokens)
+            continue
+        words = part.split()
+        for word in words:
+            if len(word) > 1 and word[0] == "+":
+                word_tokens = analyze_query(word[1:])
+                tokens += word_tokens
+                required += word_tokens
+            elif len(word) > 1 and word[0] == "-":
+                word_tokens = analyze_query(word[1:])
+                if word_tokens:
+                    excluded.append(word_tokens)
+            else:
+                tokens += analyze_query(word)
+        # A lone minus right before a quote excludes the phrase
+        exclude_phrase = part.endswith("-") and words[-1] == "-"
+    return ParsedQuery(
+        tuple(tokens), tuple(phrases), tuple(required), tuple(excluded)
+    )
+
+
+@lru_cache(maxsize=65536)
+def lemmatize_word(word: str) -> str:
+    return lemmatize([word])[0]
 
 
 def compute_word_frequencies(
-    tokens: list[str], frequencies: dict[str, int] = {}
+    tokens: Iterable[str], frequencies: dict[str, int] | None = None
 ) -> dict[str, int]:
-    frequencies = Counter(tokens)
+    """Counts the tokens, adding them to frequencies in place if it is given"""
+    if frequencies is None:
+        return Counter(tokens)
+    for token in tokens:
+        frequencies[token] = frequencies.get(token, 0) + 1
     return frequencies
 
 
@@ -43,7 +228,7 @@ def print_frequencies(frequencies: dict[str, int]):
 
 
 def is_valid_token(token: str) -> bool:
-    return not is_stop_word(token) and len(token) > 1
+    return len(token) > 1 and not is_stop_word(token)
 
 
 def is_stop_word(word: str) -> bool:
@@ -51,40 +236,14 @@ def is_stop_word(word: str) -> bool:
 
 
 def lemmatize(tokens: list[str]) -> list[str]:
-    # Dictionary with each nltk identifiable part of speech, and its corresponding 'pos' tag.
-    # The 'pos' tag will be used as a paramater in the WordNetLemmatizer.lemmatize() function
-    # to identify what part of speech the given token is for the greatest lemmatization accuracy.
-    # -------------------------------------------------------------------------------------------
-    # n noun
-    # v verb
-    # a adjective
-    # r adverb
-    lemmatized_tokens = []
-    l = WordNetLemmatizer()
-    parts_of_speech = {
-        "JJ": "a",
-        "JJR": "a",
-        "JJS": "a",
-        "NN": "n",
-        "NNP": "n",
-        "NNS": "n",
-        "RB": "r",
-        "RBR": "r",
-        "RBS": "r",
-        "VBG": "v",
-        "VB": "v",
-        "VBD": "v",
-        "VBG": "v",
-        "VBN": "v",
-        "VBP": "v",
-        "VBZ": "v",
-    }
-
-    for w in pos_tag(tokens):
-        if w[1] in parts_of_speech:
-            word = l.lemmatize(w[0], pos=parts_of_speech[w[1]])
-            lemmatized_tokens.append(word)
-        else:
-            word = l.lemmatize(w[0])
-            lemmatized_tokens.append(word)
-    return lemmatized_tokens
+    return [
+        lemma_cache.lemma(word, parts_of_speech.get(tag, "n"))
+        for word, tag in pos_tag(tokens)
+    ]
+
+
+def lemmatize_batch(documents: list[list[str]]) -> list[list[str]]:
+    return [
+        [lemma_cache.lemma(word, parts_of_speech.get(tag, "n")) for word, tag in tagged]
+        for tagged in pos_tag_sents(documents)
+    ]